@@ -1,95 +1,140 @@
 from inspect import getargspec
+from weakref import WeakKeyDictionary, ref
+from collections import deque
+from heapq import heappush, heappop
+import logging
 
-debug = 5
-def Debug( msg, lvl = 1 ):
-	if lvl <= debug:
-		print msg
+from profiler import Profiler, default_timer
+
+logger = logging.getLogger("mathemagics")
+
+debug = 0 #verbosity: Debug messages above this level are dropped before being formatted (0: none)
+def SetDebug( lvl ):
+	"""Set the debug verbosity (see python main.py --help)"""
+	global debug
+	debug = lvl
+
+def DebugLevel():
+	return debug
+
+def Debug( msg, lvl = 1, *args ):
+	"""Log msg at the given verbosity level.  Any args are %-formatted into msg
+		only if the message is actually going to be output"""
+	if lvl <= debug and logger.isEnabledFor(logging.DEBUG):
+		logger.debug(msg, *args)
 
 #------------------------------------------------------------------------------
 class Event(object):
 	"""this is a superclass for any events that might be generated by an
-	object and sent to the EventManager"""
-	def __init__(self):
-		self.name = "Generic Event"
+	object and sent to the EventManager
+		name: description of the event (a class attribute, so events only carry their own data)
+		subjectAttrs: names of the attributes holding the evIDs of the actors
+			this event concerns (used to route it to listeners filtered on a subject)
+	Events are small and plentiful, so they declare their attributes in __slots__"""
+	__slots__ = ()
+	name = "Generic Event"
+	subjectAttrs = ()
 	def __str__(self):
 		return self.name
 
 class TickEvent(Event):
 	"""this event is triggered on each game tick"""
+	__slots__ = ('time', 'dtime')
+	name = "CPU Tick Event"
 	def __init__(self, time, dtime = 0):
-		self.name = "CPU Tick Event"
 		self.time = time
 		self.dtime = dtime
 	def __str__(self):
 		return "%s: at %d (delta %s)" % (self.name, self.time, self.dtime)
 
+class RenderEvent(Event):
+	"""this event is triggered when the display should be redrawn (the game may have ticked
+		several times since the last one, or not at all)"""
+	__slots__ = ('time',)
+	name = "Render Event"
+	def __init__(self, time):
+		self.time = time
+	def __str__(self):
+		return "%s: at %d" % (self.name, self.time)
+
 class QuitEvent(Event):
 	"""this event is triggered when the user chooses to quit the game"""
-	def __init__(self):
-		self.name = "Program Quit Event"
+	__slots__ = ()
+	name = "Program Quit Event"
+
+class ToggleProfilerEvent(Event):
+	"""this event is triggered when the user turns the profiler overlay on or off"""
+	__slots__ = ()
+	name = "Toggle Profiler Event"
 
 class GameStartedEvent(Event):
-	"""this event is triggered when a new game is started"""
-	def __init__(self, game):
-		self.name = "Game Started Event"
+	"""this event is triggered when a new game is started
+		seed: the game's random seed (a game started with the same seed plays out the same way)"""
+	__slots__ = ('game', 'seed')
+	name = "Game Started Event"
+	def __init__(self, game, seed=None):
 		self.game = game
+		self.seed = seed
 	def __str__(self):
-		return "%s for game %s" % (self.name, self.game)
+		return "%s for game %s (seed %s)" % (self.name, self.game, self.seed)
 
 class NextBattleEvent(Event):
 	"""This event is triggered when the player requests a new battle"""
-	def __init__(self):
-		self.name = "Next Battle Event"
+	__slots__ = ()
+	name = "Next Battle Event"
 	def __str__(self):
 		return self.name
 
 #------------------------------------------------------------------------------
 class SpawnEvent(Event):
 	"""Superclass for all events that indicate spawning of an actor"""
+	__slots__ = ('evID',)
+	name = "Spawn Event"
 	def __init__(self, evID):
-		self.name = "Spawn Event"
 		self.evID = evID
 	def __str__(self):
 		return "%s for Actor %s" % (self.name, self.evID)
 
 class SpawnHeroEvent(SpawnEvent):
 	"""this event is triggered when a hero spawns"""
-	def __init__(self, evID):
-		SpawnEvent.__init__(self, evID)
-		self.name = "Spawn Hero Event"
+	__slots__ = ()
+	name = "Spawn Hero Event"
 
 class SpawnEnemyEvent(SpawnEvent):
 	"""this event is triggered when an enemy spawns"""
-	def __init__(self, evID):
-		SpawnEvent.__init__(self, evID)
-		self.name = "Spawn Enemy Event"
+	__slots__ = ()
+	name = "Spawn Enemy Event"
 
 #------------------------------------------------------------------------------
 class AddProblemCategoryEvent(Event):
+	__slots__ = ('category',)
+	name = "Add Problem Category Event"
 	def __init__(self, category):
 		self.category = category
-		self.name = "Add Problem Category Event"
 	def __str__(self):
 		return "%s for category %s" % (self.name, self.category)
 
 class AddProblemTypeEvent(Event):
+	__slots__ = ('type',)
+	name = "Add Problem Type Event"
 	def __init__(self, type):
 		self.type = type
-		self.name = "Add Problem Type Event"
 	def __str__(self):
 		return "%s for type %s" % (self.name, self.type)
 
 class AddProblemLevelEvent(Event):
+	__slots__ = ('level',)
+	name = "Add Problem Level Event"
 	def __init__(self, level):
 		self.level = level
-		self.name = "Add Problem Level Event"
 	def __str__(self):
 		return "%s for level %s" % (self.name, self.level)
 
 class AddProblemEvent(Event):
+	__slots__ = ('problem',)
+	name = "Add Problem Event"
 	def __init__(self, problem):
 		self.problem = problem
-		self.name = "Add Problem Event"
 	def __str__(self):
 		return "%s for problem %s"
 	
@@ -97,71 +142,103 @@ class AddProblemEvent(Event):
 #------------------------------------------------------------------------------
 class RequestAttackEvent(Event):
 	"""this event is triggered when the player initiates an attack"""
-	def __init__(self):
-		self.name = "Request Attack Event"
+	__slots__ = ()
+	name = "Request Attack Event"
 
 class RequestSolutionEvent(Event):
 	"""this event is triggered when the system is ready for the solution to an attack"""
+	__slots__ = ('problem', 'endTime')
+	name = "Request Solution Event"
 	def __init__(self, problem, endTime):
-		self.name = "Request Solution Event"
 		self.problem = problem
 		self.endTime = endTime
 	def __str__(self):
 		return "%s problem %s with end time %s" % (self.name, self.problem, self.endTime)
 
 class SolutionUpdateEvent(Event):
-	"""this event is triggered with each keypress as the player types the solution for an attack"""
-	def __init__(self, solution):
-		self.name = "Solution Update Event"
+	"""this event is triggered with each keypress as the player types the solution for an attack
+		time: game time of the keypress (None if unknown)
+		wallTime: pygame.time.get_ticks() at the keypress, for measuring how long it takes to show"""
+	__slots__ = ('solution', 'time', 'wallTime')
+	name = "Solution Update Event"
+	def __init__(self, solution, time=None, wallTime=None):
 		self.solution = solution
+		self.time = time
+		self.wallTime = wallTime
 	def __str__(self):
 		return "%s for solution %s" % (self.name, self.solution)
 
 class SolveEvent(Event):
-	"""this event is triggered when the player submits a solution for an attack"""
-	def __init__(self, solution):
-		self.name = "Solve Event"
+	"""this event is triggered when the player submits a solution for an attack
+		time: game time the solution was submitted at (None if unknown), which it is scored by
+		wallTime: pygame.time.get_ticks() at the keypress, for measuring how long it takes to show"""
+	__slots__ = ('solution', 'time', 'wallTime')
+	name = "Solve Event"
+	def __init__(self, solution, time=None, wallTime=None):
 		self.solution = solution
+		self.time = time
+		self.wallTime = wallTime
 	def __str__(self):
 		return "%s for solution %s" % (self.name, self.solution)
 
+class TimeoutSolveEvent(SolveEvent):
+	"""the (always wrong) solution given for the player when the countdown runs out"""
+	__slots__ = ()
+	name = "Timeout Solve Event"
+
 #------------------------------------------------------------------------------
 class GameStateChangeEvent(Event):
 	"""Superclass for all events that indicate the change of state of the game"""
-	def __init__(self):
-		self.name = "Game State Change Event"
+	__slots__ = ()
+	name = "Game State Change Event"
 	def __str__(self):
 		return self.name
 
 class GameOverEvent(GameStateChangeEvent):
-	def __init__(self):
-		self.name = "Game Over Event"
+	__slots__ = ()
+	name = "Game Over Event"
 
 class VictoryEvent(GameStateChangeEvent):
-	def __init__(self):
-		self.name = "Victory Event"
+	__slots__ = ()
+	name = "Victory Event"
+
+class GameRestoredEvent(GameStateChangeEvent):
+	"""The game has been put back to a saved state (see Game.Restore): whatever was shown of it
+		is out of date.  It is followed by a spawn event & an ActorRestoredEvent for each actor,
+		and a RequestSolutionEvent for any problem waiting to be solved
+		endEvent: the class of event the restored battle had ended with (VictoryEvent or
+			GameOverEvent), or None if it is still going -- it isn't sent again, as the battle
+			didn't end again"""
+	__slots__ = ('endEvent',)
+	name = "Game Restored Event"
+	def __init__(self, endEvent=None):
+		self.endEvent = endEvent
 
 #------------------------------------------------------------------------------
 class ActorStateChangeEvent(Event):
 	"""Superclass for all events that indicate the change of state of an actor
 		subject: acting party"""
+	__slots__ = ('subject',)
+	name = "Actor State Change Event"
+	subjectAttrs = ('subject',)
 	def __init__(self, subject):
-		self.name = "Actor State Change Event"
 		self.subject = subject
 	def __str__(self):
 		return "%s for Actor %s" % (self.name, self.subject)
 
 class WaitEvent(ActorStateChangeEvent):
 	"""Actor is currently not involved in an event"""
-	def __init__(self, subject):
-		ActorStateChangeEvent.__init__(self, subject)
-		self.name = "Wait Event"
+	__slots__ = ()
+	name = "Wait Event"
 
 class AttackEvent(ActorStateChangeEvent):
-	"""Actor is currently attacking"""
+	"""Actor is currently attacking
+		object: party being attacked"""
+	__slots__ = ('object', 'damage')
+	name = "Attack Event"
+	subjectAttrs = ('subject', 'object')
 	def __init__(self, subject, object, damage):
 		ActorStateChangeEvent.__init__(self, subject)
-		self.name = "Attack Event"
 		self.object = object
 		self.damage = damage
 	def __str__(self):
@@ -170,31 +247,44 @@ class AttackEvent(ActorStateChangeEvent):
 
 class DefendEvent(ActorStateChangeEvent):
 	"""Actor is currently defending"""
-	def __init__(self, subject):
-		ActorStateChangeEvent.__init__(self, subject)
-		self.name = "Defend Event"
+	__slots__ = ()
+	name = "Defend Event"
 
 class HurtEvent(ActorStateChangeEvent):
 	"""Actor is currently being hurt"""
+	__slots__ = ('newHealth',)
+	name = "Hurt Event"
 	def __init__(self, subject, newHealth):
 		ActorStateChangeEvent.__init__(self, subject)
-		self.name = "Hurt Event"
 		self.newHealth = newHealth
 	def __str__(self):
 		return "%s: Actor was hurt %s with resulting health of %s" % (self.name, self.subject, self.newHealth)
 
 class DieEvent(ActorStateChangeEvent):
 	"""Actor is currently dead"""
-	def __init__(self, subject):
+	__slots__ = ()
+	name = "Die Event"
+
+class ActorRestoredEvent(ActorStateChangeEvent):
+	"""Actor has been put back to a saved state
+		stateEvent: the event class of the state it is in (WaitEvent, AttackEvent...)"""
+	__slots__ = ('stateEvent', 'newHealth')
+	name = "Actor Restored Event"
+	def __init__(self, subject, stateEvent, newHealth):
 		ActorStateChangeEvent.__init__(self, subject)
-		self.name = "Die Event"
+		self.stateEvent = stateEvent
+		self.newHealth = newHealth
+	def __str__(self):
+		return "%s: Actor %s restored to %s with health of %s" % \
+				(self.name, self.subject, self.stateEvent.name, self.newHealth)
 
 #------------------------------------------------------------------------------
 class OpenMenuEvent(Event):
 	"""..."""
+	__slots__ = ('title', 'choices')
+	name = "Open Menu event"
 	def __init__(self, title, choices):
 		Event.__init__(self)
-		self.name = "Open Menu event"
 		self.title = title
 		self.choices = choices
 	def __str__(self):
@@ -203,13 +293,15 @@ class OpenMenuEvent(Event):
 #------------------------------------------------------------------------------
 class Singleton(object):
 	"""Singleton as defined here: http://snippets.dzone.com/posts/show/651"""
+	__slots__ = ()
 	def __new__(type):
 		 if not '_the_instance' in type.__dict__:
 		 	type._the_instance = object.__new__(type)
 		 return type._the_instance
 
 class Borg(object):
-	"""borg design pattern: http://code.activestate.com/recipes/66531/"""
+	"""borg design pattern: http://code.activestate.com/recipes/66531/
+	(no __slots__: the pattern works by sharing __dict__ between instances)"""
 	__shared_state = {}
 	def __init__(self):
 		self.__dict__ = self.__shared_state
@@ -220,13 +312,23 @@ class Borg(object):
 		pass
 
 class SingletonType(type):
-	"""Singleton metaclass as defined here: http://timka.org/programming/2008/12/17/singleton-in-python/"""
-	def __call__(cls):
+	"""Singleton metaclass as defined here: http://timka.org/programming/2008/12/17/singleton-in-python/
+	calling the class returns the shared default instance (created with the arguments of the first
+	call, e.g. Game(evManager)); NewInstance creates independent ones"""
+	__slots__ = ()
+	def __call__(cls, *args, **kwds):
 		if getattr(cls, '__instance__', None) is None:
-			instance = cls.__new__(cls)
-			instance.__init__()
-			cls.__instance__ = instance
+			cls.__instance__ = cls.NewInstance(*args, **kwds)
+		elif args or kwds:
+			raise TypeError("the shared %s has already been created: use %s.NewInstance for another"
+				% (cls.__name__, cls.__name__))
 		return cls.__instance__
+	
+	def NewInstance(cls, *args, **kwds):
+		"""Create an instance that is not shared (e.g. one EventManager per battle)"""
+		instance = cls.__new__(cls)
+		instance.__init__(*args, **kwds)
+		return instance
 
 
 class EventManager(object):
@@ -234,36 +336,295 @@ class EventManager(object):
 	between the Model, View, and Controller.
 	"""
 	__metaclass__ = SingletonType
+	__slots__ = ('listeners', 'subjectListeners', 'dispatchTable', 'registrationOrder', 'registrations',
+		'validListenerClasses', 'traceTable', 'tracedClasses', 'untracedClasses',
+		'queued', 'maxEventsPerTick', 'eventQueue', 'dispatching', 'eventsThisTick',
+		'time', 'timers', 'timerCount', 'tickEvent', 'renderEvent', 'profiler', 'dispatch')
 	
 	def __init__(self):
-		from weakref import WeakKeyDictionary
-		self.listeners = WeakKeyDictionary()
-		self.eventQueue= []
-
-	#todo: listeners should be able to only subscribe to a subset of events (e.g. only pertaining to a specific actor) 
-	def RegisterListener( self, listener ):
-		"""Add given listener to list that will recieve event notifications"""
-		#make sure the Notify method exists, and has the right params (enforced duck typing)
-		if not hasattr(listener, 'Notify') \
-			or not callable(listener.Notify) \
-			or len(getargspec(listener.Notify)[0]) < 2 \
-			or not getargspec(listener.Notify)[0][1] == 'event':
+		self.listeners = WeakKeyDictionary() #listener -> (subscribed event classes or None, subject or None)
+		self.subjectListeners = {} #subject -> WeakKeyDictionary of the listeners filtered on that subject
+		self.dispatchTable = {} #(event class, subject) -> list of weakrefs to interested listeners
+		self.registrationOrder = WeakKeyDictionary() #listener -> sequence number, so dispatch order is repeatable
+		self.registrations = 0
+		self.validListenerClasses = set() #classes whose Notify signature has already been checked
+		self.traceTable = {} #event class -> whether dispatching it is logged
+		self.TraceEvents( () )
+		
+		#queued mode: events posted while dispatching wait their turn instead of recursing
+		self.queued = False
+		self.maxEventsPerTick = None #cap on non-tick events dispatched per TickEvent (None for no cap)
+		self.eventQueue = deque()
+		self.dispatching = False
+		self.eventsThisTick = 0
+		
+		#game clock and pending timers, advanced by each TickEvent dispatched
+		self.time = 0
+		self.timers = [] #heap of [deadline, sequence number, callback]
+		self.timerCount = 0
+		
+		#the events reused by NotifyTick and NotifyRender (None while in use)
+		self.tickEvent = None
+		self.renderEvent = None
+		
+		self.profiler = None #times listeners and events while enabled
+		self.dispatch = self.Dispatch #...by swapping in ProfiledDispatch
+
+	def EnableProfiler( self, profiler = None ):
+		"""Start timing every listener's Notify (by listener class) and the dispatch of every
+			event (by event class, including any events it causes to be dispatched in immediate mode)
+			returns the Profiler the timings are recorded in"""
+		if profiler is None:
+			profiler = Profiler()
+		self.profiler = profiler
+		self.dispatch = self.ProfiledDispatch
+		return profiler
+
+	def DisableProfiler( self ):
+		"""Stop timing -- dispatching goes back to the untimed Dispatch, so an idle profiler costs nothing"""
+		self.profiler = None
+		self.dispatch = self.Dispatch
+
+	def TraceEvents( self, eventClasses = (Event,), ignoreClasses = (TickEvent, RenderEvent) ):
+		"""Log each dispatched event of the given classes (or their subclasses) at DEBUG level,
+			except for those of ignoreClasses.  Pass no eventClasses to turn tracing off,
+			in which case events are never formatted"""
+		self.tracedClasses = tuple(eventClasses)
+		self.untracedClasses = tuple(ignoreClasses)
+		self.traceTable.clear()
+
+	def IsTraced( self, eventClass ):
+		"""Return whether dispatching the given event class is logged (cached per class)"""
+		try:
+			return self.traceTable[ eventClass ]
+		except KeyError:
+			traced = issubclass(eventClass, self.tracedClasses) \
+				and not issubclass(eventClass, self.untracedClasses)
+			self.traceTable[ eventClass ] = traced
+			return traced
+
+	def SetTimer( self, deadline, callback ):
+		"""Have callback(time) called when the first TickEvent at or after the given deadline
+			(in game time) is dispatched, before the tick reaches any listener
+			returns a handle that can be passed to CancelTimer"""
+		self.timerCount += 1
+		timer = [deadline, self.timerCount, callback]
+		heappush( self.timers, timer )
+		return timer
+
+	def CancelTimer( self, timer ):
+		"""Stop the given timer from firing (fail silently if it already has)"""
+		timer[2] = None
+
+	def RunTimers( self, time ):
+		"""Fire every timer whose deadline has been reached, earliest first"""
+		timers = self.timers
+		while timers and timers[0][0] <= time:
+			timer = heappop( timers )
+			callback = timer[2]
+			if callback is not None:
+				timer[2] = None #fired -- so the handle no longer counts as pending
+				callback( time )
+
+	def SetQueued( self, queued = True, maxEventsPerTick = None ):
+		"""Switch between immediate mode (every event is dispatched as soon as it is posted,
+			nesting inside the handler that posted it) and queued mode (events are dispatched
+			one at a time in the order they were posted).
+			maxEventsPerTick: in queued mode, the number of events other than ticks and renders
+				that may be dispatched for each TickEvent posted -- any others are held over
+				until the next tick"""
+		self.queued = queued
+		self.maxEventsPerTick = maxEventsPerTick
+		if not queued and not self.dispatching:
+			self.ProcessQueue( True ) #nothing should be left waiting in immediate mode
+
+	def RegisterListener( self, listener, eventClasses = None, subject = None ):
+		"""Add given listener to list that will recieve event notifications
+			eventClasses: optional sequence of Event classes the listener is interested in
+				(events of any subclass are delivered as well).  If not given, the listener
+				will be notified of every event
+			subject: optional evID -- if given, events that concern particular actors
+				(see Event.subjectAttrs) are only delivered when they concern this one"""
+		self.RegisterListeners( [(listener, eventClasses, subject)] )
+
+	def RegisterListeners( self, registrations ):
+		"""Add several listeners at once
+			registrations: iterable of listeners, or of (listener, eventClasses, subject) tuples
+				with the same meaning as the arguments to RegisterListener.
+			Every listener is validated before any of them is added"""
+		entries = []
+		for registration in registrations:
+			if isinstance(registration, tuple):
+				listener, eventClasses, subject = registration
+			else:
+				listener, eventClasses, subject = registration, None, None
+			self.ValidateListener( listener )
+			if eventClasses is not None:
+				eventClasses = tuple(eventClasses)
+			entries.append( (listener, (eventClasses, subject)) )
+		for listener, entry in entries:
+			self.RemoveListener( listener ) #in case it was registered with another subject
+			self.listeners[ listener ] = entry
+			self.registrations += 1
+			self.registrationOrder[ listener ] = self.registrations
+			subject = entry[1]
+			if subject is not None:
+				self.subjectListeners.setdefault( subject, WeakKeyDictionary() )[ listener ] = entry
+		self.dispatchTable.clear()
+
+	def ValidateListener( self, listener ):
+		"""Raise a TypeError unless the given listener defines method 'Notify(self, event)'
+			(enforced duck typing).  The signature is only inspected once per listener class"""
+		listenerClass = listener.__class__
+		ownNotify = 'Notify' in getattr(listener, '__dict__', ())
+		if listenerClass in self.validListenerClasses and not ownNotify:
+			return
+		if not hasattr(listener, 'Notify') or not callable(listener.Notify):
 			raise TypeError("listener '%s' must define method 'Notify(self, event)'" % (listener))
-		self.listeners[ listener ] = 1
+		args = getargspec(listener.Notify)[0]
+		if len(args) < 2 or not args[1] == 'event':
+			raise TypeError("listener '%s' must define method 'Notify(self, event)'" % (listener))
+		if not ownNotify:
+			self.validListenerClasses.add( listenerClass )
 
 	def UnregisterListener( self, listener ):
 		"""Remove given listener from list that will recieve event notifications
 			fail silently if the listener doesn't exist"""
-		if listener in self.listeners.keys():
-			del self.listeners[ listener ]
+		if self.RemoveListener( listener ):
+			self.dispatchTable.clear()
+
+	def RemoveListener( self, listener ):
+		"""Remove given listener from the listener tables without touching the dispatch table
+			returns whether the listener was registered"""
+		if listener not in self.listeners:
+			return False
+		eventClasses, subject = self.listeners[ listener ]
+		del self.listeners[ listener ]
+		del self.registrationOrder[ listener ]
+		if subject is not None:
+			del self.subjectListeners[ subject ][ listener ]
+			if len(self.subjectListeners[ subject ]) == 0:
+				del self.subjectListeners[ subject ]
+		return True
+
+	def GetListeners( self, eventClass, subject = None ):
+		"""Return weak references to every listener interested in the given event class
+			(and, if given, filtered on the given subject)
+			in the order they were registered.  The result is computed once per event class
+			and subject, and cached until a listener is registered or unregistered"""
+		try:
+			return self.dispatchTable[ (eventClass, subject) ]
+		except KeyError:
+			if subject is None:
+				candidates = self.listeners
+			else:
+				candidates = self.subjectListeners.get( subject, {} )
+			interested = [] #(registration order, weakref)
+			for listener, (eventClasses, listenerSubject) in candidates.items():
+				#events about actors reach subject-filtered listeners through their subject's entry
+				if subject is None and listenerSubject is not None and eventClass.subjectAttrs:
+					continue
+				if eventClasses is None or issubclass(eventClass, eventClasses):
+					interested.append( (self.registrationOrder[ listener ], ref(listener)) )
+			interested.sort()
+			interested = [listenerRef for order, listenerRef in interested]
+			self.dispatchTable[ (eventClass, subject) ] = interested
+			return interested
 
 	def Notify( self, event ):
-		"""Inform all listeners that a given event has occurred"""
-		if not isinstance(event, TickEvent): Debug( "     Message: " + str(event) )
-		for listener in self.listeners.keys():
-			#If the weakref has died, remove it and continue
+		"""Inform all interested listeners that a given event has occurred
+			(or, in queued mode, that it will occur once the events before it are done)"""
+		if not self.queued:
+			self.dispatch( event )
+			return
+		if isinstance(event, TickEvent):
+			self.eventsThisTick = 0
+		self.eventQueue.append( event )
+		if not self.dispatching:
+			self.ProcessQueue()
+
+	def NotifyTick( self, time, dtime = 0 ):
+		"""Notify a TickEvent, reusing the same event object every tick so the game loop doesn't
+			allocate one each time.  Listeners must not hold on to the event after Notify returns"""
+		tick = self.tickEvent
+		if tick is None:
+			tick = TickEvent( time, dtime )
+		else:
+			tick.time = time
+			tick.dtime = dtime
+		self.tickEvent = None #not to be reused while it is being dispatched
+		self.Notify( tick )
+		if not self.eventQueue: #(otherwise it may be waiting in the queue)
+			self.tickEvent = tick
+
+	def NotifyRender( self, time ):
+		"""Notify a RenderEvent, reusing the same event object every frame (see NotifyTick)"""
+		render = self.renderEvent
+		if render is None:
+			render = RenderEvent( time )
+		else:
+			render.time = time
+		self.renderEvent = None
+		self.Notify( render )
+		if not self.eventQueue:
+			self.renderEvent = render
+
+	def ProcessQueue( self, ignoreBudget = False ):
+		"""Dispatch queued events in the order they were posted, until the queue is empty
+			or this tick's budget of events is used up"""
+		self.dispatching = True
+		try:
+			while self.eventQueue:
+				if not isinstance(self.eventQueue[0], (TickEvent, RenderEvent)) and not ignoreBudget:
+					if self.maxEventsPerTick is not None and self.eventsThisTick >= self.maxEventsPerTick:
+						break
+					self.eventsThisTick += 1
+				self.dispatch( self.eventQueue.popleft() )
+		finally:
+			self.dispatching = False
+
+	def Dispatch( self, event ):
+		"""Pass the given event to every interested listener right away"""
+		listenerRefs = self.StartDispatch( event )
+		#(indexed through xrange, which unlike a list iterator isn't a gc-tracked allocation)
+		for i in xrange( len(listenerRefs) ):
+			#If the weakref has died, skip it and continue
 			#through the list
+			listener = listenerRefs[i]()
+			if listener is None:
+				continue
+			listener.Notify( event )
+
+	def ProfiledDispatch( self, event ):
+		"""Dispatch, recording how long each listener and the event as a whole take"""
+		profiler = self.profiler
+		start = default_timer()
+		for listenerRef in self.StartDispatch( event ):
+			listener = listenerRef()
 			if listener is None:
-				del self.listeners[ listener ]
 				continue
-			listener.Notify( event )
\ No newline at end of file
+			before = default_timer()
+			listener.Notify( event )
+			profiler.Record( 'listener', listener.__class__.__name__, default_timer() - before )
+		profiler.Record( 'event', event.__class__.__name__, default_timer() - start )
+
+	def StartDispatch( self, event ):
+		"""Trace the event, advance the clock and run timers if it is a tick
+			returns weak references to the listeners it should be passed to"""
+		eventClass = event.__class__
+		if self.IsTraced( eventClass ): logger.debug( "     Message: %s", event )
+		if isinstance(event, TickEvent):
+			self.time = event.time
+			self.RunTimers( event.time )
+		listenerRefs = self.GetListeners( eventClass )
+		if not eventClass.subjectAttrs: #(most events, ticks & renders included: nothing to allocate)
+			return listenerRefs
+		subjects = []
+		for attr in eventClass.subjectAttrs:
+			subject = getattr(event, attr)
+			if subject is not None and subject not in subjects:
+				subjects.append( subject )
+				subjectRefs = self.GetListeners( eventClass, subject )
+				if subjectRefs:
+					listenerRefs = listenerRefs + subjectRefs
+		return listenerRefs
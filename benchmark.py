@@ -0,0 +1,144 @@
+"""Counts the events allocated while a headless battle ticks along, with the game loop
+allocating a new TickEvent & RenderEvent every tick (as it used to) and with the pooled
+ones (NotifyTick & NotifyRender), along with every other object the garbage collector tracks
+(the lists, tuples, dicts & instances allocated by dispatching them, say), and compares the
+size of an event with __slots__ to one with a __dict__ and a name of its own.
+With pooling, a quiet tick allocates nothing: what is left comes from the battle's own
+events (attacks, hurts, problems & the timers they set) and from the listener lists built
+the first time each kind of event is dispatched.
+Then times a crowd of enemies attacking the hero, as EnemyModels and kept in an ActorArena
+(if NumPy is installed).
+
+	python benchmark.py [ticks] [enemies]
+"""
+from EventManager import *
+from simulation import *
+
+import gc
+import sys
+import time
+
+class DictTickEvent(object):
+	"""A TickEvent as events used to be: with a __dict__ and a name on each instance"""
+	def __init__(self, time, dtime = 0):
+		self.name = "CPU Tick Event"
+		self.time = time
+		self.dtime = dtime
+
+def CountEvents(run):
+	"""Call run(), returning the number of events of each class created meanwhile"""
+	counts = {}
+	def CountingNew(cls, *args, **kwds):
+		counts[cls.__name__] = counts.get(cls.__name__, 0) + 1
+		return object.__new__(cls)
+	Event.__new__ = staticmethod(CountingNew)
+	try:
+		run()
+	finally:
+		del Event.__new__
+	return counts
+
+def CountAllocations(run):
+	"""Call run(), returning the number of gc-tracked objects (lists, tuples, dicts, instances...
+		but not ints or strings) allocated meanwhile: the garbage collector's count of them is
+		checked on every line run, with collection turned off, and each rise in it added up.
+		(Objects allocated & freed again within a single line aren't seen, and nor are the
+		lists, tuples & dicts CPython hands back out of its free lists)"""
+	allocated = [0]
+	last = [0]
+	def Trace(frame, event, arg):
+		count = gc.get_count()[0]
+		if count > last[0]:
+			allocated[0] += count - last[0]
+		last[0] = count
+		return Trace
+	enabled = gc.isenabled()
+	gc.disable()
+	gc.collect()
+	sys.settrace(Trace)
+	try:
+		run()
+	finally:
+		sys.settrace(None)
+		if enabled:
+			gc.enable()
+	return allocated[0]
+
+def TickBattle(ticks, pooled, step=10, seed=0):
+	"""Run a battle for the given number of ticks (rendering after every tick), returning
+		the events created by class and the number of gc-tracked objects allocated"""
+	evManager = EventManager.NewInstance()
+	game = Game.NewInstance(evManager, seed)
+	player = ScriptedPlayerController(game, rng=random.Random(seed), evManager=evManager)
+	evManager.Notify(TickEvent(0, step)) #start the game
+	def Run():
+		for time in xrange(step, (ticks+1)*step, step):
+			if pooled:
+				evManager.NotifyTick(time, step)
+				evManager.NotifyRender(time)
+			else:
+				evManager.Notify(TickEvent(time, step))
+				evManager.Notify(RenderEvent(time))
+	counts = {}
+	allocated = CountAllocations(lambda: counts.update(CountEvents(Run)))
+	return counts, allocated
+
+def CrowdBattle(enemies, ticks, arena, step=25, seed=0):
+	"""Time a game with the given number of enemies (doing no damage, so the hero lasts) for the
+		given number of ticks, returning the seconds taken and the number of attacks"""
+	evManager = EventManager.NewInstance()
+	game = Game.NewInstance(evManager, seed, arena)
+	game.enemySettings = {'attackPower': 0}
+	attacks = []
+	counter = SubscribingAttackCounter(attacks) #(listeners are only weakly referenced)
+	evManager.RegisterListener(counter, (AttackEvent,))
+	evManager.NotifyTick(0, step) #start the game
+	for i in range(enemies-1):
+		game.SpawnEnemy()
+	start = time.time()
+	for tick in xrange(step, (ticks+1)*step, step):
+		evManager.NotifyTick(tick, step)
+	return time.time() - start, len(attacks)
+
+class SubscribingAttackCounter(object):
+	def __init__(self, attacks):
+		self.attacks = attacks
+	def Notify(self, event):
+		self.attacks.append(event.subject)
+
+def EventSize(event):
+	"""Bytes taken by an event and its attribute dict (if it has one)"""
+	size = sys.getsizeof(event)
+	if hasattr(event, '__dict__'):
+		size += sys.getsizeof(event.__dict__)
+	return size
+
+def main():
+	ticks = 1000
+	enemies = 1000
+	if len(sys.argv) > 1:
+		ticks = int(sys.argv[1])
+	if len(sys.argv) > 2:
+		enemies = int(sys.argv[2])
+	for label, pooled in (("new events every tick", False), ("pooled tick & render", True)):
+		counts, allocated = TickBattle(ticks, pooled)
+		print "%s: %s events allocated in %s ticks, %s gc-tracked objects in all" % \
+			(label, sum(counts.values()), ticks, allocated)
+		for name, count in sorted(counts.items()):
+			print "\t%-22s %s" % (name, count)
+	print "(pooled, the rest come from the battle's own events and the listener lists built for them)"
+	print "bytes per TickEvent: %s with a __dict__, %s with __slots__" % \
+		(EventSize(DictTickEvent(1000, 10)), EventSize(TickEvent(1000, 10)))
+	modes = [("EnemyModels", False)]
+	try:
+		import numpy
+		modes.append(("arena", True))
+	except ImportError:
+		print "(NumPy isn't installed: no arena mode)"
+	for label, arena in modes:
+		seconds, attacks = CrowdBattle(enemies, ticks, arena)
+		print "%s enemies as %s: %s attacks in %s ticks, %.3f seconds" % \
+			(enemies, label, attacks, ticks, seconds)
+
+if __name__ == "__main__":
+	main()
@@ -3,102 +3,219 @@ from EventManager import *
 import pygame
 from pygame.locals import *
 
+import os
+from ConfigParser import RawConfigParser
+
 class KeyboardController(object):
 	"""Takes input from the keboard and translates that into game Events to trigger action
-		in the rest of the system"""
+		in the rest of the system.  The pygame event queue is polled once per tick by the
+		CPUSpinnerController's input stage (see Poll), and is filtered down to the only events
+		we use.  Each keypress is translated with a single lookup in the key bindings, which are
+		loaded from a config file (see keys.cfg)"""
 	STATE_ACTION = 0
 	STATE_SOLVE = 1
 	STATE_VICTORY = 2
 	
-	def __init__(self):
-		self.evManager = EventManager()
-		self.evManager.RegisterListener( self )
+	#config file section -> state its bindings apply in (None for every state)
+	states = {'any': None, 'action': STATE_ACTION, 'solve': STATE_SOLVE, 'victory': STATE_VICTORY}
+	
+	def __init__(self, bindings=os.path.join(os.path.dirname(__file__), "keys.cfg"), evManager=None):
+		if evManager is None: evManager = EventManager()
+		self.evManager = evManager
+		self.evManager.RegisterListener( self, (VictoryEvent, GameRestoredEvent, RequestSolutionEvent, SolveEvent) )
 		self.state = KeyboardController.STATE_ACTION
 		self.solution = ""
-		self.solveTime = 0
+		self.filtered = False #whether the pygame event queue has been filtered yet
+		self.keyTime = 0 #game time of the keypresses being handled
+		self.keyWallTime = 0 #...and the wall clock time
+		self.keymap = self.CompileBindings(self.LoadBindings(bindings))
+
+	def LoadBindings(self, filename):
+		"""Read key bindings from a config file, with a section for each state (or 'any')
+			binding key names to the names of the methods handling them, e.g.
+				[action]
+				space = Attack
+			keys are named as in pygame.locals, without the K_ (any case), or as the
+			character typed in quotes (e.g. "7" = TypeDigit)
+			returns {state: {key or character: action}}"""
+		config = RawConfigParser()
+		config.optionxform = str #keep the case of quoted characters
+		if not config.read(filename):
+			raise IOError("couldn't read key bindings from '%s'" % filename)
+		bindings = {}
+		for section in config.sections():
+			if section not in self.states:
+				raise ValueError("unknown state '%s' in key bindings" % section)
+			stateBindings = bindings.setdefault(self.states[section], {})
+			for name, action in config.items(section):
+				stateBindings[self.KeyFromName(name)] = action
+		return bindings
+
+	def KeyFromName(self, name):
+		"""Return the key constant (or, for a quoted name, the character) a binding refers to"""
+		if len(name) > 2 and name[0] == name[-1] and name[0] in '"\'':
+			return unicode(name[1:-1])
+		for key in ('K_' + name, 'K_' + name.lower(), 'K_' + name.upper()):
+			if hasattr(pygame.locals, key):
+				return getattr(pygame.locals, key)
+		raise ValueError("unknown key '%s' in key bindings" % name)
+
+	def CompileBindings(self, bindings):
+		"""Flatten bindings into {(state, key or character): method}, so handling a keypress
+			takes one lookup however many bindings there are.  Bindings for a particular state
+			take precedence over those for every state"""
+		keymap = {}
+		for state in self.states.values():
+			if state is None:
+				continue
+			for stateBindings in (bindings.get(None, {}), bindings.get(state, {})):
+				for key, action in stateBindings.items():
+					if not callable(getattr(self, action, None)):
+						raise ValueError("unknown action '%s' in key bindings" % action)
+					keymap[(state, key)] = getattr(self, action)
+		return keymap
+
+	def FilterEvents(self):
+		"""Have pygame drop every event but keypresses and quitting before they reach its queue
+			(only possible once pygame's display has been initialized)"""
+		if not self.filtered and pygame.display.get_init():
+			pygame.event.set_blocked(None)
+			pygame.event.set_allowed([KEYDOWN, QUIT])
+			self.filtered = True
+
+	def Poll(self, time=None):
+		"""Drain the pygame event queue, translating it into game events in one pass
+			returns the game events
+		pygame's key events aren't timestamped, so they are stamped with the time of the
+		tick they are handled in (by default the last tick the event manager dispatched)"""
+		self.FilterEvents()
+		events = []
+		pgEvents = pygame.event.get()
+		if pgEvents:
+			self.keyTime = self.evManager.time if time is None else time
+			self.keyWallTime = pygame.time.get_ticks()
+		for pgEvent in pgEvents:
+			if pgEvent.type == QUIT:
+				events.append(QuitEvent())
+			elif pgEvent.type == KEYDOWN:
+				action = self.keymap.get((self.state, pgEvent.key)) \
+					or self.keymap.get((self.state, pgEvent.unicode))
+				if action is not None:
+					event = action(pgEvent)
+					if event is not None:
+						events.append(event)
+		return events
+
+	def Quit(self, pgEvent):
+		return QuitEvent()
+
+	def ToggleProfiler(self, pgEvent):
+		return ToggleProfilerEvent()
+
+	def Attack(self, pgEvent):
+		return RequestAttackEvent()
+
+	def TypeDigit(self, pgEvent):
+		self.solution += pgEvent.unicode
+		return SolutionUpdateEvent(self.solution, self.keyTime, self.keyWallTime)
+
+	def DeleteDigit(self, pgEvent):
+		self.solution = self.solution[:-1]
+		return SolutionUpdateEvent(self.solution, self.keyTime, self.keyWallTime)
+
+	def Submit(self, pgEvent):
+		return SolveEvent(self.solution, self.keyTime, self.keyWallTime)
+
+	def NextBattle(self, pgEvent):
+		self.state = KeyboardController.STATE_ACTION
+		return NextBattleEvent()
 
 	def Notify(self, event):
-		"""Takes mostly keyboard inputs and generates events based on state.
+		"""Keeps track of the state the key bindings apply in (key presses are translated by Poll)
+		Any state:
+			GameRestoredEvent:
+				Change state back to STATE_ACTION (or STATE_VICTORY, if the battle had been won)
+				and reset solution (any problem being solved is requested again)
 		STATE_ACTION: Generic state -- basically just waiting for player to attack
 			RequestSolutionEvent:
 				Change state to STATE_SOLVE
-			TickEvent:
-				Check to see if game is quit or attack is requested based on key presses
 		STATE_VICTORY: Player has defeated all enemies (waiting for next battle)
 		STATE_SOLVE: Player has attacked, and is in the process of entering the solution
 			SolveEvent:
 				Attack has completed, change state back to STATE_ACTION and reset solution
-			TickEvent:
-				Listen for any key presses (quit, numbers, delete, submit) and update appropriately
 		"""
-		events = [] #events to be raised at the end if necessary
-		
-		#always quit (regardless of state)
-		if isinstance(event, TickEvent):
-			pgEventList = pygame.event.get()
-			for pgEvent in pgEventList:
-				if pgEvent.type == QUIT:
-					events.append(QuitEvent())
-				elif pgEvent.type == KEYDOWN:
-					if pgEvent.key == K_ESCAPE:
-						events.append(QuitEvent())
 		#always switch to victory state (regardless of current state)
-		elif isinstance(event, VictoryEvent):
-			print "controller victory"
+		if isinstance(event, VictoryEvent):
+			Debug("controller victory", 3)
 			self.state = KeyboardController.STATE_VICTORY
-		
-		if self.state == KeyboardController.STATE_ACTION:
+		#...or back to the state the game is restored in
+		elif isinstance(event, GameRestoredEvent):
+			if event.endEvent is VictoryEvent:
+				self.state = KeyboardController.STATE_VICTORY
+			else:
+				self.state = KeyboardController.STATE_ACTION
+			self.solution = ""
+		elif self.state == KeyboardController.STATE_ACTION:
 			if isinstance(event, RequestSolutionEvent):
 				self.state = KeyboardController.STATE_SOLVE
-			elif isinstance(event, TickEvent):
-				#Handle Input Events
-				for pgEvent in pgEventList:
-					if pgEvent.type == KEYDOWN:
-						if pgEvent.key == K_SPACE:
-							events.append(RequestAttackEvent())
-		
 		elif self.state == KeyboardController.STATE_SOLVE:
 			if isinstance(event, SolveEvent):
 				self.state = KeyboardController.STATE_ACTION
 				self.solution = ""
-			elif isinstance(event, TickEvent):
-				for pgEvent in pgEventList:
-					if pgEvent.type == KEYDOWN:
-						if pgEvent.unicode in u'0123456789': #typed a digit
-							self.solution += pgEvent.unicode
-							events.append(SolutionUpdateEvent(self.solution))
-						elif pgEvent.key == K_BACKSPACE:
-							self.solution = self.solution[:-1]
-							events.append(SolutionUpdateEvent(self.solution))
-						elif pgEvent.key in (K_RETURN, K_KP_ENTER):
-							events.append(SolveEvent(self.solution))
-		
-		elif self.state == KeyboardController.STATE_VICTORY:
-			if isinstance(event, TickEvent):
-				for pgEvent in pgEventList:
-					if pgEvent.type == KEYDOWN:
-						if pgEvent.key == K_SPACE:
-							events.append(NextBattleEvent())
-							self.state = KeyboardController.STATE_ACTION
-		for ev in events:
-			self.evManager.Notify( ev )
 
 class CPUSpinnerController(object):
-	"""Controls the game clock -- generating an Event for each game tick, and throttling
-		the game to limit CPU usage"""
-	def __init__(self, maxfps=40):
-		self.evManager = EventManager()
-		self.evManager.RegisterListener( self )
+	"""Controls the game clock -- generating a TickEvent for each game tick at a fixed rate,
+		and a RenderEvent for each frame drawn, throttling frames to limit CPU usage.
+		When drawing is slow, frames are dropped rather than ticks, so game timing stays
+		accurate -- up to maxCatchUp ticks per frame; past that the rest of the stall is
+		dropped, and the game clock carries on from where it was (behind the wall clock)"""
+	def __init__(self, maxfps=40, tickRate=100, maxCatchUp=10, inputs=(), evManager=None):
+		if evManager is None: evManager = EventManager()
+		self.evManager = evManager
+		self.evManager.RegisterListener( self, (QuitEvent,) )
 
 		self.keepGoing = 1
 		self.clock = pygame.time.Clock()
 		self.maxfps = maxfps
+		self.step = 1000/tickRate #milliseconds of game time per tick
+		self.maxCatchUp = maxCatchUp #most ticks to run between two frames
+		self.inputs = list(inputs) #controllers polled for input before each tick (see KeyboardController.Poll)
+		self.time = 0 #game time of the last tick (the wall clock, less lostTime)
+		self.ticks = 0
+		self.frames = 0
+		self.lostTime = 0 #milliseconds of wall clock time the game has fallen behind by
 
 	def Run(self):
 		"""Start the game by telling the game clock to go!"""
+		self.time = pygame.time.get_ticks()
 		while self.keepGoing:
-			event = TickEvent(pygame.time.get_ticks(), self.clock.tick(self.maxfps))
-			self.evManager.Notify( event )
+			self.clock.tick(self.maxfps)
+			self.Advance(pygame.time.get_ticks())
+
+	def Advance(self, now):
+		"""Tick the game up to the given wall clock time (within the catch up limit), then render"""
+		ticks = 0
+		while self.keepGoing and self.time + self.step <= now - self.lostTime:
+			if ticks == self.maxCatchUp:
+				#too far behind to catch up: let the rest go, by moving the wall clock
+				#reference on rather than jumping the game clock (and every timer with it)
+				self.lostTime += (now - self.lostTime - self.time)/self.step*self.step
+				break
+			self.time += self.step
+			self.PollInput(self.time)
+			self.evManager.NotifyTick( self.time, self.step )
+			ticks += 1
+		self.ticks += ticks
+		if self.keepGoing:
+			self.frames += 1
+			self.evManager.NotifyRender( self.time )
+
+	def PollInput(self, time=None):
+		"""Input stage: post the events raised by each input controller since the last tick,
+			stamped with the time of the tick about to be dispatched"""
+		for controller in self.inputs:
+			for event in controller.Poll(time):
+				self.evManager.Notify( event )
 
 	def Notify(self, event):
 		"""handled events:
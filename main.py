@@ -3,14 +3,36 @@ from controller import *
 from view import *
 from model import *
 
+import logging
+from optparse import OptionParser
+
 def main():
     """Put everthing into motion -- with as few lines of code as possible."""
+    parser = OptionParser(usage="%prog [--debug LEVEL] [--queued EVENTS] [logfile]")
+    parser.add_option("-d", "--debug", type="int", default=0, metavar="LEVEL",
+        help="log debug messages up to LEVEL (1-5) and trace events (off by default)")
+    parser.add_option("-q", "--queued", type="int", default=None, metavar="EVENTS",
+        help="queue events rather than dispatching them straight away, dispatching no more than "
+             "EVENTS a tick (0 for no limit)")
+    options, args = parser.parse_args()
+    if options.debug:
+        SetDebug(options.debug)
+        logging.basicConfig(level=logging.DEBUG, format="%(message)s")
+        EventManager().TraceEvents()
+    if options.queued is not None:
+        EventManager().SetQueued(True, maxEventsPerTick=options.queued or None)
     keybd = KeyboardController()
-    spinner = CPUSpinnerController()
+    spinner = CPUSpinnerController(inputs=[keybd])
     pygameView = PygameView()
     game = Game()
+    recorder = None
+    if args: #record the battle, for replay.py to play back
+        from replay import BattleRecorder
+        recorder = BattleRecorder(args[0])
     
     spinner.Run()
+    if recorder is not None:
+        recorder.Close()
 
 if __name__ == "__main__":
         main()
@@ -3,6 +3,17 @@ from problem import *
 
 import random
 import locale
+from array import array
+
+def SaveRandom(rng):
+    """Return the state of a random number stream as plain data (for a snapshot)"""
+    version, internal, gauss = rng.getstate()
+    return (version, array('I', internal).tostring(), gauss)
+
+def LoadRandom(rng, state):
+    """Put a random number stream back into a state returned by SaveRandom"""
+    version, internal, gauss = state
+    rng.setstate((version, tuple(array('I', internal)), gauss))
 
 class ActorModel(object):
     """Generic class for anything 'alive' -- namely anything that can be involved in combat
@@ -16,11 +27,21 @@ class ActorModel(object):
     STATE_DEFENDING = 2
     STATE_HURTING = 3
     STATE_DEAD = 4
+    
+    #events this actor (or subclass) needs to be notified of
+    #(timing is handled with timers on the event manager rather than by watching every TickEvent)
+    eventClasses = (AttackEvent,)
+    #timer name -> name of the method it calls (so timers can be restored from a snapshot)
+    timerCallbacks = {'attack': 'AttackEnded', 'hurt': 'HurtEnded'}
+    #state -> the event an actor entering it sends (see ActorRestoredEvent)
+    stateEvents = {STATE_WAITING: WaitEvent, STATE_ATTACKING: AttackEvent, STATE_DEFENDING: DefendEvent,
+                   STATE_HURTING: HurtEvent, STATE_DEAD: DieEvent}
 
-    def __init__(self, evID, opponents):
-        self.evManager = EventManager()
-        self.evManager.RegisterListener( self )
+    def __init__(self, evID, opponents, evManager=None):
+        if evManager is None: evManager = EventManager()
+        self.evManager = evManager
         self.evID = evID
+        self.Register()
         self.opponents = opponents
         self.victim = None
         
@@ -28,7 +49,7 @@ class ActorModel(object):
         
         self.AttackWait = 300 #milliseconds
         self.HurtWait = 200 #milliseconds
-        self.time = 0
+        self.timers = {} #name -> handle of this actor's pending timer of that name
         self.AttackEndTime = self.time
         self.HurtEndTime = self.time
         
@@ -37,6 +58,60 @@ class ActorModel(object):
         
         self.attackPower = 0 # to be defined in subclasses
     
+    time = property(lambda self: self.evManager.time, doc="current game time (from the event manager)")
+    
+    def Register(self):
+        """Start listening for the events this actor needs to be notified of"""
+        self.evManager.RegisterListener( self, self.eventClasses, self.evID )
+    
+    def Unregister(self):
+        self.evManager.UnregisterListener(self)
+    
+    def Remove(self):
+        """Take this actor out of the game for good (quietly, unlike dying)"""
+        for name in self.timers.keys():
+            self.CancelTimer(name)
+        self.Unregister()
+    
+    def SetTimer(self, name, deadline, callback):
+        """Has callback(time) called once the game time reaches deadline,
+        replacing any pending timer of the same name"""
+        self.CancelTimer(name)
+        self.timers[name] = self.evManager.SetTimer(deadline, callback)
+    
+    def CancelTimer(self, name):
+        """Cancels the pending timer of the given name (if any)"""
+        if name in self.timers:
+            self.evManager.CancelTimer(self.timers.pop(name))
+    
+    def PendingTimers(self):
+        """Return (sequence number, name, deadline) for each of this actor's timers still to fire"""
+        return [(timer[1], name, timer[0]) for name, timer in self.timers.items() if timer[2] is not None]
+    
+    def RestoreTimer(self, name, deadline):
+        """Sets the timer of the given name (as returned by PendingTimers) again"""
+        self.SetTimer(name, deadline, getattr(self, self.timerCallbacks[name]))
+    
+    def SaveState(self):
+        """Return this actor's state as plain data (its timers are saved by the Game, see Game.Snapshot)"""
+        return {'state': self.state, 'health': self.health, 'maxHealth': self.maxHealth,
+                'victim': self.victim, 'AttackEndTime': self.AttackEndTime, 'HurtEndTime': self.HurtEndTime}
+    
+    def LoadState(self, state, offset=0):
+        """Restore this actor's state from SaveState, with its times moved on by offset
+        (leaving its timers to the Game)"""
+        wasDead = self.state == ActorModel.STATE_DEAD
+        self.state = state['state']
+        self.health = state['health']
+        self.maxHealth = state['maxHealth']
+        self.victim = state['victim']
+        self.AttackEndTime = state['AttackEndTime'] + offset
+        self.HurtEndTime = state['HurtEndTime'] + offset
+        if self.state == ActorModel.STATE_DEAD:
+            self.Unregister()
+        elif wasDead:
+            self.Register()
+    
     def Wait(self):
         """Sets Actor's current state to waiting (neutral)"""
         self.state = ActorModel.STATE_WAITING
@@ -46,7 +121,7 @@ class ActorModel(object):
     def nextVictim(self):
         """Determines next victim from list of known opponents"""
         victims = self.opponents.keys()
-        Debug("available victims: %s" % victims, 5)
+        Debug("available victims: %s", 5, victims)
         if len(victims) == 0 or self.victim not in victims:
             self.victim = None
         for a in (1,2): #search list twice to wrap, since current victim might be last opponent in list
@@ -62,9 +137,10 @@ class ActorModel(object):
         if self.state == ActorModel.STATE_WAITING:
             self.state = ActorModel.STATE_ATTACKING
             self.AttackEndTime = self.time+self.AttackWait
+            self.SetTimer('attack', self.AttackEndTime, self.AttackEnded)
             
             self.nextVictim() #currently there is no targeting system -- so just pick the next opponent in line
-            Debug("victim %s has been chosen" % self.victim, 5)
+            Debug("victim %s has been chosen", 5, self.victim)
             event = AttackEvent(self.evID, self.victim, damage)
             self.evManager.Notify(event)
     
@@ -79,6 +155,7 @@ class ActorModel(object):
         """Sets Actors current state to hurting and deducts damage from health"""
         self.state = ActorModel.STATE_HURTING
         self.HurtEndTime = self.time+self.HurtWait
+        self.SetTimer('hurt', self.HurtEndTime, self.HurtEnded)
         
         if self.health >= 0:
             self.health -= damage
@@ -94,27 +171,29 @@ class ActorModel(object):
     def Die(self):
         """Sets Actor's current state to dead"""
         self.state = ActorModel.STATE_DEAD
+        for name in self.timers.keys():
+            self.CancelTimer(name)
         
         event = DieEvent(self.evID)
         self.evManager.Notify(event)
-        self.evManager.UnregisterListener(self)
+        self.Unregister()
+    
+    def AttackEnded(self, time):
+        """Timer callback: ready to stop attacking"""
+        if self.state == ActorModel.STATE_ATTACKING and self.AttackEndTime <= time:
+            self.Wait()
+    
+    def HurtEnded(self, time):
+        """Timer callback: ready to stop hurting"""
+        if self.state == ActorModel.STATE_HURTING and self.HurtEndTime <= time:
+            self.Wait()
     
     def Notify(self, event):
         """Handles the following events:
-        TickEvent:
-            verify whether actor is currently still attacking or hurting based on 
-                duration values for these states
-        HurtEvent:
+        AttackEvent:
             if this actor is being attacked, call hurt
         """
-        if isinstance(event, TickEvent):
-            self.time = event.time
-            #ready to stop attacking
-            if self.state == ActorModel.STATE_ATTACKING and self.AttackEndTime <= self.time:
-                self.Wait()
-            if self.state == ActorModel.STATE_HURTING and self.HurtEndTime <= self.time:
-                self.Wait()
-        elif isinstance(event, AttackEvent) and event.object == self.evID:
+        if isinstance(event, AttackEvent) and event.object == self.evID:
             self.Hurt(event.damage)
 
 class HeroModel(ActorModel):
@@ -128,40 +207,70 @@ class HeroModel(ActorModel):
         * current problem being solved
         * amount of time left to solve current problem
     """ 
-    def __init__(self, evID, opponents):
-        ActorModel.__init__(self, evID, opponents)
-        self.solutionWait = 5000 #miliseconds
+    eventClasses = ActorModel.eventClasses + (RequestAttackEvent, SolveEvent)
+    timerCallbacks = dict(ActorModel.timerCallbacks, solution='SolutionTimedOut')
+    
+    def __init__(self, evID, opponents, solutionWait=5000, attackPower=60, backfirePower=(10, 20),
+            problems=None, evManager=None):
+        ActorModel.__init__(self, evID, opponents, evManager)
+        if problems is None: problems = ProblemRegistry(self.evManager)
+        self.problems = problems #where the problems for each attack come from
+        self.solutionWait = solutionWait #miliseconds
+        self.attackPower = attackPower #damage dealt by an instant correct solution
+        self.backfirePower = backfirePower #(minimum, time-dependent) damage taken for a wrong solution
         self.solEndTime = 0
         self.problem = None
     
+    def SaveState(self):
+        state = ActorModel.SaveState(self)
+        state['solEndTime'] = self.solEndTime
+        state['problem'] = None
+        if self.problem is not None:
+            state['problem'] = self.problems.SaveProblem(self.problem)
+        return state
+    
+    def LoadState(self, state, offset=0):
+        ActorModel.LoadState(self, state, offset)
+        self.solEndTime = state['solEndTime']
+        if self.solEndTime != 0:
+            self.solEndTime += offset
+        self.problem = None
+        if state['problem'] is not None:
+            self.problem = self.problems.LoadProblem(state['problem'])
+    
+    def SolutionTimedOut(self, time):
+        """Timer callback: the countdown timer has reached zero"""
+        if self.solEndTime != 0 and time >= self.solEndTime:
+            self.solEndTime = time #so that dmgOffset doesn't go negative
+            self.evManager.Notify(TimeoutSolveEvent('-1', time)) #always wrong answer
+    
     def Notify(self, event):
         """Handled events:
-        TickEvent:
-            Make sure countdown timer hasn't reached zero (if applicable)
         RequestAttackEvent:
-            Initiate a new attack
+            Initiate a new attack (and start the countdown timer)
         SolveEvent:
-            Solultion entered: Calculate damage and apply it appropriately
+            Solultion entered: Calculate damage (by when it was entered, if known, rather than
+                when the event arrives) and apply it appropriately
         """
         ActorModel.Notify(self, event)
         
-        if isinstance(event, TickEvent):
-            #deal with solution timeout
-            if self.solEndTime != 0 and self.time > self.solEndTime:
-                self.solEndTime = self.time #so that dmgOffset doesn't go negative
-                self.evManager.Notify(SolveEvent('-1')) #always wrong answer
-        elif isinstance(event, RequestAttackEvent):
-            self.problem = MultiplicationProblem()
-            prob = unicode(self.problem)
+        if isinstance(event, RequestAttackEvent):
+            self.problem = self.problems.Next()
+            prob = self.problem.question
             self.solEndTime = self.time+self.solutionWait
+            self.SetTimer('solution', self.solEndTime, self.SolutionTimedOut)
             self.evManager.Notify(RequestSolutionEvent(prob, self.solEndTime))
         elif isinstance(event, SolveEvent):
-            dmgOffset = 1.0*(self.solEndTime-self.time)/self.solutionWait
-            Debug("Damage Offset: %s" % dmgOffset, 2)
+            self.CancelTimer('solution')
+            solveTime = self.time
+            if event.time is not None:
+                solveTime = min(event.time, self.solEndTime)
+            dmgOffset = 1.0*(self.solEndTime-solveTime)/self.solutionWait
+            Debug("Damage Offset: %s", 2, dmgOffset)
             if event.solution.isdigit() and self.problem.solve(locale.atoi(event.solution)):
-                self.Attack(60*dmgOffset)
+                self.Attack(self.attackPower*dmgOffset)
             else:
-                self.Hurt(10+20*dmgOffset)
+                self.Hurt(self.backfirePower[0]+self.backfirePower[1]*dmgOffset)
             self.solEndTime = 0
 
 class EnemyModel(ActorModel):
@@ -170,22 +279,55 @@ class EnemyModel(ActorModel):
     Tracks the following data:
         * amount of time until next attack
     """
-    def __init__(self, evID, opponents, gameTime):
-        ActorModel.__init__(self, evID, opponents)
-        self.time = gameTime
-        self.attackWait = 10000 #milliseconds
-        self.nextAttack = self.time + random.randint(self.attackWait/2, self.attackWait)
-
-    def Notify(self, event):
-        ActorModel.Notify(self, event)
-        if isinstance(event, TickEvent):
-            if self.time > self.nextAttack  and self.state == self.STATE_WAITING:
-                self.Attack(10)
+    timerCallbacks = dict(ActorModel.timerCallbacks, nextAttack='AttackDue')
+    
+    def __init__(self, evID, opponents, gameTime, attackWait=10000, attackPower=10, rng=random,
+            evManager=None):
+        ActorModel.__init__(self, evID, opponents, evManager)
+        self.attackWait = attackWait #milliseconds
+        self.attackPower = attackPower
+        self.rng = rng #random number stream this enemy decides when to attack with (see RandomWait)
+        self.nextAttack = gameTime + self.RandomWait(self.attackWait/2, self.attackWait)
+        self.ScheduleAttack()
+    
+    def SaveState(self):
+        state = ActorModel.SaveState(self)
+        state['nextAttack'] = self.nextAttack
+        if self.rng is not None:
+            state['rng'] = SaveRandom(self.rng)
+        return state
+    
+    def LoadState(self, state, offset=0):
+        ActorModel.LoadState(self, state, offset)
+        self.nextAttack = state['nextAttack'] + offset
+        if self.rng is not None:
+            LoadRandom(self.rng, state['rng'])
+    
+    def RandomWait(self, low, high):
+        """Return a random number of milliseconds from low to high (inclusive), from this enemy's stream"""
+        return self.rng.randint(low, high)
+    
+    def ScheduleAttack(self):
+        """(Re)sets the timer for the next attack to nextAttack"""
+        if self.state != ActorModel.STATE_DEAD:
+            self.SetTimer('nextAttack', self.nextAttack, self.AttackDue)
+    
+    def AttackDue(self, time):
+        """Timer callback: time for the next attack (if not busy -- otherwise attack once waiting again)"""
+        if self.state == ActorModel.STATE_WAITING:
+            self.Attack(self.attackPower)
+    
+    def Wait(self):
+        ActorModel.Wait(self)
+        if self.time >= self.nextAttack:
+            self.Attack(self.attackPower)
     
     def Attack(self, damage):
         ActorModel.Attack(self, damage)
-        self.nextAttack += random.randint(self.attackWait/2, self.attackWait)        
+        self.nextAttack += self.RandomWait(self.attackWait/2, self.attackWait)
+        self.ScheduleAttack()
     
     def Hurt(self, damage):
         ActorModel.Hurt(self, damage)
-        self.nextAttack += random.randint(0, self.attackWait/2)
+        self.nextAttack += self.RandomWait(0, self.attackWait/2)
+        self.ScheduleAttack()
@@ -0,0 +1,284 @@
+"""Arena mode: the state of many actors kept in NumPy arrays, one slot per actor, so the
+actors can be updated all at once rather than one Python object at a time.  Needs NumPy."""
+from EventManager import *
+from actor import *
+
+import numpy
+
+class ActorArena(object):
+    """Keeps the health, state and timing of a number of actors in arrays indexed by slot, and
+    updates them with array operations: ending attacks & hurts, starting the attacks that are due
+    and applying the damage dealt to them.  Rather than a listener & timers for each actor, the
+    arena listens for attacks on behalf of all of them and sets a single timer for the earliest
+    deadline of any of them.  Each slot's deadline is kept in an array of its own, and only worked
+    out again for the slots that change (see Track), so an update only works on the slots that are
+    due, and an attack on the slot hit.  Events are only sent for the actors whose state has changed.
+    The actors themselves (see ArenaActor) are views over their slot"""
+    arrays = (('health', numpy.float64), ('maxHealth', numpy.float64), ('state', numpy.int8),
+              ('attackEnd', numpy.int64), ('hurtEnd', numpy.int64), ('nextAttack', numpy.float64),
+              ('AttackWait', numpy.int64), ('HurtWait', numpy.int64), ('attackWait', numpy.int64),
+              ('attackPower', numpy.float64), ('attacker', numpy.bool_), ('hit', numpy.bool_),
+              ('damage', numpy.float64), ('deadline', numpy.float64))
+
+    def __init__(self, evManager=None, capacity=64, seed=None):
+        if evManager is None: evManager = EventManager()
+        self.evManager = evManager
+        self.evManager.RegisterListener( self, (AttackEvent,) )
+
+        self.rng = numpy.random.RandomState(seed) #for when each actor attacks next
+        self.capacity = 0
+        for name, dtype in self.arrays:
+            setattr(self, name, numpy.zeros(0, dtype))
+        self.Grow(capacity)
+        self.actors = {} #slot -> actor
+        self.slots = {} #evID -> slot
+        self.free = [] #slots given back, to be reused
+        self.used = 0 #slots handed out so far (the arrays are only looked at up to here)
+        self.hits = [] #slots hit since damage was last applied
+        self.timer = None #handle of the timer for the next deadline
+        self.updating = False
+
+    def Grow(self, capacity):
+        """Make room for the given number of actors"""
+        for name, dtype in self.arrays:
+            array = numpy.zeros(capacity, dtype)
+            array[:self.capacity] = getattr(self, name)
+            setattr(self, name, array)
+        self.nextAttack[self.capacity:] = numpy.inf
+        self.deadline[self.capacity:] = numpy.inf
+        self.state[self.capacity:] = ActorModel.STATE_DEAD
+        self.capacity = capacity
+
+    def Allocate(self, actor):
+        """Return a slot for the given actor"""
+        if self.free:
+            slot = self.free.pop()
+        else:
+            if self.used == self.capacity:
+                self.Grow(self.capacity*2)
+            slot = self.used
+            self.used += 1
+        for name, dtype in self.arrays:
+            getattr(self, name)[slot] = 0
+        self.nextAttack[slot] = numpy.inf
+        self.deadline[slot] = numpy.inf
+        self.actors[slot] = actor
+        self.slots[actor.evID] = slot
+        return slot
+
+    def Release(self, actor):
+        """Give back an actor's slot, to be reused (the actor can't be used any more)"""
+        slot = self.slots.pop(actor.evID, None)
+        if slot is not None:
+            del self.actors[slot]
+            self.state[slot] = ActorModel.STATE_DEAD
+            self.hit[slot] = False
+            self.nextAttack[slot] = numpy.inf
+            self.deadline[slot] = numpy.inf
+            self.free.append(slot)
+
+    def Deadlines(self, slots):
+        """Return the game time each of the given slots is next due, by its state (inf if never)"""
+        state = self.state[slots]
+        return numpy.where(state == ActorModel.STATE_ATTACKING, self.attackEnd[slots],
+               numpy.where(state == ActorModel.STATE_HURTING, self.hurtEnd[slots],
+               numpy.where(self.attacker[slots] & (state == ActorModel.STATE_WAITING),
+                           self.nextAttack[slots], numpy.inf)))
+
+    def Track(self, slots):
+        """Note when the given slots are next due, after their state or timing has changed"""
+        if len(slots):
+            deadlines = self.Deadlines(slots)
+            self.deadline[slots] = deadlines
+            self.Wake(deadlines.min())
+
+    def NextDeadline(self):
+        """Return the earliest game time anything is due (inf if nothing is) -- a scan of every slot
+        in use, once per update.  Every update moves the earliest deadline on, so a cached minimum
+        would have to be worked out again each time anyway (this scan is why arena mode only pays
+        off for large crowds: see the README)"""
+        if not self.used:
+            return numpy.inf
+        return self.deadline[:self.used].min()
+
+    def Wake(self, deadline):
+        """Make sure the arena is updated by the given game time"""
+        if deadline == numpy.inf:
+            return
+        if self.timer is None or deadline < self.timer[0]:
+            if self.timer is not None:
+                self.evManager.CancelTimer(self.timer)
+            self.timer = self.evManager.SetTimer(deadline, self.Update)
+
+    def Schedule(self):
+        """Work out every slot's deadline afresh (after the arrays have been changed directly),
+        and (re)set the timer for the earliest"""
+        if self.timer is not None:
+            self.evManager.CancelTimer(self.timer)
+            self.timer = None
+        self.Track(numpy.arange(self.used))
+
+    def RandomInt(self, low, high):
+        """Return a random integer from low to high (inclusive), drawn the way RandomInts draws them"""
+        return low + int(self.rng.random_sample() * (high - low + 1))
+
+    def RandomInts(self, low, high):
+        """Return a random integer from low to high (inclusive) for each pair of the given arrays"""
+        return low + (self.rng.random_sample(len(high)) * (high - low + 1)).astype(numpy.int64)
+
+    def Update(self, time):
+        """Timer callback: end the attacks & hurts that are over, and start the attacks that are due"""
+        self.timer = None
+        self.updating = True #damage dealt meanwhile is applied all at once afterwards
+        slots = numpy.flatnonzero(self.deadline[:self.used] <= time)
+        try:
+            state = self.state[slots]
+            ended = ((state == ActorModel.STATE_ATTACKING) & (self.attackEnd[slots] <= time)) | \
+                    ((state == ActorModel.STATE_HURTING) & (self.hurtEnd[slots] <= time))
+            state[ended] = ActorModel.STATE_WAITING
+            self.state[slots] = state
+            for slot in slots[ended].tolist():
+                actor = self.actors.get(slot)
+                if actor is not None:
+                    self.evManager.Notify(WaitEvent(actor.evID))
+
+            due = slots[self.attacker[slots] & (state == ActorModel.STATE_WAITING) &
+                        (self.nextAttack[slots] <= time)]
+            if len(due):
+                self.state[due] = ActorModel.STATE_ATTACKING
+                self.attackEnd[due] = time + self.AttackWait[due]
+                attackWait = self.attackWait[due]
+                self.nextAttack[due] += self.RandomInts(attackWait//2, attackWait)
+                for slot in due.tolist():
+                    actor = self.actors.get(slot)
+                    if actor is None:
+                        continue
+                    actor.nextVictim()
+                    self.evManager.Notify(AttackEvent(actor.evID, actor.victim, actor.attackPower))
+        finally:
+            self.updating = False
+            self.Track(slots)
+        self.ApplyDamage(time)
+        self.Wake(self.NextDeadline())
+
+    def ApplyDamage(self, time):
+        """Hurt every actor that has been hit since damage was last applied"""
+        if not self.hits:
+            return
+        slots = numpy.unique(numpy.array(self.hits, numpy.int64))
+        self.hits = []
+        self.hit[slots] = False
+        hit = slots[self.state[slots] != ActorModel.STATE_DEAD]
+        damage = self.damage[hit]
+        self.damage[slots] = 0
+        self.state[hit] = ActorModel.STATE_HURTING
+        self.hurtEnd[hit] = time + self.HurtWait[hit]
+        self.health[hit] = numpy.maximum(self.health[hit] - damage, 0)
+        attackers = hit[self.attacker[hit]]
+        if len(attackers):
+            self.nextAttack[attackers] += self.RandomInts(0, self.attackWait[attackers]//2)
+        for slot in hit.tolist():
+            actor = self.actors.get(slot)
+            if actor is None:
+                continue
+            self.evManager.Notify(HurtEvent(actor.evID, actor.health/actor.maxHealth))
+            if actor.health == 0:
+                actor.Die()
+        self.Track(hit)
+
+    def SaveState(self):
+        """Return the state of the arena's random number stream as plain data (the actors are
+        saved by the Game, see Game.Snapshot)"""
+        name, internal, pos, hasGauss, gauss = self.rng.get_state()
+        return (name, internal.astype(numpy.uint32).tostring(), pos, hasGauss, gauss)
+
+    def LoadState(self, state):
+        name, internal, pos, hasGauss, gauss = state
+        self.rng.set_state((name, numpy.fromstring(internal, numpy.uint32), pos, hasGauss, gauss))
+        self.Schedule()
+
+    def Notify(self, event):
+        """Handled events:
+        AttackEvent:
+            If one of the arena's actors is attacked, hurt it (straight away, unless the arena is
+                being updated -- then all the damage is applied at once after the update)
+        """
+        slot = self.slots.get(event.object)
+        if slot is None:
+            return
+        if not self.hit[slot]:
+            self.hit[slot] = True
+            self.hits.append(slot)
+        self.damage[slot] += event.damage
+        if not self.updating:
+            self.ApplyDamage(self.evManager.time)
+
+def SlotProperty(name, convert):
+    """A property for an actor attribute kept in the arena array of the given name"""
+    def Get(self):
+        return convert(getattr(self.arena, name)[self.slot])
+    def Set(self, value):
+        getattr(self.arena, name)[self.slot] = value
+    return property(Get, Set)
+
+class ArenaActor(object):
+    """Mixin for an ActorModel that keeps its state in a slot of an ActorArena rather than in its
+    own attributes, and leaves its timing to the arena (along with being notified of attacks)"""
+    health = SlotProperty('health', float)
+    maxHealth = SlotProperty('maxHealth', float)
+    state = SlotProperty('state', int)
+    AttackEndTime = SlotProperty('attackEnd', int)
+    HurtEndTime = SlotProperty('hurtEnd', int)
+    AttackWait = SlotProperty('AttackWait', int)
+    HurtWait = SlotProperty('HurtWait', int)
+    attackPower = SlotProperty('attackPower', float)
+
+    def __init__(self, arena, evID):
+        self.arena = arena
+        self.evID = evID
+        self.slot = arena.Allocate(self)
+
+    def Register(self):
+        pass #the arena listens for all its actors
+
+    def Unregister(self):
+        pass
+
+    def Remove(self):
+        self.arena.Release(self)
+
+    def SetTimer(self, name, deadline, callback):
+        self.arena.Track([self.slot]) #the deadline itself is in the arena's arrays
+
+    def CancelTimer(self, name):
+        pass #the arena goes by state, so a deadline that no longer applies is ignored
+
+    def LoadState(self, state, offset=0):
+        super(ArenaActor, self).LoadState(state, offset)
+        self.arena.Track([self.slot])
+
+class ArenaEnemyModel(ArenaActor, EnemyModel):
+    """An EnemyModel kept in an ActorArena, drawing when it attacks from the arena's random
+    number stream (like the arena's own updates) rather than one of its own"""
+    nextAttack = SlotProperty('nextAttack', float)
+    attackWait = SlotProperty('attackWait', int)
+    settings = ('attackWait', 'attackPower', 'AttackWait', 'HurtWait') #saved with the actor's state
+
+    def __init__(self, evID, opponents, gameTime, arena, attackWait=10000, attackPower=10, evManager=None):
+        ArenaActor.__init__(self, arena, evID)
+        arena.attacker[self.slot] = True
+        EnemyModel.__init__(self, evID, opponents, gameTime, attackWait, attackPower, None, evManager)
+
+    def RandomWait(self, low, high):
+        return self.arena.RandomInt(low, high)
+
+    def SaveState(self):
+        state = super(ArenaEnemyModel, self).SaveState()
+        for name in self.settings:
+            state[name] = getattr(self, name)
+        return state
+
+    def LoadState(self, state, offset=0):
+        for name in self.settings:
+            setattr(self, name, state[name])
+        super(ArenaEnemyModel, self).LoadState(state, offset)
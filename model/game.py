@@ -4,6 +4,7 @@ from actor import *
 
 import random
 import locale
+import marshal
 
 class Game(object):
     """Responsible for setting the stage:
@@ -16,9 +17,10 @@ class Game(object):
     STATE_PAUSED = 2
     STATE_GAMEOVER = 3
 
-    def __init__(self):
-        self.evManager = EventManager()
-        self.evManager.RegisterListener( self )
+    def __init__(self, evManager=None, seed=None, arena=False):
+        if evManager is None: evManager = EventManager()
+        self.evManager = evManager
+        self.evManager.RegisterListener( self, (TickEvent, DieEvent, NextBattleEvent) )
 
         self.state = Game.STATE_PREPARING
         self.heroes = {}
@@ -28,6 +30,22 @@ class Game(object):
         self.time = 0
         self.solutionWait = 5000 #milliseconds
         self.solEndTime = 0
+        
+        #each source of randomness gets its own stream, seeded from the game's seed, so a game
+        #can be replayed from its seed however the streams are interleaved
+        if seed is None: seed = random.getrandbits(32)
+        self.seed = seed
+        self.seeds = random.Random(seed) #seeds for the streams
+        self.problemRandom = random.Random(self.seeds.getrandbits(32))
+        self.problems = ProblemRegistry(self.evManager, rng=self.problemRandom)
+        self.heroSettings = {} #keyword arguments for each HeroModel spawned
+        self.enemySettings = {} #keyword arguments for each EnemyModel spawned
+        
+        #in arena mode, enemies are kept in the arrays of an ActorArena (which needs NumPy)
+        self.arena = None
+        if arena:
+            from arena import ActorArena
+            self.arena = ActorArena(self.evManager, seed=self.seeds.getrandbits(32))
 
     def Start(self):
         """starts the game action -- spawning any Actors needed, setting required variables
@@ -36,18 +54,117 @@ class Game(object):
         self.SpawnEnemy()
             
         self.state = Game.STATE_RUNNING
-        self.evManager.Notify(GameStartedEvent(self))
+        self.evManager.Notify(GameStartedEvent(self, self.seed))
 
-    def SpawnHero(self):
-        self.heroes["hero"] = HeroModel("hero", self.enemies)
-        self.evManager.Notify(SpawnHeroEvent(self.heroes["hero"].evID))
+    def SpawnHero(self, heroID="hero"):
+        self.heroes[heroID] = HeroModel(heroID, self.enemies, problems=self.problems, evManager=self.evManager,
+                                        **self.heroSettings)
+        self.evManager.Notify(SpawnHeroEvent(heroID))
     
-    def SpawnEnemy(self):
-        self.enemyCount += 1
-        enemyID = "enemy%s" % self.enemyCount
-        self.enemies[enemyID] = EnemyModel(enemyID, self.heroes, self.time)
+    def SpawnEnemy(self, enemyID=None):
+        if enemyID is None:
+            self.enemyCount += 1
+            enemyID = "enemy%s" % self.enemyCount
+        if self.arena is not None: #(arena enemies share the arena's stream)
+            from arena import ArenaEnemyModel
+            self.enemies[enemyID] = ArenaEnemyModel(enemyID, self.heroes, self.evManager.time, self.arena,
+                                                    evManager=self.evManager, **self.enemySettings)
+        else:
+            rng = random.Random(self.seeds.getrandbits(32))
+            self.enemies[enemyID] = EnemyModel(enemyID, self.heroes, self.evManager.time, rng=rng,
+                                               evManager=self.evManager, **self.enemySettings)
         self.evManager.Notify(SpawnEnemyEvent(enemyID))
     
+    def RemoveActor(self, actors, evID):
+        """Drop an actor from the game (quietly -- this doesn't kill it)"""
+        actors.pop(evID).Remove()
+    
+    def Snapshot(self):
+        """Return the state of the game and its actors (health, timers, problems, random streams...)
+        as a compact string of bytes, for Restore"""
+        timers = []
+        for actors in (self.heroes, self.enemies):
+            for evID, actor in actors.items():
+                timers.extend([(count, evID, name, deadline) for count, name, deadline in actor.PendingTimers()])
+        timers.sort()
+        return marshal.dumps({
+            'time': self.evManager.time,
+            'gameTime': self.time,
+            'state': self.state,
+            'enemyCount': self.enemyCount,
+            'seed': self.seed,
+            'seeds': SaveRandom(self.seeds),
+            'problemRandom': SaveRandom(self.problemRandom),
+            'problems': self.problems.SaveState(),
+            'heroSettings': self.heroSettings,
+            'enemySettings': self.enemySettings,
+            'heroes': dict([(evID, hero.SaveState()) for evID, hero in self.heroes.items()]),
+            'enemies': dict([(evID, enemy.SaveState()) for evID, enemy in self.enemies.items()]),
+            'timers': [(evID, name, deadline) for count, evID, name, deadline in timers],
+            'arena': self.arena and self.arena.SaveState(),
+        })
+    
+    def Restore(self, snapshot, time=None):
+        """Put the game back into the state saved by Snapshot, in place -- actors missing from the
+        game are spawned, and any that weren't in the snapshot are removed.  The snapshot's times
+        are moved on to the given game time (by default the current one), so a game can be picked up
+        again by a new session (whose clock has started again).  Views & controllers are then sent
+        the restored game (see NotifyRestored)"""
+        state = marshal.loads(snapshot)
+        if time is None: time = self.evManager.time
+        offset = time - state['time']
+        
+        self.heroSettings = state['heroSettings']
+        self.enemySettings = state['enemySettings']
+        for actors, saved, Spawn in ((self.heroes, state['heroes'], self.SpawnHero),
+                                     (self.enemies, state['enemies'], self.SpawnEnemy)):
+            for evID in actors.keys():
+                if evID not in saved:
+                    self.RemoveActor(actors, evID)
+            for evID in sorted(saved):
+                if evID not in actors:
+                    Spawn(evID)
+            for evID, actor in actors.items():
+                for name in actor.timers.keys():
+                    actor.CancelTimer(name)
+                actor.LoadState(saved[evID], offset)
+        for evID, name, deadline in state['timers']: #in the order they were set
+            actors = self.heroes
+            if evID not in actors: actors = self.enemies
+            actors[evID].RestoreTimer(name, deadline + offset)
+        
+        self.time = state['gameTime'] + offset
+        self.state = state['state']
+        self.enemyCount = state['enemyCount']
+        self.seed = state['seed']
+        LoadRandom(self.seeds, state['seeds']) #after spawning, which takes seeds from the stream
+        LoadRandom(self.problemRandom, state['problemRandom'])
+        self.problems.LoadState(state['problems'])
+        if self.arena is not None and state.get('arena'):
+            self.arena.LoadState(state['arena'])
+        self.NotifyRestored()
+    
+    def NotifyRestored(self):
+        """Let the views & controllers know the game has been restored, and send them what they
+        show or go by again: how the battle ended (if it has), each actor, its state & health and
+        the problem the hero is solving (if any)"""
+        endEvent = None
+        if self.state == Game.STATE_GAMEOVER:
+            endEvent = GameOverEvent
+        elif self.state == Game.STATE_RUNNING and self.enemyCount and not self.enemies:
+            endEvent = VictoryEvent
+        self.evManager.Notify(GameRestoredEvent(endEvent))
+        for actors, SpawnEvent in ((self.heroes, SpawnHeroEvent), (self.enemies, SpawnEnemyEvent)):
+            for evID in sorted(actors):
+                actor = actors[evID]
+                self.evManager.Notify(SpawnEvent(evID))
+                self.evManager.Notify(ActorRestoredEvent(evID, actor.stateEvents[actor.state],
+                                                         1.0*actor.health/actor.maxHealth))
+        for evID in sorted(self.heroes):
+            hero = self.heroes[evID]
+            if hero.solEndTime != 0 and hero.state != ActorModel.STATE_DEAD: #waiting for a solution
+                self.evManager.Notify(RequestSolutionEvent(hero.problem.question, hero.solEndTime))
+    
     def myOpponents(self, actor):
         if isinstance(actor, Hero):
             return self.enemies
@@ -81,6 +198,6 @@ class Game(object):
                     #del self.heroes[event.subject]
                 elif event.subject in self.enemies.keys():
                     self.evManager.Notify(VictoryEvent())
-                    del self.enemies[event.subject]
+                    self.RemoveActor(self.enemies, event.subject)
             elif isinstance(event, NextBattleEvent):
                 self.SpawnEnemy()
\ No newline at end of file
@@ -1,13 +1,16 @@
 from EventManager import *
 
 import random
+from bisect import bisect
 
-class Cateogry(object):
+class Category(object):
     def __init__(self, name):
         self.name = name
         self.types = {}
     def __str__(self):
-        return name
+        return self.name
+
+Cateogry = Category #old (misspelled) name
 
 class Type(object):
     def __init__(self, name, category):
@@ -16,34 +19,237 @@ class Type(object):
         self.levels = {}
     def __str__(self):
         return "%s.%s" % (self.category, self.name)
-    
+
 class Level(object):
-    def __init__(self, name, type):
+    """A level of difficulty of a type of problem
+        generator: function(level, rng) returning a new problem for this level -- without one,
+            problems are drawn from the ones added to the level
+        weight: how often this level is chosen, relative to the others"""
+    def __init__(self, name, type, generator=None, weight=1):
         self.name = name
         self.type = type
+        self.generator = generator
+        self.weight = weight
         self.problems = []
+    def key(self):
+        """(category, type, level) names, which the level is registered under"""
+        return (self.type.category.name, self.type.name, self.name)
+    def generate(self, rng=random):
+        if self.generator is not None:
+            return self.generator(self, rng)
+        return rng.choice(self.problems)
     def __str__(self):
         return "%s.%s" % (self.type, self.name)
 
 class Problem(object):
-    def __init__(self, question, solution, level):
+    def __init__(self, question, solution, level=None):
         self.question = question
         self.solution = solution
         self.level = level
     def solve(self, solution):
         return self.solution == solution
+    def args(self):
+        """The arguments the problem can be recreated from (besides its level)"""
+        return (self.question, self.solution)
+    def __unicode__(self):
+        return self.question
     def __str__(self):
-        return "%s.%s" % (self.level, self.name)
+        return "%s: %s" % (self.level, self.question)
 
 class MultiplicationProblem(Problem):
-    """Creates random multiplicands, and determines whether a solution is correct"""
-    def __init__(self, *args):
-        #Problem.__init__(self, *args)
-        random.seed()
-        self.a = random.randint(0,10)
-        self.b = random.randint(0,10)
+    """Multiplication of two numbers (random multiplicands from 0 to 10 if they aren't given)"""
+    def __init__(self, a=None, b=None, level=None):
+        if a is None: a = random.randint(0,10)
+        if b is None: b = random.randint(0,10)
+        self.a = a
+        self.b = b
+        Problem.__init__(self, unicode(a)+u' X '+unicode(b), a*b, level)
     def solve(self, solution):
-        if solution == 00 and debug > 3: return True
-        return self.a * self.b == solution
-    def __unicode__(self):
-        return unicode(self.a)+u' X '+unicode(self.b)
\ No newline at end of file
+        if solution == 00 and DebugLevel() > 3: return True #cheat, when debugging
+        return self.solution == solution
+    def args(self):
+        return (self.a, self.b)
+
+#problem classes by name, for recreating problems from a snapshot
+problemClasses = dict([(cls.__name__, cls) for cls in (Problem, MultiplicationProblem)])
+
+def MultiplicationLevels(type, maxFactor=10):
+    """Split the multiplication tables into levels of difficulty -- 0 X 5 is easier than 3 X 4
+        is easier than 6 X 7.  Each level is weighted by the number of problems in it, so they
+        come up as often as if the multiplicands were chosen at random"""
+    levels = {'easy': [], 'medium': [], 'hard': []}
+    for a in range(maxFactor+1):
+        for b in range(maxFactor+1):
+            if min(a, b) <= 1 or max(a, b) == 10:
+                levels['easy'].append((a, b))
+            elif max(a, b) <= 5:
+                levels['medium'].append((a, b))
+            else:
+                levels['hard'].append((a, b))
+    result = []
+    for name in ('easy', 'medium', 'hard'):
+        factors = levels[name]
+        if factors:
+            generator = lambda level, rng, factors=factors: \
+                MultiplicationProblem(*rng.choice(factors), level=level)
+            result.append(Level(name, type, generator, len(factors)))
+    return result
+
+class ProblemRegistry(object):
+    """Keeps the problems that can be set for an attack, by category, type and level of difficulty.
+    Problems are generated ahead of time into a pool for each level, topped up a few at a time on
+    each tick, so handing one out when the hero attacks is just a pop from the pool of a level
+    chosen by weight.  Categories, types, levels and problems can be added through
+    the AddProblem*Events"""
+    def __init__(self, evManager=None, poolSize=16, refillPerTick=2, rng=random, defaults=True):
+        if evManager is None: evManager = EventManager()
+        self.evManager = evManager
+        self.evManager.RegisterListener( self, (TickEvent, AddProblemCategoryEvent, AddProblemTypeEvent,
+                                                AddProblemLevelEvent, AddProblemEvent) )
+        self.poolSize = poolSize #problems generated ahead of time for each level
+        self.refillPerTick = refillPerTick #most problems generated on each tick
+        self.rng = rng
+        self.categories = {}
+        self.levels = {} #(category, type, level) names -> Level
+        self.levelKeys = [] #...in order, so levels are always filled & weighed in the same order
+        self.pools = {} #(category, type, level) names -> problems generated ahead of time
+        self.weights = [] #cumulative weights of the levels, for choosing one
+        self.weightKeys = [] #...and the level each weight belongs to
+        self.full = False #whether every pool is full (so there's nothing for a tick to top up)
+        if defaults:
+            self.AddDefaults()
+        self.Refill()
+
+    def AddDefaults(self):
+        """Add multiplication (the only kind of problem so far)"""
+        math = Category("math")
+        multiplication = Type("multiplication", math)
+        self.AddCategory(math)
+        self.AddType(multiplication)
+        for level in MultiplicationLevels(multiplication):
+            self.AddLevel(level)
+
+    def AddCategory(self, category):
+        self.categories[category.name] = category
+
+    def AddType(self, type):
+        if type.category.name not in self.categories:
+            self.AddCategory(type.category)
+        type.category.types[type.name] = type
+
+    def AddLevel(self, level):
+        if level.type.name not in level.type.category.types:
+            self.AddType(level.type)
+        level.type.levels[level.name] = level
+        key = level.key()
+        self.levels[key] = level
+        self.levelKeys = sorted(self.levels)
+        self.pools.setdefault(key, [])
+        self.full = False
+        self.UpdateWeights()
+
+    def AddProblem(self, problem):
+        """Add a fixed problem to its level
+            only levels without a generator hand out their fixed problems"""
+        if problem.level.key() not in self.levels:
+            self.AddLevel(problem.level)
+        problem.level.problems.append(problem)
+        self.full = False
+        self.UpdateWeights()
+
+    def SetWeight(self, key, weight):
+        """Change how often the level with the given (category, type, level) names is chosen"""
+        self.levels[key].weight = weight
+        self.UpdateWeights()
+
+    def UpdateWeights(self):
+        """Work out the cumulative weights -- if every level is weighted 0, they are all
+            chosen evenly rather than none of them"""
+        self.weights = []
+        self.weightKeys = []
+        total = 0
+        usable = [key for key in self.levelKeys if self.levels[key].generator or self.levels[key].problems]
+        weighted = [key for key in usable if self.levels[key].weight > 0]
+        for key in weighted:
+            total += self.levels[key].weight
+            self.weights.append(total)
+            self.weightKeys.append(key)
+        if not weighted:
+            self.weights = range(1, len(usable)+1)
+            self.weightKeys = usable
+
+    def ChooseLevel(self):
+        """Return the (category, type, level) names of a level, chosen by weight"""
+        if not self.weights:
+            raise ValueError("no level has any problems to choose from")
+        return self.weightKeys[bisect(self.weights, self.rng.random()*self.weights[-1])]
+
+    def Next(self, key=None):
+        """Hand out a problem from the given level (or from one chosen by weight)"""
+        if key is None:
+            key = self.ChooseLevel()
+        pool = self.pools[key]
+        if pool:
+            self.full = False
+            return pool.pop()
+        return self.levels[key].generate(self.rng) #the pool couldn't keep up
+
+    def Refill(self, limit=None):
+        """Generate problems for the pools that aren't full, no more than limit of them
+            returns the number generated"""
+        if self.full:
+            return 0
+        generated = 0
+        for key in self.levelKeys:
+            level = self.levels[key]
+            pool = self.pools[key]
+            if not level.generator and not level.problems:
+                continue
+            while len(pool) < self.poolSize:
+                if limit is not None and generated >= limit:
+                    return generated
+                pool.append(level.generate(self.rng))
+                generated += 1
+        self.full = True
+        return generated
+
+    def SaveProblem(self, problem):
+        """Return a problem as plain data: (level names, class name, args)"""
+        key = None
+        if problem.level is not None:
+            key = problem.level.key()
+        return (key, problem.__class__.__name__, problem.args())
+
+    def LoadProblem(self, saved):
+        """Recreate a problem saved by SaveProblem"""
+        key, className, args = saved
+        return problemClasses[className](*args, level=self.levels.get(key))
+
+    def SaveState(self):
+        """Return the problems waiting in the pools as plain data"""
+        return dict([(key, [self.SaveProblem(problem) for problem in pool]) for key, pool in self.pools.items()])
+
+    def LoadState(self, state):
+        """Put back the problems saved by SaveState (for the levels this registry has)"""
+        for key, pool in state.items():
+            if key in self.pools:
+                self.pools[key] = [self.LoadProblem(saved) for saved in pool]
+        self.full = False
+
+    def Notify(self, event):
+        """Handled events:
+        TickEvent:
+            Top up the problem pools (a few problems at a time)
+        AddProblemCategoryEvent, AddProblemTypeEvent, AddProblemLevelEvent, AddProblemEvent:
+            Add the category, type, level or problem
+        """
+        if isinstance(event, TickEvent):
+            self.Refill(self.refillPerTick)
+        elif isinstance(event, AddProblemCategoryEvent):
+            self.AddCategory(event.category)
+        elif isinstance(event, AddProblemTypeEvent):
+            self.AddType(event.type)
+        elif isinstance(event, AddProblemLevelEvent):
+            self.AddLevel(event.level)
+        elif isinstance(event, AddProblemEvent):
+            self.AddProblem(event.problem)
@@ -0,0 +1,80 @@
+from timeit import default_timer
+from collections import deque
+
+def Percentiles(values, percents=(0, 10, 50, 90, 100)):
+	"""Return the given percentiles (nearest rank) of a list of numbers, as a dict"""
+	values = sorted(values)
+	result = {}
+	for p in percents:
+		if values:
+			result[p] = values[min(len(values)-1, int(len(values)*p/100.0))]
+		else:
+			result[p] = None
+	return result
+
+class Histogram(object):
+	"""Counts values in buckets of a fixed width (e.g. latencies in ms), keeping every value
+		seen rather than a rolling window"""
+	def __init__(self, bucketWidth=5):
+		self.bucketWidth = bucketWidth
+		self.buckets = {} #bucket start -> count
+		self.count = 0
+		self.total = 0
+
+	def Add(self, value):
+		bucket = value//self.bucketWidth*self.bucketWidth
+		self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+		self.count += 1
+		self.total += value
+
+	def Counts(self):
+		"""Return (bucket start, count) for every bucket with something in it, in order"""
+		return sorted(self.buckets.items())
+
+	def Percentile(self, p):
+		"""Return the start of the bucket holding the given percentile (nearest rank)"""
+		if not self.count:
+			return None
+		rank = min(self.count-1, int(self.count*p/100.0))
+		for bucket, count in self.Counts():
+			if rank < count:
+				return bucket
+			rank -= count
+
+	def Mean(self):
+		if not self.count:
+			return None
+		return 1.0*self.total/self.count
+
+class Profiler(object):
+	"""Keeps the latest timings (in seconds) of each thing being measured, so their
+		percentiles can be reported as they change.  Timings are filed by category
+		(e.g. 'listener', 'event', 'view') and the name of what was timed"""
+	def __init__(self, window=200):
+		self.window = window #number of timings kept for each thing measured
+		self.samples = {} #(category, name) -> deque of the latest timings
+
+	def Record(self, category, name, seconds):
+		"""Add a timing, pushing out the oldest one if the window is full"""
+		try:
+			samples = self.samples[(category, name)]
+		except KeyError:
+			samples = self.samples[(category, name)] = deque(maxlen=self.window)
+		samples.append(seconds)
+
+	def Timings(self, category, name, percents=(50, 90, 99)):
+		"""Return the given percentiles of the timings kept for something, as a dict"""
+		return Percentiles(self.samples.get((category, name), ()), percents)
+
+	def Report(self, category=None, percents=(50, 90, 99), limit=None):
+		"""Return (category, name, count, percentiles) for everything measured (or only
+			for the given category), slowest first by the highest percentile"""
+		report = []
+		for (cat, name), samples in self.samples.items():
+			if category is None or cat == category:
+				report.append((cat, name, len(samples), Percentiles(samples, percents)))
+		report.sort(key=lambda entry: entry[3][percents[-1]], reverse=True)
+		return report[:limit]
+
+	def Clear(self):
+		self.samples.clear()
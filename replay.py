@@ -0,0 +1,293 @@
+"""Records battles to a compact binary log, and plays them back.
+
+A log starts with a header, followed by a record for each event dispatched (other than
+ticks and renders) and for the ticks the game clock doesn't reach by its regular step:
+	header: MAGIC, then a 2 byte length and a marshalled dict of the event manager settings
+	record: 4 byte milliseconds since the previous record, 1 byte event code (0 for a tick),
+		2 byte length and the marshalled tuple of the event's slots
+Since a Game plays out the same way from its seed (see GameStartedEvent), only the player's
+input needs to be fed back in to replay it -- the rest of the log is compared with what the
+game does during the replay, to check that it still does the same thing.
+
+	python replay.py [--realtime] logfile
+"""
+from EventManager import *
+from model import *
+
+import marshal
+import struct
+import time
+
+MAGIC = "MMLG\x01"
+RECORD = struct.Struct("<IBH")
+
+#event classes by code (the position in this list, plus one) -- only ever add to the end
+LOGGED_EVENTS = [QuitEvent, GameStartedEvent, NextBattleEvent, SpawnHeroEvent, SpawnEnemyEvent,
+	RequestAttackEvent, RequestSolutionEvent, SolutionUpdateEvent, SolveEvent, TimeoutSolveEvent,
+	GameOverEvent, VictoryEvent, WaitEvent, AttackEvent, DefendEvent, HurtEvent, DieEvent]
+EVENT_CODES = dict([(eventClass, i+1) for i, eventClass in enumerate(LOGGED_EVENTS)])
+
+#events that come from the player rather than the game, which are fed back in on replay
+INPUT_EVENTS = (QuitEvent, NextBattleEvent, RequestAttackEvent, SolutionUpdateEvent, SolveEvent)
+
+def EventSlots(eventClass):
+	"""Return the names of an event class's slots, its superclasses' first"""
+	slots = []
+	for cls in reversed(eventClass.__mro__):
+		slots.extend(cls.__dict__.get('__slots__', ()))
+	return slots
+
+def EncodeEvent(event):
+	"""Return the code and values an event is logged with (None if it isn't logged)"""
+	eventClass = event.__class__
+	code = EVENT_CODES.get(eventClass)
+	if code is None:
+		return None
+	if eventClass is GameStartedEvent: #log what the game can be recreated from, not the game itself
+		return code, (event.seed, event.game.heroSettings, event.game.enemySettings)
+	return code, tuple([getattr(event, slot) for slot in EventSlots(eventClass)])
+
+def DecodeEvent(code, values):
+	"""Recreate an event logged by EncodeEvent"""
+	eventClass = LOGGED_EVENTS[code-1]
+	event = eventClass.__new__(eventClass)
+	if eventClass is GameStartedEvent:
+		event.game = None
+		event.seed = values[0]
+		return event
+	for slot, value in zip(EventSlots(eventClass), values):
+		setattr(event, slot, value)
+	return event
+
+class BattleRecorder(object):
+	"""Writes every event dispatched (but ticks & renders) to a new battle log (replacing any file
+		of that name), along with the ticks that aren't a regular step after the one before.
+		Writes are buffered: the log is flushed when the game ends or quits, and on Close"""
+	def __init__(self, filename, evManager=None, bufferSize=65536):
+		if evManager is None: evManager = EventManager()
+		self.evManager = evManager
+		self.evManager.RegisterListener( self )
+
+		self.file = open(filename, "wb", bufferSize) #a log holds a single recording
+		header = marshal.dumps({'queued': evManager.queued, 'maxEventsPerTick': evManager.maxEventsPerTick})
+		self.file.write(MAGIC + struct.pack("<H", len(header)) + header)
+		self.lastTime = 0 #time of the last record written
+		self.lastTick = None #time of the last tick
+		self.records = 0
+
+	def Write(self, time, code, values):
+		payload = marshal.dumps(values)
+		self.file.write(RECORD.pack(time - self.lastTime, code, len(payload)) + payload)
+		self.lastTime = time
+		self.records += 1
+
+	def Close(self):
+		if not self.file.closed:
+			self.file.close()
+		self.evManager.UnregisterListener( self )
+
+	def Notify(self, event):
+		"""Handled events:
+		TickEvent:
+			Record the first tick, and any tick that isn't a regular step after the last one
+		GameOverEvent, QuitEvent:
+			Record it, and flush the log
+		Any other (logged) event:
+			Record it, at the current game time
+		"""
+		if isinstance(event, TickEvent):
+			if self.lastTick is None or event.time - self.lastTick != event.dtime:
+				self.Write(event.time, 0, (self.lastTick, event.dtime))
+			self.lastTick = event.time
+			return
+		encoded = EncodeEvent(event)
+		if encoded is not None and not self.file.closed:
+			self.Write(self.evManager.time, *encoded)
+			if isinstance(event, (GameOverEvent, QuitEvent)):
+				self.file.flush()
+
+def ReadLog(filename):
+	"""Return the header of a battle log and its records, as (time, code, values)"""
+	logFile = open(filename, "rb")
+	try:
+		data = logFile.read()
+	finally:
+		logFile.close()
+	if not data.startswith(MAGIC):
+		raise ValueError("'%s' is not a battle log" % filename)
+	offset = len(MAGIC)
+	length, = struct.unpack_from("<H", data, offset)
+	offset += 2
+	header = marshal.loads(data[offset:offset+length])
+	offset += length
+	records = []
+	time = 0
+	while offset < len(data):
+		delta, code, length = RECORD.unpack_from(data, offset)
+		offset += RECORD.size
+		time += delta
+		records.append((time, code, marshal.loads(data[offset:offset+length])))
+		offset += length
+	return header, records
+
+class ReplayController(object):
+	"""Plays a battle log back through a fresh Game: ticks the game clock as it was ticked
+		in the log (as fast as possible, or in real time), feeding the player's input back in
+		at the tick it was originally dispatched on, and compares everything else the game does
+		with the log.  Creates the game itself, so as to be notified of each tick after it (as the
+		player's input was when recorded).
+		A snapshot of the game is taken every snapshotInterval ms of game time, so the replay can
+		Seek back without playing it all again from the start"""
+	def __init__(self, filename, evManager=None, snapshotInterval=5000):
+		if evManager is None: evManager = EventManager()
+		self.evManager = evManager
+
+		self.header, records = ReadLog(filename)
+		self.evManager.SetQueued(self.header['queued'], self.header['maxEventsPerTick'])
+		self.inputs = {} #time -> input events dispatched then
+		self.jumps = {} #tick time -> time of the next tick, where it isn't a regular step
+		self.expected = [] #(time, code, values) of everything else logged
+		self.seed = None
+		self.heroSettings = {}
+		self.enemySettings = {}
+		self.firstTick = None
+		self.step = None
+		self.endTime = 0
+		for time, code, values in records:
+			self.endTime = max(self.endTime, time)
+			if code == 0:
+				lastTick, self.step = values
+				if lastTick is None:
+					if self.firstTick is None: self.firstTick = time
+				else:
+					self.jumps[lastTick] = time
+			elif LOGGED_EVENTS[code-1] in INPUT_EVENTS:
+				event = DecodeEvent(code, values)
+				if hasattr(event, 'wallTime'):
+					event.wallTime = None #the keypress wasn't now, so there's no latency to measure
+				self.inputs.setdefault(time, []).append(event)
+			else:
+				if LOGGED_EVENTS[code-1] is GameStartedEvent and self.seed is None:
+					self.seed, self.heroSettings, self.enemySettings = values
+				self.expected.append((time, code, values))
+		self.replayed = [] #(time, code, values) of what the game has done during the replay
+		self.keepGoing = 1
+		self.restoring = False
+		self.time = None #time of the last tick dispatched
+		self.nextTick = self.firstTick
+
+		self.game = Game.NewInstance(self.evManager, self.seed)
+		self.game.heroSettings = self.heroSettings
+		self.game.enemySettings = self.enemySettings
+		self.evManager.RegisterListener( self )
+		self.snapshotInterval = snapshotInterval
+		self.snapshots = [] #(time, next tick time, game snapshot, number of events replayed by then)
+		self.TakeSnapshot()
+
+	def TakeSnapshot(self):
+		self.snapshots.append((self.evManager.time, self.nextTick, self.game.Snapshot(), len(self.replayed)))
+
+	def Run(self, realTime=False, maxfps=40, until=None):
+		"""Tick through the log (up to the given time, or to the end), rendering maxfps times a
+			second when playing in real time
+			returns the number of differences between what the game did and what was logged"""
+		start = time.time()
+		startTime = self.nextTick
+		lastRender = None
+		while self.keepGoing and self.nextTick is not None and (until is None or self.nextTick <= until):
+			self.time = self.nextTick
+			self.evManager.NotifyTick( self.time, self.step )
+			if realTime:
+				wait = start + (self.time - startTime)/1000.0 - time.time()
+				if wait > 0:
+					time.sleep(wait)
+				if lastRender is None or self.time - lastRender >= 1000/maxfps:
+					self.evManager.NotifyRender( self.time )
+					lastRender = self.time
+			if self.time >= self.endTime:
+				self.nextTick = None
+			else:
+				self.nextTick = self.jumps.get(self.time, self.time + self.step)
+			if self.time - self.snapshots[-1][0] >= self.snapshotInterval and not self.evManager.eventQueue:
+				self.TakeSnapshot()
+		return self.Differences()
+
+	def Seek(self, target):
+		"""Move the replay to the given game time: going back to the last snapshot before it if
+			it has already been passed, then ticking on up to it"""
+		if self.time is not None and target < self.time:
+			index = 0
+			for i, snapshot in enumerate(self.snapshots):
+				if snapshot[0] <= target:
+					index = i
+			snapshotTime, self.nextTick, snapshot, replayed = self.snapshots[index]
+			del self.snapshots[index+1:]
+			self.evManager.time = snapshotTime
+			self.restoring = True #actors spawned back into the game aren't part of the replay
+			try:
+				self.game.Restore(snapshot)
+			finally:
+				self.restoring = False
+			del self.replayed[replayed:]
+			self.time = snapshotTime
+			self.keepGoing = 1
+		self.Run(until=target)
+
+	def Differences(self):
+		"""Return the number of events that differ between the log and the replay (sorted by time,
+			since listeners see nested events in a different order depending on when they registered)"""
+		differences = abs(len(self.expected) - len(self.replayed))
+		for logged, replayed in zip(sorted(self.expected), sorted(self.replayed)):
+			if logged != replayed:
+				differences += 1
+		return differences
+
+	def Notify(self, event):
+		"""Handled events:
+		TickEvent:
+			Feed in the input dispatched at this time in the log
+		QuitEvent:
+			Stop the replay
+		Any other (logged) event:
+			Note it, to compare with the log
+		"""
+		if isinstance(event, TickEvent):
+			for input in self.inputs.get(event.time, ()):
+				self.evManager.Notify( input )
+			return
+		if isinstance(event, QuitEvent):
+			self.keepGoing = 0
+		elif self.restoring:
+			return
+		elif not isinstance(event, INPUT_EVENTS) or isinstance(event, TimeoutSolveEvent):
+			encoded = EncodeEvent(event)
+			if encoded is not None:
+				self.replayed.append((self.evManager.time,) + encoded)
+
+def Replay(filename, realTime=False, view=False):
+	"""Play back a battle log (into a PygameView if view is set)
+		returns the ReplayController, with the game it replayed"""
+	evManager = EventManager.NewInstance()
+	replayer = ReplayController(filename, evManager)
+	if view:
+		from view import PygameView
+		replayer.view = PygameView(evManager)
+	replayer.Run(realTime)
+	return replayer
+
+def main():
+	from optparse import OptionParser
+	parser = OptionParser(usage="%prog [--realtime] logfile")
+	parser.add_option("--realtime", action="store_true", default=False,
+		help="play the battle back in real time, on screen (rather than as fast as possible)")
+	options, args = parser.parse_args()
+	if len(args) != 1:
+		parser.error("expected the battle log to replay")
+	replayer = Replay(args[0], options.realtime, options.realtime)
+	print "seed %s: replayed %s ms of game time" % (replayer.seed, replayer.time)
+	for evID, actor in sorted(replayer.game.heroes.items() + replayer.game.enemies.items()):
+		print "%s health: %s" % (evID, actor.health)
+	print "%s differences from the log" % replayer.Differences()
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,234 @@
+from EventManager import *
+from model import *
+from profiler import Percentiles
+
+import random
+import time
+
+class SimulationController(object):
+	"""Controls the game clock without a display -- generating TickEvents with synthetic
+		time at a fixed step, as fast as the CPU allows, until the battle is decided"""
+	def __init__(self, step=25, maxTime=600000, seed=None, evManager=None):
+		if evManager is None: evManager = EventManager()
+		self.evManager = evManager
+		self.evManager.RegisterListener( self, (QuitEvent, GameOverEvent, VictoryEvent) )
+
+		self.keepGoing = 1
+		self.step = step #milliseconds of game time per tick
+		self.maxTime = maxTime #give up on the battle after this much game time
+		self.seed = seed #of the battle (just for reference: the Game seeds its own random streams)
+		self.time = 0
+		self.ticks = 0
+		self.elapsed = 0 #wall clock seconds spent in Run
+		self.outcome = None
+
+	def Run(self):
+		"""Tick the game clock until the battle is won or lost (or maxTime is reached)
+			returns the outcome: 'victory', 'defeat' or None"""
+		start = time.time()
+		while self.keepGoing and self.time < self.maxTime:
+			self.time += self.step
+			self.ticks += 1
+			self.evManager.NotifyTick( self.time, self.step )
+		self.elapsed = time.time() - start
+		return self.outcome
+
+	def TicksPerSecond(self):
+		"""Number of ticks simulated per wall clock second during the last Run"""
+		if self.elapsed == 0:
+			return float(self.ticks)
+		return self.ticks / self.elapsed
+
+	def Notify(self, event):
+		"""handled events:
+		QuitEvent:
+			Stop the clock
+		GameOverEvent, VictoryEvent:
+			Record the outcome of the battle and stop the clock
+		"""
+		if isinstance(event, GameOverEvent):
+			self.outcome = 'defeat'
+		elif isinstance(event, VictoryEvent):
+			self.outcome = 'victory'
+		self.keepGoing = 0
+
+class ScriptedPlayerController(object):
+	"""Stands in for the keyboard during simulations: attacks as soon as the hero is ready,
+		and answers each problem after a random delay, correctly with the given probability"""
+	STATE_ACTION = 0
+	STATE_SOLVE = 1
+
+	def __init__(self, game, accuracy=0.8, latency=(1000, 3000), heroID="hero", rng=random, evManager=None):
+		if evManager is None: evManager = EventManager()
+		self.evManager = evManager
+		self.evManager.RegisterListener( self, (TickEvent, RequestSolutionEvent, SolveEvent, GameRestoredEvent) )
+
+		self.game = game
+		self.accuracy = accuracy #probability of answering correctly
+		self.latency = latency #(min, max) milliseconds taken to answer
+		self.heroID = heroID
+		self.rng = rng
+		self.state = ScriptedPlayerController.STATE_ACTION
+		self.time = 0
+		self.answerTime = 0
+
+	def Answer(self):
+		"""Return the solution the player types in for the hero's current problem"""
+		solution = self.game.heroes[self.heroID].problem.solution
+		if self.rng.random() >= self.accuracy:
+			solution += 1
+		return unicode(solution)
+
+	def Notify(self, event):
+		"""handled events:
+		TickEvent:
+			STATE_ACTION: request an attack
+			STATE_SOLVE: submit the answer once the answer time is reached
+		RequestSolutionEvent:
+			Pick the time at which the answer will be submitted
+		SolveEvent, GameRestoredEvent:
+			Go back to STATE_ACTION (the hero may have timed out, or a problem being solved is
+				requested again)
+		"""
+		if isinstance(event, TickEvent):
+			self.time = event.time
+			if self.state == ScriptedPlayerController.STATE_ACTION:
+				hero = self.game.heroes.get(self.heroID)
+				if hero is not None and hero.state == ActorModel.STATE_WAITING:
+					self.evManager.Notify( RequestAttackEvent() )
+			elif self.time >= self.answerTime:
+				self.evManager.Notify( SolveEvent(self.Answer(), self.answerTime) )
+		elif isinstance(event, RequestSolutionEvent):
+			self.state = ScriptedPlayerController.STATE_SOLVE
+			self.answerTime = self.time + self.rng.randint(*self.latency)
+		elif isinstance(event, (SolveEvent, GameRestoredEvent)):
+			self.state = ScriptedPlayerController.STATE_ACTION
+
+class BattleStatsListener(object):
+	"""Records the damage dealt by each attack during a simulated battle"""
+	def __init__(self, heroID="hero", evManager=None):
+		if evManager is None: evManager = EventManager()
+		self.evManager = evManager
+		self.evManager.RegisterListener( self, (AttackEvent,) )
+
+		self.heroID = heroID
+		self.heroDamage = [] #damage of each attack made by the hero
+		self.enemyDamage = [] #damage of each attack made by an enemy
+
+	def Notify(self, event):
+		"""handled events:
+		AttackEvent:
+			Record the damage of the attack
+		"""
+		if event.subject == self.heroID:
+			self.heroDamage.append(event.damage)
+		else:
+			self.enemyDamage.append(event.damage)
+
+def RunBattle(seed=None, accuracy=0.8, latency=(1000, 3000), step=25, maxTime=600000,
+		heroSettings=None, enemySettings=None, logFile=None, arena=False):
+	"""Run a single headless battle on its own EventManager and Game (leaving the shared ones alone)
+		heroSettings, enemySettings: keyword arguments for the spawned HeroModel and EnemyModel
+		logFile: file to record the battle to (see replay.py)
+		arena: keep the enemies in an ActorArena (see model/arena.py)
+		returns the SimulationController, which holds the outcome and timings, along with
+		the game, player and stats"""
+	evManager = EventManager.NewInstance()
+	simulator = SimulationController(step, maxTime, seed, evManager)
+	simulator.game = Game.NewInstance(evManager, seed, arena)
+	simulator.game.heroSettings = heroSettings or {}
+	simulator.game.enemySettings = enemySettings or {}
+	simulator.player = ScriptedPlayerController(simulator.game, accuracy, latency,
+		rng=random.Random(seed), evManager=evManager)
+	simulator.stats = BattleStatsListener(evManager=evManager)
+	if logFile is not None:
+		from replay import BattleRecorder
+		simulator.recorder = BattleRecorder(logFile, evManager)
+	simulator.Run()
+	if logFile is not None:
+		simulator.recorder.Close()
+	return simulator
+
+def RunDuel(job):
+	"""Run the battle described by the given dict of RunBattle keyword arguments, and return
+		a picklable summary of it (this is what each worker process runs)"""
+	simulator = RunBattle(**job)
+	hero = simulator.game.heroes["hero"]
+	return {'outcome': simulator.outcome,
+		'time': simulator.time,
+		'heroHealth': hero.health,
+		'heroDamage': simulator.stats.heroDamage,
+		'enemyDamage': simulator.stats.enemyDamage,
+		'ticks': simulator.ticks,
+		'elapsed': simulator.elapsed}
+
+def RunBatch(duels, seed=0, processes=None, **settings):
+	"""Run the given number of independent duels across a pool of worker processes, each
+		seeded from seed onwards.  Any other keyword arguments are passed on to RunBattle.
+		returns the list of RunDuel summaries"""
+	from multiprocessing import Pool
+	jobs = []
+	for i in range(duels):
+		job = dict(settings)
+		job['seed'] = seed + i
+		jobs.append(job)
+	pool = Pool(processes)
+	try:
+		return pool.map(RunDuel, jobs, 1)
+	finally:
+		pool.close()
+		pool.join()
+
+def Summarize(results):
+	"""Aggregate RunDuel summaries into win rate, time-to-kill and damage distributions"""
+	wins = [r for r in results if r['outcome'] == 'victory']
+	heroDamage = []
+	enemyDamage = []
+	for r in results:
+		heroDamage.extend(r['heroDamage'])
+		enemyDamage.extend(r['enemyDamage'])
+	return {'duels': len(results),
+		'winRate': 1.0*len(wins)/max(len(results), 1),
+		'timeToKill': Percentiles([r['time'] for r in wins]),
+		'heroDamage': Percentiles(heroDamage),
+		'enemyDamage': Percentiles(enemyDamage),
+		'ticksPerSecond': sum([r['ticks'] for r in results])/max(sum([r['elapsed'] for r in results]), 1e-9)}
+
+def main():
+	"""Run a batch of seeded duels across a process pool and report the aggregated results:
+		python simulation.py [options] [duels] [seed]"""
+	from optparse import OptionParser
+	parser = OptionParser(usage="%prog [options] [duels] [seed]")
+	parser.add_option("-p", "--processes", type="int", help="number of worker processes (default: one per CPU)")
+	parser.add_option("--accuracy", type="float", default=0.8, help="probability of a correct answer")
+	parser.add_option("--latency", default="1000,3000", help="min,max milliseconds taken to answer")
+	parser.add_option("--solutionWait", type="int", help="milliseconds the hero has to solve a problem")
+	parser.add_option("--heroPower", type="float", help="damage of an instant correct solution")
+	parser.add_option("--attackWait", type="int", help="maximum milliseconds between enemy attacks")
+	parser.add_option("--enemyPower", type="float", help="damage of an enemy attack")
+	options, args = parser.parse_args()
+	duels = 100
+	seed = 0
+	if len(args) > 0: duels = int(args[0])
+	if len(args) > 1: seed = int(args[1])
+
+	heroSettings = {}
+	if options.solutionWait is not None: heroSettings['solutionWait'] = options.solutionWait
+	if options.heroPower is not None: heroSettings['attackPower'] = options.heroPower
+	enemySettings = {}
+	if options.attackWait is not None: enemySettings['attackWait'] = options.attackWait
+	if options.enemyPower is not None: enemySettings['attackPower'] = options.enemyPower
+	latency = tuple([int(ms) for ms in options.latency.split(",")])
+
+	summary = Summarize(RunBatch(duels, seed, options.processes, accuracy=options.accuracy,
+		latency=latency, heroSettings=heroSettings, enemySettings=enemySettings))
+	def Format(percentiles):
+		return "  ".join(["p%d=%s" % (p, percentiles[p]) for p in sorted(percentiles)])
+	print "duels: %(duels)d  win rate: %(winRate).2f" % summary
+	print "time to kill (ms): %s" % Format(summary['timeToKill'])
+	print "hero damage: %s" % Format(summary['heroDamage'])
+	print "enemy damage: %s" % Format(summary['enemyDamage'])
+	print "%d ticks/second per worker" % summary['ticksPerSecond']
+
+if __name__ == "__main__":
+	main()
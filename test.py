@@ -4,9 +4,21 @@ from EventManager import *
 from controller import *
 from model import *
 from view import * #...but how to test?
+from simulation import *
+from profiler import *
+from replay import *
 
 import threading
+import tempfile
+import random
+import os
 import time
+import logging
+try:
+    from model.arena import *
+    import numpy
+except ImportError:
+    numpy = None #arena mode needs NumPy
 
 class EventDrivenTestCase(unittest.TestCase):
     """Generic test case that keeps track of an instance of Event Manager, and blanks it out
@@ -15,10 +27,10 @@ class EventDrivenTestCase(unittest.TestCase):
         unittest.TestCase.__init__(self, *args, **kwds)
         self.evManager = EventManager()
     def setUp(self):
-        del self.evManager.initialized
+        EventManager.__instance__ = None
         self.evManager = EventManager()
     def tearDown(self):
-        del self.evManager.initialized
+        EventManager.__instance__ = None
         self.evManager = EventManager()
 
 # Some test listeners with varying degrees of validity and functionality
@@ -123,6 +135,43 @@ class RegisterListenerTest(EventDrivenTestCase):
                              "found %s before and %s after" % (len(before), len(after)))
                      
 
+    def testRegisterListeners(self):
+        """Verify that registering several valid listeners at once adds all of them"""
+        vl1 = ValidListener()
+        vl2 = ValidListener()
+        self.evManager.RegisterListeners([vl1, (vl2, (TickEvent,), "Test")])
+        self.assertEqual(len(self.evManager.listeners), 2,
+                         "listeners %s should contain two listeners" % self.evManager.listeners.keys())
+        self.assertEqual(self.evManager.listeners[vl2], ((TickEvent,), "Test"),
+                         "listener %s was not registered with its event classes and subject" % vl2)
+    
+    def testRegisterListenersBad(self):
+        """Verify that registering several listeners at once when one of them is invalid:
+            * raises a TypeError
+            * doesn't add any of them to the list of registered listeners
+        """
+        self.assertRaises(TypeError, self.evManager.RegisterListeners, [ValidListener(), BadNotifyListener()])
+        self.assertEqual(len(self.evManager.listeners), 0,
+                         "listeners %s should be empty" % self.evManager.listeners.keys())
+    
+    def testValidationCached(self):
+        """Verify that the Notify signature is only inspected once per listener class"""
+        import EventManager as EventManagerModule
+        calls = []
+        getargspec = EventManagerModule.getargspec
+        def countingGetargspec(func):
+            calls.append(func)
+            return getargspec(func)
+        EventManagerModule.getargspec = countingGetargspec
+        try:
+            listeners = [ValidListener() for i in range(5)]
+            for vl in listeners:
+                self.evManager.RegisterListener(vl)
+        finally:
+            EventManagerModule.getargspec = getargspec
+        self.assertEqual(len(calls), 1,
+                         "getargspec should have been called once, was called %s times" % len(calls))
+
 class TestEvent(Event):
     """Generic event using specified name for test purposes"""
     def __init__(self, name):
@@ -153,6 +202,305 @@ class NotifyEventTest(EventDrivenTestCase):
         self.assertEquals(tl.events, positiveEvents,
                           "Test Event list should just contain %s, found to contain %s" % (positiveEvents, tl.events))
 
+class SubscribingListener(TestListener):
+    """Keeps track of the events it has been notified of, but only subscribes to the given classes
+    (and optionally a single subject)"""
+    def __init__(self, eventClasses, subject=None):
+        self.events = []
+        self.recordTicks = True
+        EventManager().RegisterListener(self, eventClasses, subject)
+
+class SubscriptionTest(EventDrivenTestCase):
+    def testNotifySubscribed(self):
+        """Verify that a listener only recieves events of the classes it subscribed to"""
+        sl = SubscribingListener((TickEvent,))
+        tick = TickEvent(10)
+        self.evManager.Notify(TestEvent("Unsubscribed Event"))
+        self.evManager.Notify(tick)
+        
+        self.assertEquals(sl.events, [tick],
+                          "Test Event list should just contain %s, found to contain %s" % (tick, sl.events))
+    
+    def testNotifySubclass(self):
+        """Verify that subscribing to an event class also delivers events of its subclasses"""
+        sl = SubscribingListener((ActorStateChangeEvent,))
+        hurt = HurtEvent("Test", 0.5)
+        self.evManager.Notify(hurt)
+        
+        self.assertEquals(sl.events, [hurt],
+                          "Test Event list should just contain %s, found to contain %s" % (hurt, sl.events))
+    
+    def testCatchAllListener(self):
+        """Verify that a listener registered without event classes still recieves every event"""
+        sl = SubscribingListener((TickEvent,))
+        tl = TestListener()
+        ev = TestEvent("Generic Event")
+        self.evManager.Notify(ev)
+        
+        self.assertEquals(tl.events, [ev],
+                          "Test Event list should just contain %s, found to contain %s" % (ev, tl.events))
+        self.assertEquals(sl.events, [],
+                          "Subscribed listener should not have recieved %s" % sl.events)
+    
+    def testRegisterAfterDispatch(self):
+        """Verify that a listener registered after an event class has been dispatched
+            still recieves later events of that class"""
+        self.evManager.Notify(TickEvent(10))
+        sl = SubscribingListener((TickEvent,))
+        tick = TickEvent(20)
+        self.evManager.Notify(tick)
+        
+        self.assertEquals(sl.events, [tick],
+                          "Test Event list should just contain %s, found to contain %s" % (tick, sl.events))
+
+    def testNotifySubject(self):
+        """Verify that a listener filtered on a subject only recieves actor events concerning
+            that subject, but still recieves events that don't concern any actor"""
+        sl = SubscribingListener((TickEvent, ActorStateChangeEvent), "Test")
+        tick = TickEvent(10)
+        hurt = HurtEvent("Test", 0.5)
+        self.evManager.Notify(HurtEvent("Other", 0.5))
+        self.evManager.Notify(hurt)
+        self.evManager.Notify(tick)
+        
+        self.assertEquals(sl.events, [hurt, tick],
+                          "Test Event list should just contain %s, found to contain %s" % ([hurt, tick], sl.events))
+    
+    def testNotifyAttackObject(self):
+        """Verify that an AttackEvent reaches listeners filtered on either the attacker or the victim,
+            and only once if they are the same"""
+        attacker = SubscribingListener((AttackEvent,), "Attacker")
+        victim = SubscribingListener((AttackEvent,), "Victim")
+        bystander = SubscribingListener((AttackEvent,), "Bystander")
+        attack = AttackEvent("Attacker", "Victim", 10)
+        selfAttack = AttackEvent("Victim", "Victim", 10)
+        self.evManager.Notify(attack)
+        self.evManager.Notify(selfAttack)
+        
+        self.assertEquals(attacker.events, [attack],
+                          "Attacker should have recieved %s, found %s" % (attack, attacker.events))
+        self.assertEquals(victim.events, [attack, selfAttack],
+                          "Victim should have recieved %s, found %s" % ([attack, selfAttack], victim.events))
+        self.assertEquals(bystander.events, [],
+                          "Bystander should not have recieved %s" % bystander.events)
+    
+    def testUnregisterSubject(self):
+        """Verify that an unregistered subject-filtered listener no longer recieves its events"""
+        sl = SubscribingListener((ActorStateChangeEvent,), "Test")
+        self.evManager.UnregisterListener(sl)
+        self.evManager.Notify(WaitEvent("Test"))
+        
+        self.assertEquals(sl.events, [],
+                          "Unregistered listener should not have recieved %s" % sl.events)
+        self.assertEquals(self.evManager.subjectListeners, {},
+                          "Subject table should be empty, found %s" % self.evManager.subjectListeners)
+
+class CountingEvent(Event):
+    """Event that keeps track of how many times it has been formatted"""
+    def __init__(self):
+        self.name = "Counting Event"
+        self.formatted = 0
+    def __str__(self):
+        self.formatted += 1
+        return self.name
+
+class TraceEventsTest(EventDrivenTestCase):
+    def setUp(self):
+        EventDrivenTestCase.setUp(self)
+        self.records = []
+        test = self
+        class RecordingHandler(logging.Handler):
+            def emit(self, record):
+                test.records.append(record.getMessage())
+        self.handler = RecordingHandler()
+        logger.addHandler(self.handler)
+        self.level = logger.level
+        logger.setLevel(logging.DEBUG)
+    
+    def tearDown(self):
+        logger.removeHandler(self.handler)
+        logger.setLevel(self.level)
+        EventDrivenTestCase.tearDown(self)
+    
+    def testUntracedNotFormatted(self):
+        """Verify that events are not formatted or logged unless tracing is turned on for them"""
+        TestListener()
+        ev = CountingEvent()
+        self.evManager.Notify(ev)
+        self.assertEquals(ev.formatted, 0, "Untraced event was formatted %s times" % ev.formatted)
+        self.assertEquals(self.records, [], "Untraced event was logged: %s" % self.records)
+    
+    def testTraceEventClass(self):
+        """Verify that only events of the traced classes (and their subclasses) are logged"""
+        self.evManager.TraceEvents((ActorStateChangeEvent,))
+        ev = CountingEvent()
+        self.evManager.Notify(ev)
+        self.evManager.Notify(HurtEvent("Test", 0.5))
+        self.assertEquals(ev.formatted, 0, "Untraced event was formatted %s times" % ev.formatted)
+        self.assertEquals(len(self.records), 1, "Expected one traced event, found %s" % self.records)
+    
+    def testDebugOffByDefault(self):
+        """Verify that debug messages (and the debugging cheat) are off unless asked for"""
+        self.assertEquals(DebugLevel(), 0, "Debug level defaults to %s" % DebugLevel())
+        Debug("Debug message", 1)
+        self.assertEquals(self.records, [], "Debug message was logged: %s" % self.records)
+        self.assertFalse(MultiplicationProblem(3, 4).solve(0), "Debugging cheat is on")
+        SetDebug(1)
+        try:
+            Debug("Debug message", 1)
+        finally:
+            SetDebug(0)
+        self.assertEquals(self.records, ["Debug message"], "Debug message not logged: %s" % self.records)
+    
+    def testTraceIgnoresTicks(self):
+        """Verify that tracing every event still leaves out tick events"""
+        self.evManager.TraceEvents()
+        self.evManager.Notify(TickEvent(10))
+        self.evManager.Notify(TestEvent("Traced Event"))
+        self.assertEquals(len(self.records), 1, "Expected one traced event, found %s" % self.records)
+
+class SeparateBusTest(EventDrivenTestCase):
+    def testNewInstance(self):
+        """Verify that a new EventManager instance is separate from the shared one"""
+        bus = EventManager.NewInstance()
+        self.assert_(bus is not EventManager(), "NewInstance returned the shared EventManager")
+        tl = TestListener()
+        self.evManager.RegisterListener(tl)
+        bus.Notify(TestEvent("Other Bus Event"))
+        self.assertEquals(tl.events, [], "Listener on the shared bus recieved %s" % tl.events)
+    
+    def testSharedWithArguments(self):
+        """Verify that the shared instance can be given its arguments when it is first created"""
+        bus = EventManager.NewInstance()
+        Game.__instance__ = None
+        try:
+            game = Game(bus, 42)
+            self.assert_(game is Game(), "Game created with arguments isn't the shared one")
+            self.assert_(game.evManager is bus and game.seed == 42, "Arguments not passed on to the shared game")
+            self.assertRaises(TypeError, Game, bus)
+        finally:
+            Game.__instance__ = None
+    
+    def testSeparateGames(self):
+        """Verify that games on separate event managers progress independently"""
+        busA = EventManager.NewInstance()
+        busB = EventManager.NewInstance()
+        gameA = Game.NewInstance(busA)
+        gameB = Game.NewInstance(busB)
+        busA.Notify(TickEvent(10))
+        self.assertEquals(gameA.state, Game.STATE_RUNNING,
+                          "Ticked game did not start: state %s" % gameA.state)
+        self.assertEquals(gameB.state, Game.STATE_PREPARING,
+                          "Game on another bus started: state %s" % gameB.state)
+        self.assert_(gameA.heroes["hero"].evManager is busA,
+                     "Spawned hero is not on its game's event manager")
+
+class TimerTest(EventDrivenTestCase):
+    def testTimersFireInOrder(self):
+        """Verify that timers fire on the first tick at or after their deadline, earliest first"""
+        fired = []
+        self.evManager.SetTimer(30, lambda time: fired.append(("late", time)))
+        self.evManager.SetTimer(20, lambda time: fired.append(("early", time)))
+        self.evManager.Notify(TickEvent(10))
+        self.assertEquals(fired, [], "Timers fired before their deadline: %s" % fired)
+        self.evManager.Notify(TickEvent(30))
+        self.assertEquals(fired, [("early", 30), ("late", 30)],
+                          "Timers did not fire in deadline order: %s" % fired)
+    
+    def testCancelTimer(self):
+        """Verify that a cancelled timer never fires"""
+        fired = []
+        timer = self.evManager.SetTimer(20, lambda time: fired.append(time))
+        self.evManager.CancelTimer(timer)
+        self.evManager.Notify(TickEvent(30))
+        self.assertEquals(fired, [], "Cancelled timer fired: %s" % fired)
+    
+    def testActorRecovery(self):
+        """Verify that an attacking actor goes back to waiting once its attack time is up,
+            without listening to TickEvents"""
+        tl = TestListener()
+        actor = ActorModel("Test", {"victim": None})
+        self.assertEquals([r() for r in self.evManager.GetListeners(TickEvent)].count(actor), 0,
+                          "Actor should not be listening to TickEvents")
+        actor.Attack(0)
+        self.evManager.Notify(TickEvent(actor.AttackWait-1))
+        self.assertEquals(actor.state, ActorModel.STATE_ATTACKING,
+                          "Actor stopped attacking early: state %s" % actor.state)
+        self.evManager.Notify(TickEvent(actor.AttackWait))
+        self.assertEquals(actor.state, ActorModel.STATE_WAITING,
+                          "Actor did not stop attacking: state %s" % actor.state)
+        self.assertEquals(tl.getEventClasses().count(WaitEvent), 1,
+                          "Actor did not send a WaitEvent: found %s" % tl.getEventClasses())
+    
+    def testEnemyAttackTimer(self):
+        """Verify that an enemy attacks once its attack timer expires, and not before"""
+        victim = ActorModel("v", {})
+        enemy = EnemyModel("Enemy", {"v": victim}, 0)
+        tl = TestListener()
+        self.evManager.Notify(TickEvent(enemy.nextAttack-1))
+        self.assertEquals(tl.getEventClasses().count(AttackEvent), 0,
+                          "Enemy attacked early: found %s" % tl.getEventClasses())
+        self.evManager.Notify(TickEvent(enemy.nextAttack))
+        self.assertEquals(tl.getEventClasses().count(AttackEvent), 1,
+                          "Enemy did not attack: found %s" % tl.getEventClasses())
+
+class ChainListener:
+    """Posts a follow-up event from inside its handler, recording when each event started
+    and finished being handled"""
+    def __init__(self, trigger, followUp):
+        self.trigger = trigger
+        self.followUp = followUp
+        self.log = []
+        EventManager().RegisterListener(self)
+    def Notify(self, event):
+        self.log.append(("start", event.name))
+        if event.name == self.trigger:
+            EventManager().Notify(TestEvent(self.followUp))
+        self.log.append(("end", event.name))
+
+class QueuedNotifyTest(EventDrivenTestCase):
+    def setUp(self):
+        EventDrivenTestCase.setUp(self)
+        self.evManager.SetQueued(True)
+    
+    def testNoReentry(self):
+        """Verify that in queued mode an event posted by a handler is only dispatched
+            after the current event has been handled by everyone"""
+        cl = ChainListener("First", "Second")
+        self.evManager.Notify(TestEvent("First"))
+        expected = [("start", "First"), ("end", "First"), ("start", "Second"), ("end", "Second")]
+        
+        self.assertEquals(cl.log, expected,
+                          "Events were not handled in order: expected %s, found %s" % (expected, cl.log))
+    
+    def testImmediateMode(self):
+        """Verify that switching back to immediate mode dispatches events inside the handler that posted them"""
+        self.evManager.SetQueued(False)
+        cl = ChainListener("First", "Second")
+        self.evManager.Notify(TestEvent("First"))
+        expected = [("start", "First"), ("start", "Second"), ("end", "Second"), ("end", "First")]
+        
+        self.assertEquals(cl.log, expected,
+                          "Events were not handled in order: expected %s, found %s" % (expected, cl.log))
+    
+    def testTickBudget(self):
+        """Verify that no more than maxEventsPerTick events are dispatched per tick,
+            and that the rest are held over in order"""
+        self.evManager.SetQueued(True, maxEventsPerTick=2)
+        tl = TestListener()
+        events = [TestEvent("Event %s" % i) for i in range(3)]
+        self.evManager.dispatching = True #post everything as if from inside a handler
+        for e in events:
+            self.evManager.Notify(e)
+        self.evManager.dispatching = False
+        
+        self.evManager.Notify(TickEvent(10))
+        self.assertEquals(tl.events, events[:2],
+                          "Expected only %s to be dispatched, found %s" % (events[:2], tl.events))
+        self.evManager.Notify(TickEvent(20))
+        self.assertEquals(tl.events, events,
+                          "Expected %s to be dispatched, found %s" % (events, tl.events))
+
 class MockKeyEvent:
     """Mockup of a pygame keypress event"""
     def __init__(self, type, key=None, unicode=''):
@@ -169,6 +517,7 @@ class KeyboardControllerTest(EventDrivenTestCase):
         while self.game.state == Game.STATE_PREPARING:
             self.evManager.Notify(TickEvent(10))
         self.keybd = KeyboardController()
+        self.spinner = CPUSpinnerController(inputs=[self.keybd])
     
     def tearDown(self):
         self.evManager.Notify(QuitEvent())
@@ -180,7 +529,7 @@ class KeyboardControllerTest(EventDrivenTestCase):
         
         tl = TestListener()
         pygame.event.get = lambda: [quitkey]
-        self.keybd.Notify(TickEvent(10))
+        self.spinner.PollInput()
         
         self.assertEquals(len(tl.events), 1, 
                           "Test Event list should contain only one event, found %s" \
@@ -203,7 +552,7 @@ class KeyboardControllerTest(EventDrivenTestCase):
         
         #ask for solution to be determined & drawn
         pygame.event.get = lambda: attackFlow
-        self.evManager.Notify(TickEvent(10))
+        self.spinner.PollInput()
         #reset attackFlow
         attackFlow = []
         
@@ -218,7 +567,7 @@ class KeyboardControllerTest(EventDrivenTestCase):
         
         #enter solution
         pygame.event.get = lambda: attackFlow
-        self.evManager.Notify(TickEvent(10))
+        self.spinner.PollInput()
         
         #sorted because order doesn't matter -- some events may get registered in a 
         #    slightly different order sometimes
@@ -228,6 +577,79 @@ class KeyboardControllerTest(EventDrivenTestCase):
                           "Test Event list should just contain: \n%s \nfound to contain: \n%s" \
                           % (expected, found))
 
+    def testPollOnce(self):
+        """Verify that the spinner's input stage reads the pygame event queue once per tick, and
+            the keyboard doesn't read it itself"""
+        polls = []
+        def get():
+            polls.append(1)
+            return []
+        pygame.event.get = get
+        self.spinner.Advance(10)
+        self.assertEquals(len(polls), 1, "pygame event queue read %s times in one tick" % len(polls))
+    
+    def testUnboundKeys(self):
+        """Verify that keys without a binding in the current state raise no events"""
+        tl = TestListener()
+        pygame.event.get = lambda: [MockKeyEvent(pygame.locals.KEYDOWN, pygame.locals.K_RETURN, u'\r'),
+                                    MockKeyEvent(pygame.locals.KEYDOWN, pygame.locals.K_LSHIFT),
+                                    MockKeyEvent(pygame.locals.KEYDOWN, unicode=u'7')]
+        self.spinner.PollInput()
+        self.assertEquals(tl.events, [], "Unbound keys raised %s" % tl.events)
+    
+    def testKeysInOrder(self):
+        """Verify that several keypresses in one tick are translated in the order they were pressed"""
+        self.keybd.state = KeyboardController.STATE_SOLVE
+        tl = TestListener()
+        pygame.event.get = lambda: [MockKeyEvent(pygame.locals.KEYDOWN, unicode=u'4'),
+                                    MockKeyEvent(pygame.locals.KEYDOWN, unicode=u'2'),
+                                    MockKeyEvent(pygame.locals.KEYDOWN, pygame.locals.K_BACKSPACE, u'\b'),
+                                    MockKeyEvent(pygame.locals.KEYDOWN, pygame.locals.K_ESCAPE)]
+        self.spinner.PollInput()
+        found = [getattr(e, 'solution', e.__class__) for e in tl.events]
+        self.assertEquals(found, ['4', '42', '4', QuitEvent], "Keys translated to %s" % found)
+
+    def testKeyTime(self):
+        """Verify that a keypress is stamped with the time of the tick it is handled in"""
+        self.keybd.state = KeyboardController.STATE_SOLVE
+        tl = TestListener(recordTicks=True)
+        found = []
+        tl.Notify = lambda event: found.append((event.__class__, getattr(event, 'time', None)))
+        keys = [[], [MockKeyEvent(pygame.locals.KEYDOWN, unicode=u'4')]]
+        pygame.event.get = lambda: keys and keys.pop(0) or []
+        self.spinner.Advance(30)
+        expected = [(TickEvent, 10), (SolutionUpdateEvent, 20), (TickEvent, 20), (TickEvent, 30)]
+        found = found[:len(expected)]
+        self.assertEquals(found, expected, "Expected %s, found %s" % (expected, found))
+
+    def writeBindings(self, text):
+        filename = os.path.join(tempfile.mkdtemp(), "keys.cfg")
+        bindingsFile = open(filename, "w")
+        bindingsFile.write(text)
+        bindingsFile.close()
+        return filename
+    
+    def testCustomBindings(self):
+        """Verify that bindings from a config file replace the default ones, and that
+            bindings for a state take precedence over those for every state"""
+        filename = self.writeBindings("[any]\nq = Quit\nspace = Quit\n[action]\nspace = Attack\n")
+        keybd = KeyboardController(filename, evManager=EventManager.NewInstance())
+        self.assertEquals(keybd.keymap[(KeyboardController.STATE_ACTION, pygame.locals.K_SPACE)], keybd.Attack,
+                          "State binding didn't take precedence")
+        self.assertEquals(keybd.keymap[(KeyboardController.STATE_SOLVE, pygame.locals.K_SPACE)], keybd.Quit,
+                          "Binding for every state not applied")
+        self.assertEquals(keybd.keymap[(KeyboardController.STATE_VICTORY, pygame.locals.K_q)], keybd.Quit,
+                          "Binding for every state not applied")
+        self.assertFalse((KeyboardController.STATE_ACTION, pygame.locals.K_ESCAPE) in keybd.keymap,
+                         "Default bindings kept")
+    
+    def testBadBindings(self):
+        """Verify that unknown keys, actions and states are reported when the bindings are loaded"""
+        for text in ("[action]\nnosuchkey = Attack\n", "[action]\nspace = Explode\n",
+                     "[dancing]\nspace = Attack\n"):
+            filename = self.writeBindings(text)
+            self.assertRaises(ValueError, KeyboardController, filename, EventManager.NewInstance())
+
 class CPUSpinnerTest(EventDrivenTestCase):
     def setUp(self):
         EventDrivenTestCase.setUp(self)
@@ -239,7 +661,7 @@ class CPUSpinnerTest(EventDrivenTestCase):
         EventDrivenTestCase.tearDown(self)
     
     def testRun(self):
-        """Verify that the CPU Spinner sends out tick events at a rate of 'maxfps' per second"""
+        """Verify that the CPU Spinner renders at most 'maxfps' frames per second, and ticks at 'tickRate'"""
         maxfps = 20
         runSeconds = 1
         self.spinner = CPUSpinnerController(maxfps)
@@ -251,12 +673,16 @@ class CPUSpinnerTest(EventDrivenTestCase):
         self.spinner.keepGoing = False # stop it
         
         ticks = [e for e in tl.events if isinstance(e, TickEvent)]
+        renders = [e for e in tl.events if isinstance(e, RenderEvent)]
         self.assert_(len(ticks) > 0, "CPU Spinner did not send any Tick Events")
         fpsbuffer = maxfps*runSeconds
         fpsbuffer *= 1.1 # allow +10% margin of error
-        self.assert_(len(ticks) < fpsbuffer,
-                     "CPU Spinner did not throttle clock ticks to %s per second:" % maxfps +
-                     " it ran for %s ticks in %s seconds" % (len(ticks), runSeconds))
+        self.assert_(len(renders) < fpsbuffer,
+                     "CPU Spinner did not throttle frames to %s per second:" % maxfps +
+                     " it rendered %s frames in %s seconds" % (len(renders), runSeconds))
+        tickbuffer = 1000/self.spinner.step*runSeconds*1.1
+        self.assert_(len(ticks) < tickbuffer,
+                     "CPU Spinner ran %s ticks in %s seconds" % (len(ticks), runSeconds))
     
     def testQuitEvent(self):
         """Verify that the CPU Spinner stops sending out tick events when the quit event is sent"""
@@ -591,6 +1017,846 @@ class EnemyModelTest(EventDrivenTestCase):
         self.assertEquals(ae.object, "v", 
                           "Generated AttackEvent had wrong object: Expected 'v', got '%s'" % ae.object)
 
+class SimulationTest(unittest.TestCase):
+    def testBattleDecided(self):
+        """Verify that a headless battle runs until one side wins"""
+        simulator = RunBattle(seed=1)
+        self.assert_(simulator.outcome in ('victory', 'defeat'),
+                     "Battle was not decided: outcome %s after %s ticks" % (simulator.outcome, simulator.ticks))
+        self.assertEquals(simulator.time, simulator.ticks*simulator.step,
+                          "Simulated time %s doesn't match %s ticks of %sms" %
+                          (simulator.time, simulator.ticks, simulator.step))
+    
+    def testSeedReproducible(self):
+        """Verify that two battles run from the same seed play out identically"""
+        first = RunBattle(seed=42, accuracy=0.5)
+        firstHealth = first.game.heroes["hero"].health
+        second = RunBattle(seed=42, accuracy=0.5)
+        secondHealth = second.game.heroes["hero"].health
+        self.assertEquals((first.outcome, first.ticks, firstHealth), (second.outcome, second.ticks, secondHealth),
+                          "Battles with the same seed differed: %s vs %s" %
+                          ((first.outcome, first.ticks, firstHealth), (second.outcome, second.ticks, secondHealth)))
+
+    def testBattleSettings(self):
+        """Verify that hero and enemy settings are applied to the spawned actors"""
+        game = RunBattle(seed=1, heroSettings={'solutionWait': 3000}, enemySettings={'attackPower': 25}).game
+        self.assertEquals(game.heroes["hero"].solutionWait, 3000,
+                          "Hero solutionWait not applied: found %s" % game.heroes["hero"].solutionWait)
+        self.assertEquals(game.enemySettings, {'attackPower': 25},
+                          "Enemy settings not passed to game: found %s" % game.enemySettings)
+    
+    def testRunBatch(self):
+        """Verify that duels run in worker processes give the same results as in this process"""
+        results = RunBatch(3, seed=5, processes=2, accuracy=0.5)
+        expected = [RunDuel({'seed': 5+i, 'accuracy': 0.5}) for i in range(3)]
+        self.assertEquals([(r['outcome'], r['time']) for r in results],
+                          [(r['outcome'], r['time']) for r in expected],
+                          "Pooled duels differed from in-process duels")
+        summary = Summarize(results)
+        self.assertEquals(summary['duels'], 3, "Summary should cover 3 duels, found %s" % summary['duels'])
+
+class CountingFont:
+    """Wraps a pygame font, counting how many times text is rendered"""
+    def __init__(self, font):
+        self.font = font
+        self.renders = 0
+    def render(self, *args):
+        self.renders += 1
+        return self.font.render(*args)
+
+class HUDTest(EventDrivenTestCase):
+    def setUp(self):
+        EventDrivenTestCase.setUp(self)
+        pygame.init()
+        self.window = pygame.display.set_mode((640,480), 0, 32)
+        self.hud = HUD(self.window.get_rect(), pygame.sprite.RenderUpdates())
+        self.hud.update()
+        for sprite in self.hud.boxSprites.values():
+            sprite.dirty = 0 #as if drawn
+        self.hud.text.font = CountingFont(self.hud.text.font)
+    
+    def testIdleTick(self):
+        """Verify that a tick with nothing new to show doesn't re-render or dirty anything"""
+        self.evManager.Notify(TickEvent(10))
+        self.hud.update()
+        self.assertEquals(self.hud.text.font.renders, 0, "HUD rendered text %s times" % self.hud.text.font.renders)
+        dirty = [name for name, sprite in self.hud.boxSprites.items() if sprite.dirty]
+        self.assertEquals(dirty, [], "Idle HUD marked %s dirty" % dirty)
+    
+    def testRerenderCached(self):
+        """Verify that re-rendering text that has been shown before comes from the cache"""
+        self.hud.SetInstructions(self.hud.instr_win)
+        self.hud.update()
+        self.hud.SetInstructions(self.hud.instr_wait)
+        self.hud.update()
+        self.assertEquals(self.hud.text.font.renders, 2,
+                          "Expected only the 2 new lines to be rendered, found %s" % self.hud.text.font.renders)
+    
+    def testSolutionUpdate(self):
+        """Verify that updating the solution only re-renders and dirties the solution box"""
+        self.evManager.Notify(SolutionUpdateEvent(u"42"))
+        self.hud.update()
+        self.assertEquals(self.hud.text.font.renders, 2, "HUD rendered text %s times" % self.hud.text.font.renders)
+        dirty = [name for name, sprite in self.hud.boxSprites.items() if sprite.dirty]
+        self.assertEquals(dirty, ['solution'], "HUD should only mark the solution box dirty, found %s" % dirty)
+
+class TextCacheTest(unittest.TestCase):
+    def setUp(self):
+        pygame.font.init()
+        self.font = CountingFont(pygame.font.Font(None, 18))
+        self.cache = TextCache(self.font, capacity=2)
+    
+    def testHitsAndMisses(self):
+        """Verify that rendering the same text twice only renders it once, and is counted"""
+        first = self.cache.Render("text", False, (255,255,255))
+        second = self.cache.Render("text", False, (255,255,255))
+        self.assert_(first is second, "Cached surface was not reused")
+        self.assertEquals((self.cache.hits, self.cache.misses, self.font.renders), (1, 1, 1),
+                          "Expected 1 hit, 1 miss and 1 render, found %s" %
+                          ((self.cache.hits, self.cache.misses, self.font.renders),))
+    
+    def testLeastRecentlyUsedEvicted(self):
+        """Verify that the least recently used text is dropped when the cache is full"""
+        white = (255,255,255)
+        self.cache.Render("a", False, white)
+        self.cache.Render("b", False, white)
+        self.cache.Render("a", False, white)
+        self.cache.Render("c", False, white) #evicts "b"
+        keys = sorted([key[0] for key in self.cache.surfaces.keys()])
+        self.assertEquals(keys, ["a", "c"], "Expected a and c to be cached, found %s" % keys)
+    
+    def testGlyphs(self):
+        """Verify that typing digits only renders each glyph once"""
+        surface = pygame.Surface((100,50))
+        self.cache.BlitGlyphs(surface, u"121", (0,0), False, (255,255,255))
+        self.cache.BlitGlyphs(surface, u"1212", (0,0), False, (255,255,255))
+        self.assertEquals(self.font.renders, 2, "Expected 2 glyphs rendered, found %s" % self.font.renders)
+        self.assertEquals((self.cache.glyphHits, self.cache.glyphMisses), (5, 2),
+                          "Expected 5 glyph hits and 2 misses, found %s" % ((self.cache.glyphHits, self.cache.glyphMisses),))
+        self.assertEquals((self.cache.hits, self.cache.misses), (0, 0),
+                          "Glyphs counted against the string cache: %s" % ((self.cache.hits, self.cache.misses),))
+
+class PygameViewTest(EventDrivenTestCase):
+    def setUp(self):
+        EventDrivenTestCase.setUp(self)
+        pygame.init()
+        self.setMode = pygame.display.set_mode
+        pygame.display.set_mode = lambda size: self.setMode(size, 0, 32)
+        self.view = PygameView()
+        self.evManager.Notify(SpawnHeroEvent("hero"))
+        self.evManager.Notify(SpawnEnemyEvent("enemy1"))
+        self.evManager.Notify(TickEvent(10))
+        self.evManager.Notify(RenderEvent(10))
+        self.evManager.Notify(TickEvent(20))
+        self.evManager.Notify(RenderEvent(20))
+    
+    def tearDown(self):
+        pygame.display.set_mode = self.setMode
+        EventDrivenTestCase.tearDown(self)
+    
+    def testIdleFrame(self):
+        """Verify that a frame where nothing changed doesn't push any pixels to the display"""
+        self.evManager.Notify(TickEvent(30))
+        self.evManager.Notify(RenderEvent(30))
+        self.assertEquals(self.view.pixelsUpdated, 0,
+                          "Idle frame updated %s pixels" % self.view.pixelsUpdated)
+    
+    def testActorChange(self):
+        """Verify that an actor changing state only updates that actor's part of the display"""
+        enemy = self.view.GetActor("enemy1")
+        self.evManager.Notify(HurtEvent("enemy1", 0.5))
+        self.evManager.Notify(TickEvent(30))
+        self.evManager.Notify(RenderEvent(30))
+        self.assert_(0 < self.view.pixelsUpdated <= enemy.rect.width*enemy.rect.height,
+                     "Hurting an enemy updated %s pixels" % self.view.pixelsUpdated)
+
+    def testRestore(self):
+        """Verify that the actors' sprites are replaced when the game is restored, showing the
+            restored state & health"""
+        self.evManager.Notify(GameRestoredEvent())
+        self.assertEquals(self.view.actorSprites.sprites(), [], "Sprites left after restoring")
+        self.evManager.Notify(SpawnHeroEvent("hero"))
+        self.evManager.Notify(SpawnEnemyEvent("enemy1"))
+        self.evManager.Notify(ActorRestoredEvent("enemy1", HurtEvent, 0.5))
+        enemy = self.view.GetActor("enemy1")
+        self.assertEquals(len(self.view.actorSprites), 2, "%s sprites after restoring" % len(self.view.actorSprites))
+        self.assertEquals(enemy.healthWidth, enemy.waitImage.get_width()/2, "Health bar %s wide" % enemy.healthWidth)
+        self.assert_(enemy.stateImage is enemy.hurtImage, "Restored enemy not shown hurting")
+
+    def testRestoreEnded(self):
+        """Verify that the HUD shows how a restored battle had ended"""
+        hud = self.view.hud
+        for endEvent, instr in ((VictoryEvent, hud.instr_win), (GameOverEvent, hud.instr_loose),
+                                (None, hud.instr_wait)):
+            self.evManager.Notify(GameRestoredEvent(endEvent))
+            self.assertEquals(hud.instr, instr, "HUD shows '%s' for a battle ended by %s" % (hud.instr, endEvent))
+
+    def testSlowFrame(self):
+        """Verify that only what changed is drawn even after a slow frame"""
+        getTicks = pygame.sprite.get_ticks
+        ticks = [0]
+        def SlowTicks():
+            ticks[0] += 100 #every frame takes 100ms
+            return ticks[0]
+        pygame.sprite.get_ticks = SlowTicks
+        try:
+            for time in (30, 40):
+                self.evManager.Notify(TickEvent(time))
+                self.evManager.Notify(RenderEvent(time))
+        finally:
+            pygame.sprite.get_ticks = getTicks
+        self.assertEquals(self.view.pixelsUpdated, 0,
+                          "Idle frame after a slow one updated %s pixels" % self.view.pixelsUpdated)
+
+class ProfilerTest(EventDrivenTestCase):
+    def testDisabled(self):
+        """Verify that nothing is timed, and dispatching isn't wrapped, until the profiler is enabled"""
+        listener = SubscribingListener((TickEvent, QuitEvent))
+        self.evManager.Notify(TickEvent(10))
+        self.assertEquals(self.evManager.profiler, None, "Profiler enabled by default")
+        self.assertEquals(self.evManager.dispatch, self.evManager.Dispatch, "Dispatch replaced while profiler disabled")
+    
+    def testListenerTimings(self):
+        """Verify that the profiler times each listener class and each event class"""
+        listener = SubscribingListener((TickEvent, QuitEvent))
+        profiler = self.evManager.EnableProfiler()
+        self.evManager.Notify(TickEvent(10))
+        self.evManager.Notify(QuitEvent())
+        self.assertEquals(len(profiler.samples[('listener', 'SubscribingListener')]), 2,
+                          "SubscribingListener not timed for each event")
+        timed = [name for category, name, count, timings in profiler.Report('event')]
+        self.assertEquals(sorted(timed), ['QuitEvent', 'TickEvent'], "Events timed: %s" % timed)
+        self.evManager.DisableProfiler()
+        self.evManager.Notify(QuitEvent())
+        self.assertEquals(len(profiler.samples[('listener', 'SubscribingListener')]), 2,
+                          "Listener timed after the profiler was disabled")
+    
+    def testRollingWindow(self):
+        """Verify that only the latest timings count towards the percentiles"""
+        profiler = Profiler(window=3)
+        for seconds in (5, 5, 5, 1, 2, 3):
+            profiler.Record('test', 'thing', seconds)
+        self.assertEquals(profiler.Timings('test', 'thing', (0, 100)), {0: 1, 100: 3},
+                          "Old timings kept past the window")
+    
+    def testShallowDisplay(self):
+        """Verify that the view starts on a display without alpha, and the overlay is only created
+            when the profiler is turned on"""
+        pygame.init()
+        setMode = pygame.display.set_mode
+        pygame.display.set_mode = lambda size: setMode(size, 0, 8)
+        try:
+            view = PygameView()
+        finally:
+            pygame.display.set_mode = setMode
+        self.assertEquals(view.profilerOverlay, None, "Overlay created with the profiler off")
+        view.ToggleProfiler()
+        self.assert_(view.profilerOverlay.visible, "Overlay not shown")
+        self.evManager.Notify(TickEvent(10))
+        self.evManager.Notify(RenderEvent(10))
+        view.ToggleProfiler()
+    
+    def testToggleKey(self):
+        """Verify that F3 turns the profiler and its overlay on and off"""
+        pygame.init()
+        setMode = pygame.display.set_mode
+        pygame.display.set_mode = lambda size: setMode(size, 0, 32)
+        try:
+            view = PygameView()
+        finally:
+            pygame.display.set_mode = setMode
+        keybd = KeyboardController()
+        spinner = CPUSpinnerController(inputs=[keybd])
+        getEvents = pygame.event.get
+        pygame.event.get = lambda: [MockKeyEvent(pygame.locals.KEYDOWN, pygame.locals.K_F3)]
+        try:
+            spinner.PollInput()
+            self.evManager.Notify(TickEvent(10))
+            self.assertNotEqual(self.evManager.profiler, None, "F3 didn't enable the profiler")
+            self.assert_(view.profilerOverlay.visible, "F3 didn't show the overlay")
+            pygame.event.get = lambda: []
+            self.evManager.Notify(TickEvent(20))
+            self.evManager.Notify(RenderEvent(20))
+            timed = [name for category, name, count, timings in self.evManager.profiler.Report('view')]
+            self.assertEquals(sorted(timed), ['draw', 'flip', 'update'], "View stages timed: %s" % timed)
+            pygame.event.get = lambda: [MockKeyEvent(pygame.locals.KEYDOWN, pygame.locals.K_F3)]
+            spinner.PollInput()
+            self.evManager.Notify(TickEvent(30))
+            self.assertEquals(self.evManager.profiler, None, "F3 didn't disable the profiler")
+            self.assertFalse(view.profilerOverlay.visible, "F3 didn't hide the overlay")
+        finally:
+            pygame.event.get = getEvents
+
+class ClockListener:
+    """Keeps track of the class and time of each tick and render (which can't be kept themselves,
+    as the event objects are reused)"""
+    def __init__(self):
+        self.events = []
+        EventManager().RegisterListener(self, (TickEvent, RenderEvent))
+    def Notify(self, event):
+        self.events.append((event.__class__, event.time))
+
+class FramePacingTest(EventDrivenTestCase):
+    def setUp(self):
+        EventDrivenTestCase.setUp(self)
+        self.spinner = CPUSpinnerController(tickRate=100, maxCatchUp=10)
+        self.listener = ClockListener()
+    
+    def testFixedStep(self):
+        """Verify that the game ticks at a fixed step however long frames take, rendering once per frame"""
+        for now in (16, 29, 75):
+            self.spinner.Advance(now)
+        ticks = [time for eventClass, time in self.listener.events if eventClass is TickEvent]
+        renders = [time for eventClass, time in self.listener.events if eventClass is RenderEvent]
+        self.assertEquals(ticks, [10, 20, 30, 40, 50, 60, 70], "Ticks at %s" % ticks)
+        self.assertEquals(renders, [10, 20, 70], "Renders at %s" % renders)
+    
+    def testCatchUpLimit(self):
+        """Verify that a long stall only runs maxCatchUp ticks, and the rest of the time is lost
+            without the game clock jumping"""
+        self.spinner.Advance(1005)
+        ticks = [time for eventClass, time in self.listener.events if eventClass is TickEvent]
+        self.assertEquals(ticks, range(10, 110, 10), "Ran ticks at %s to catch up" % ticks)
+        self.assertEquals(self.spinner.time, 100, "Game clock at %s" % self.spinner.time)
+        self.assertEquals(self.spinner.lostTime, 900, "Lost %s ms" % self.spinner.lostTime)
+        self.spinner.Advance(1015)
+        ticks = [time for eventClass, time in self.listener.events if eventClass is TickEvent]
+        self.assertEquals(ticks[10:], [110], "Ticks after the stall at %s" % ticks[10:])
+    
+    def testQuitStopsTicking(self):
+        """Verify that no more ticks or renders happen once the game is quit"""
+        self.evManager.Notify(QuitEvent())
+        self.spinner.Advance(100)
+        self.assertEquals(self.listener.events, [], "Events after quitting: %s" % self.listener.events)
+
+class InputLatencyTest(EventDrivenTestCase):
+    def setUp(self):
+        EventDrivenTestCase.setUp(self)
+        self.game = Game.NewInstance(self.evManager)
+        while self.game.state == Game.STATE_PREPARING:
+            self.evManager.Notify(TickEvent(10))
+        self.hero = self.game.heroes['hero']
+    
+    def testScoredByKeypress(self):
+        """Verify that a solve is scored by when it was typed, not when the event arrives"""
+        self.evManager.Notify(RequestAttackEvent())
+        problem = self.hero.problem
+        damage = []
+        self.hero.Attack = lambda power: damage.append(power)
+        self.evManager.Notify(TickEvent(2000))
+        self.evManager.Notify(SolveEvent(unicode(problem.solution), 1010))
+        self.assertEquals(damage, [self.hero.attackPower*0.8],
+                          "Solve typed 1s into a 5s wait scored %s" % damage)
+    
+    def testHistogram(self):
+        """Verify that latencies are counted in buckets, and percentiles found from them"""
+        histogram = Histogram(bucketWidth=10)
+        for latency in (3, 12, 15, 18, 41):
+            histogram.Add(latency)
+        self.assertEquals(histogram.Counts(), [(0, 1), (10, 3), (40, 1)], "Buckets: %s" % histogram.Counts())
+        self.assertEquals(histogram.Percentile(50), 10, "Median bucket %s" % histogram.Percentile(50))
+        self.assertEquals(histogram.Percentile(100), 40, "Top bucket %s" % histogram.Percentile(100))
+    
+    def testLatencyRecorded(self):
+        """Verify that the time from a keypress to the frame showing it is recorded"""
+        pygame.init()
+        setMode = pygame.display.set_mode
+        pygame.display.set_mode = lambda size: setMode(size, 0, 32)
+        try:
+            view = PygameView()
+        finally:
+            pygame.display.set_mode = setMode
+        now = pygame.time.get_ticks()
+        self.evManager.Notify(SolutionUpdateEvent("4", 20, now - 30))
+        self.assertEquals(view.inputLatency, {}, "Latency recorded before the frame was shown")
+        self.evManager.Notify(RenderEvent(20))
+        histogram = view.inputLatency['SolutionUpdateEvent']
+        self.assertEquals(histogram.count, 1, "%s latencies recorded" % histogram.count)
+        self.assert_(histogram.Mean() >= 30, "Latency of %s ms recorded" % histogram.Mean())
+
+class ProblemRegistryTest(EventDrivenTestCase):
+    def setUp(self):
+        EventDrivenTestCase.setUp(self)
+        self.generated = []
+        self.registry = ProblemRegistry(poolSize=4, refillPerTick=1, defaults=False)
+        self.type = Type("arithmetic", Category("math"))
+        self.level = Level("counting", self.type, self.Generate)
+        self.registry.AddLevel(self.level)
+    
+    def Generate(self, level, rng):
+        self.generated.append(level)
+        return Problem(u"1 + 1", 2, level)
+    
+    def testPooled(self):
+        """Verify that problems are handed out from the pool, and it is topped up on later ticks"""
+        self.registry.Refill()
+        self.assertEquals(len(self.generated), 4, "Pool filled with %s problems" % len(self.generated))
+        self.registry.Next()
+        self.registry.Next()
+        self.assertEquals(len(self.generated), 4, "Problems generated when handed out")
+        self.evManager.Notify(TickEvent(10))
+        self.assertEquals(len(self.generated), 5, "Pool not topped up one problem per tick")
+
+    def testFull(self):
+        """Verify that ticks leave full pools alone, until a problem is handed out or a level added"""
+        self.registry.Refill()
+        self.assert_(self.registry.full, "Pools not marked full once filled")
+        self.assertEquals(self.registry.Refill(), 0, "Problems generated for full pools")
+        self.registry.Next()
+        self.assertEquals(self.registry.Refill(), 1, "Pool not topped up after a problem was handed out")
+        self.registry.AddLevel(Level("doubling", self.type, self.Generate))
+        self.assertEquals(self.registry.Refill(), 4, "Pool of an added level not filled")
+    
+    def testWeights(self):
+        """Verify that levels are chosen by weight, and levels weighted 0 are never chosen"""
+        easy = Level("easy", self.type, lambda level, rng: Problem(u"0 + 0", 0, level), weight=0)
+        self.registry.AddLevel(easy)
+        self.assertEquals(set([self.registry.Next().level for i in range(20)]), set([self.level]),
+                          "Level with no weight was chosen")
+        self.registry.SetWeight(easy.key(), 1000)
+        self.registry.SetWeight(self.level.key(), 0)
+        self.assertEquals(self.registry.Next().level, easy, "Heavily weighted level not chosen")
+
+    def testNoWeights(self):
+        """Verify that levels are chosen evenly when every one is weighted 0, and that a registry
+            with no problems at all says so when asked for one"""
+        easy = Level("easy", self.type, lambda level, rng: Problem(u"0 + 0", 0, level), weight=0)
+        self.registry.AddLevel(easy)
+        self.registry.SetWeight(self.level.key(), 0)
+        chosen = set([self.registry.ChooseLevel() for i in range(50)])
+        self.assertEquals(chosen, set([easy.key(), self.level.key()]), "Levels chosen: %s" % chosen)
+        empty = ProblemRegistry(poolSize=4, defaults=False, evManager=EventManager.NewInstance())
+        self.assertRaises(ValueError, empty.Next)
+
+    def testAddProblemEvents(self):
+        """Verify that levels and fixed problems can be added through events"""
+        level = Level("spelling", Type("words", Category("english")))
+        self.evManager.Notify(AddProblemLevelEvent(level))
+        self.evManager.Notify(AddProblemEvent(Problem(u"C A T", u"cat", level)))
+        self.registry.SetWeight(self.level.key(), 0)
+        self.assertEquals(self.registry.Next().question, u"C A T", "Added problem not handed out")
+        self.assert_("english" in self.registry.categories, "Category of added level not registered")
+    
+    def testDefaultLevels(self):
+        """Verify that the multiplication levels share out the 121 tables from 0 to 10 between them"""
+        levels = MultiplicationLevels(Type("multiplication", Category("math")))
+        self.assertEquals([level.name for level in levels], ['easy', 'medium', 'hard'], "Levels: %s" % levels)
+        self.assertEquals(sum([level.weight for level in levels]), 121, "Levels don't cover the tables")
+
+class GameSeedTest(EventDrivenTestCase):
+    def startGame(self, seed):
+        evManager = EventManager.NewInstance()
+        game = Game.NewInstance(evManager, seed)
+        listener = SubscribingListener((GameStartedEvent,))
+        evManager.RegisterListener(listener, (GameStartedEvent,))
+        evManager.Notify(TickEvent(10))
+        game.listener = listener
+        return game
+    
+    def playOut(self, game):
+        """Return the problems the hero is set and when the enemy attacks"""
+        problems = [game.problems.Next().question for i in range(20)]
+        return problems, game.enemies['enemy1'].nextAttack
+    
+    def testReplay(self):
+        """Verify that games started with the same seed play out the same way, whatever else
+            uses the random module in between"""
+        first = self.playOut(self.startGame(42))
+        random.random()
+        second = self.playOut(self.startGame(42))
+        self.assertEquals(first, second, "Games with the same seed differed")
+        self.assertNotEqual(first, self.playOut(self.startGame(43)), "Games with different seeds were the same")
+    
+    def testSeedExposed(self):
+        """Verify that the GameStartedEvent carries the game's seed"""
+        game = self.startGame(None)
+        self.assertEquals([event.seed for event in game.listener.events], [game.seed],
+                          "GameStartedEvent seeds: %s" % [event.seed for event in game.listener.events])
+
+class CompactEventTest(EventDrivenTestCase):
+    def testSlots(self):
+        """Verify that events keep their data in slots (no per-instance __dict__ or name)"""
+        for event in (TickEvent(10), SolveEvent(u"42", 10), AttackEvent("hero", "enemy1", 10)):
+            self.assertFalse(hasattr(event, '__dict__'), "%s has a __dict__" % event.__class__.__name__)
+        self.assertEquals(str(QuitEvent()), "Program Quit Event", "Event name not kept on the class")
+    
+    def testPooledTick(self):
+        """Verify that the same TickEvent is reused tick after tick, with the new time each time"""
+        listener = ClockListener()
+        ticks = []
+        listener.Notify = lambda event: ticks.append((id(event), event.time))
+        for time in (10, 20, 30):
+            self.evManager.NotifyTick(time, 10)
+        self.assertEquals([time for eventID, time in ticks], [10, 20, 30], "Ticks at %s" % ticks)
+        self.assertEquals(len(set([eventID for eventID, time in ticks])), 1, "TickEvent not reused")
+    
+    def testQueuedTickNotReused(self):
+        """Verify that a tick still waiting in the queue isn't reused for the next one"""
+        self.evManager.SetQueued(True, maxEventsPerTick=0)
+        listener = ClockListener()
+        self.evManager.Notify(QuitEvent()) #held over: no budget
+        self.evManager.NotifyTick(10)
+        self.evManager.NotifyTick(20)
+        self.evManager.ProcessQueue(True)
+        ticks = [time for eventClass, time in listener.events if eventClass is TickEvent]
+        self.assertEquals(ticks, [10, 20], "Ticks at %s" % ticks)
+
+class ReplayTest(EventDrivenTestCase):
+    def setUp(self):
+        EventDrivenTestCase.setUp(self)
+        handle, self.logFile = tempfile.mkstemp(".log")
+        os.close(handle)
+        os.remove(self.logFile) #the recorder starts a new log
+    
+    def tearDown(self):
+        if os.path.exists(self.logFile):
+            os.remove(self.logFile)
+        EventDrivenTestCase.tearDown(self)
+    
+    def recordBattle(self, seed, queued=False):
+        """Play a scripted battle, recording it to the log"""
+        evManager = EventManager.NewInstance()
+        evManager.SetQueued(queued, maxEventsPerTick=50)
+        simulator = SimulationController(25, 600000, seed, evManager)
+        simulator.game = Game.NewInstance(evManager, seed)
+        simulator.player = ScriptedPlayerController(simulator.game, rng=random.Random(seed), evManager=evManager)
+        recorder = BattleRecorder(self.logFile, evManager)
+        simulator.Run()
+        recorder.Close()
+        return simulator
+    
+    def testReplay(self):
+        """Verify that a replayed battle plays out as recorded, queued or not"""
+        for seed, queued in ((1, False), (2, True), (5, False)):
+            simulator = self.recordBattle(seed, queued)
+            replayer = Replay(self.logFile)
+            self.assertEquals(replayer.game.seed, seed, "Replayed game seed %s" % replayer.game.seed)
+            self.assertEquals(replayer.game.heroes['hero'].health, simulator.game.heroes['hero'].health,
+                              "Hero health %s after replay" % replayer.game.heroes['hero'].health)
+            self.assertEquals(replayer.game.enemies.keys(), simulator.game.enemies.keys(),
+                              "Enemies %s left after replay" % replayer.game.enemies.keys())
+            self.assertEquals(replayer.Differences(), 0, "%s differences from the log" % replayer.Differences())
+            os.remove(self.logFile)
+    
+    def testRecordAgain(self):
+        """Verify that recording to an existing log replaces it, rather than adding to it"""
+        self.recordBattle(1)
+        simulator = self.recordBattle(2)
+        replayer = Replay(self.logFile)
+        self.assertEquals(replayer.game.seed, 2, "Replayed game seed %s" % replayer.game.seed)
+        self.assertEquals(replayer.game.heroes['hero'].health, simulator.game.heroes['hero'].health,
+                          "Hero health %s after replay" % replayer.game.heroes['hero'].health)
+        self.assertEquals(replayer.Differences(), 0, "%s differences from the log" % replayer.Differences())
+    
+    def testDifferences(self):
+        """Verify that a game that doesn't play out as recorded is caught"""
+        self.recordBattle(1)
+        replayer = ReplayController(self.logFile, EventManager.NewInstance())
+        replayer.game.heroSettings = {'attackPower': 30}
+        self.assert_(replayer.Run() > 0, "Weaker hero replayed without differences")
+    
+    def testCompact(self):
+        """Verify that only the ticks the clock doesn't reach on its own are logged"""
+        simulator = self.recordBattle(1)
+        header, records = ReadLog(self.logFile)
+        ticks = [time for time, code, values in records if code == 0]
+        self.assertEquals(ticks, [25], "Ticks logged at %s" % ticks)
+        self.assert_(os.path.getsize(self.logFile) < simulator.ticks*5,
+                     "%s byte log for %s ticks" % (os.path.getsize(self.logFile), simulator.ticks))
+    
+    def testSeek(self):
+        """Verify that a replay can go back to an earlier time, and play on from there the same way"""
+        self.recordBattle(1)
+        replayer = ReplayController(self.logFile, EventManager.NewInstance(), snapshotInterval=2000)
+        replayer.Run(until=6000)
+        snapshot = replayer.game.Snapshot()
+        replayer.Run()
+        replayer.Seek(6000)
+        self.assertEquals(replayer.time, 6000, "Seeked to %s" % replayer.time)
+        self.assertEquals(replayer.game.Snapshot(), snapshot, "Game differs after seeking back")
+        replayer.Seek(0)
+        replayer.Run()
+        self.assertEquals(replayer.Differences(), 0, "%s differences after seeking back" % replayer.Differences())
+    
+    def testJumps(self):
+        """Verify that a jump in the game clock is logged and followed on replay"""
+        evManager = EventManager.NewInstance()
+        recorder = BattleRecorder(self.logFile, evManager)
+        for time in (10, 20, 30, 500, 510):
+            evManager.NotifyTick(time, 10)
+        evManager.Notify(QuitEvent())
+        recorder.Close()
+        
+        listener = ClockListener()
+        replayer = ReplayController(self.logFile, self.evManager)
+        replayer.Run()
+        ticks = [time for eventClass, time in listener.events if eventClass is TickEvent]
+        self.assertEquals(ticks, [10, 20, 30, 500, 510], "Replayed ticks at %s" % ticks)
+
+class SnapshotTest(EventDrivenTestCase):
+    def startBattle(self, seed, evManager):
+        """Start a scripted battle, returning the game and player"""
+        game = Game.NewInstance(evManager, seed)
+        player = ScriptedPlayerController(game, rng=random.Random(seed), evManager=evManager)
+        return game, player
+    
+    def tickUntil(self, evManager, game, start, end):
+        """Tick every 25ms from start until end (or the game ends), returning the time reached"""
+        time = start
+        while time <= end:
+            evManager.NotifyTick(time, 25)
+            time += 25
+            if game.state == Game.STATE_GAMEOVER or not game.enemies:
+                break
+        return time
+    
+    def testRestoreInPlace(self):
+        """Verify that restoring a snapshot puts the game back the way it was"""
+        evManager = EventManager.NewInstance()
+        game, player = self.startBattle(3, evManager)
+        self.tickUntil(evManager, game, 25, 3000)
+        snapshot = game.Snapshot()
+        health = game.enemies['enemy1'].health, game.heroes['hero'].health
+        self.tickUntil(evManager, game, 3025, 8000)
+        evManager.time = 3000
+        game.Restore(snapshot)
+        self.assertEquals((game.enemies['enemy1'].health, game.heroes['hero'].health), health,
+                          "Health after restoring: %s" % ((game.enemies['enemy1'].health, game.heroes['hero'].health),))
+        self.assertEquals(game.Snapshot(), snapshot, "Game differs from the snapshot it was restored from")
+    
+    def testResume(self):
+        """Verify that a game restored into a new session (with its clock started again) plays
+            on as it would have"""
+        evManager = EventManager.NewInstance()
+        game, player = self.startBattle(1, evManager)
+        self.tickUntil(evManager, game, 25, 4000)
+        snapshot = game.Snapshot()
+        playerState = player.rng.getstate(), player.state, player.answerTime
+        end = self.tickUntil(evManager, game, 4025, 600000)
+        
+        evManager = EventManager.NewInstance()
+        resumed, player = self.startBattle(None, evManager)
+        evManager.NotifyTick(0, 25)
+        resumed.Restore(snapshot)
+        player.rng.setstate(playerState[0])
+        player.state = playerState[1]
+        player.answerTime = playerState[2] - 4000
+        resumedEnd = self.tickUntil(evManager, resumed, 25, 600000)
+        self.assertEquals(resumedEnd, end - 4000, "Resumed game ended at %s, not %s" % (resumedEnd, end - 4000))
+        self.assertEquals(resumed.heroes['hero'].health, game.heroes['hero'].health,
+                          "Resumed hero health %s" % resumed.heroes['hero'].health)
+        self.assertEquals(resumed.enemyCount, 1, "%s enemies spawned" % resumed.enemyCount)
+    
+    def testResync(self):
+        """Verify that restoring a game sends what the views & controllers go by again: each actor's
+            state & health, and the problem the hero was solving"""
+        evManager = self.evManager
+        game, player = self.startBattle(1, evManager)
+        keybd = KeyboardController(evManager=evManager)
+        time = 25
+        while not game.heroes or game.heroes['hero'].solEndTime == 0:
+            evManager.NotifyTick(time, 25)
+            time += 25
+        snapshot = game.Snapshot()
+        question = game.heroes['hero'].problem.question
+        health = game.enemies['enemy1'].health/game.enemies['enemy1'].maxHealth
+        while game.heroes['hero'].solEndTime != 0:
+            evManager.NotifyTick(time, 25)
+            time += 25
+        self.assertEquals(keybd.state, KeyboardController.STATE_ACTION, "Keyboard still solving")
+        
+        listener = SubscribingListener((GameRestoredEvent, SpawnEvent, ActorRestoredEvent, RequestSolutionEvent))
+        game.Restore(snapshot)
+        self.assertEquals(listener.getEventClasses(), [GameRestoredEvent, SpawnHeroEvent, ActorRestoredEvent,
+                          SpawnEnemyEvent, ActorRestoredEvent, RequestSolutionEvent],
+                          "Events sent on restoring: %s" % listener.getEventClasses())
+        restored = listener.events[4]
+        self.assertEquals((restored.subject, restored.newHealth), ('enemy1', health),
+                          "Enemy restored as %s" % restored)
+        self.assertEquals(listener.events[-1].problem, question, "Problem requested: %s" % listener.events[-1])
+        self.assertEquals(keybd.state, KeyboardController.STATE_SOLVE, "Keyboard not solving after restoring")
+
+    def restoreEnded(self, accuracy):
+        """Play a scripted battle out and restore it as it ended, returning the events that
+            ended it or said it had ended, and the keyboard & simulation controllers"""
+        evManager = self.evManager
+        game, player = self.startBattle(1, evManager)
+        player.accuracy = accuracy
+        keybd = KeyboardController(evManager=evManager)
+        self.tickUntil(evManager, game, 25, 600000)
+        snapshot = game.Snapshot()
+        keybd.state = KeyboardController.STATE_SOLVE
+        simulator = SimulationController(evManager=evManager)
+        listener = SubscribingListener((VictoryEvent, GameOverEvent, GameRestoredEvent))
+        game.Restore(snapshot)
+        return listener.events, keybd, simulator
+
+    def testRestoreWon(self):
+        """Verify that restoring a won battle says so through the GameRestoredEvent, rather than
+            a VictoryEvent (which would end it again)"""
+        events, keybd, simulator = self.restoreEnded(1.0)
+        self.assertEquals([e.__class__ for e in events], [GameRestoredEvent], "Events sent: %s" % events)
+        self.assert_(events[0].endEvent is VictoryEvent, "Restored battle ended with %s" % events[0].endEvent)
+        self.assertEquals(keybd.state, KeyboardController.STATE_VICTORY, "Keyboard not in the victory state")
+        self.assert_(simulator.keepGoing, "Simulation stopped by restoring a won battle")
+
+    def testRestoreLost(self):
+        """Verify that restoring a lost battle says so through the GameRestoredEvent, rather than
+            a GameOverEvent"""
+        events, keybd, simulator = self.restoreEnded(0.0)
+        self.assertEquals([e.__class__ for e in events], [GameRestoredEvent], "Events sent: %s" % events)
+        self.assert_(events[0].endEvent is GameOverEvent, "Restored battle ended with %s" % events[0].endEvent)
+        self.assertEquals(keybd.state, KeyboardController.STATE_ACTION, "Keyboard in state %s" % keybd.state)
+        self.assert_(simulator.keepGoing, "Simulation stopped by restoring a lost battle")
+    
+    def testCompact(self):
+        """Verify that a snapshot is small"""
+        evManager = EventManager.NewInstance()
+        game, player = self.startBattle(1, evManager)
+        self.tickUntil(evManager, game, 25, 4000)
+        self.assert_(len(game.Snapshot()) < 16384, "%s byte snapshot" % len(game.Snapshot()))
+
+class ArenaTest(EventDrivenTestCase):
+    def setUp(self):
+        EventDrivenTestCase.setUp(self)
+        self.arena = ActorArena(self.evManager, capacity=2, seed=0)
+        self.heroes = {}
+        self.enemies = [ArenaEnemyModel("enemy%s" % i, self.heroes, 0, self.arena, attackWait=1000)
+                        for i in range(5)]
+        self.listener = SubscribingListener((WaitEvent, AttackEvent, HurtEvent, DieEvent))
+        self.listener.recordTicks = False
+    
+    def testSlotView(self):
+        """Verify that an arena actor's state is kept in the arena's arrays"""
+        enemy = self.enemies[3]
+        enemy.health = 42
+        self.assertEquals(self.arena.health[enemy.slot], 42, "Health not kept in the arena")
+        self.arena.state[enemy.slot] = ActorModel.STATE_HURTING
+        self.assertEquals(enemy.state, ActorModel.STATE_HURTING, "State not read from the arena")
+        self.assert_(self.arena.capacity >= 5, "Arena didn't grow to hold 5 actors")
+        self.assertFalse(self.evManager.listeners.has_key(enemy), "Arena actor registered as a listener")
+    
+    def testAttacks(self):
+        """Verify that actors attack when due, and events are only sent for the ones that change"""
+        for enemy in self.enemies:
+            enemy.nextAttack = 10000
+        self.enemies[1].nextAttack = 100
+        self.enemies[4].nextAttack = 100
+        self.arena.Schedule()
+        for time in (50, 100, 150):
+            self.evManager.Notify(TickEvent(time))
+        attackers = [event.subject for event in self.listener.events]
+        self.assertEquals(sorted(attackers), ["enemy1", "enemy4"], "Events from %s" % attackers)
+        self.assertEquals([enemy.state for enemy in self.enemies], [0, 1, 0, 0, 1], "States after attacking")
+        self.evManager.Notify(TickEvent(400))
+        self.assertEquals([enemy.state for enemy in self.enemies], [0]*5, "States after attacks ended")
+        self.assert_(self.enemies[1].nextAttack >= 600, "Next attack at %s" % self.enemies[1].nextAttack)
+    
+    def testDamage(self):
+        """Verify that attacks on arena actors hurt them, kill them and free their slots"""
+        enemy = self.enemies[2]
+        self.evManager.Notify(AttackEvent("hero", "enemy2", 60))
+        self.assertEquals(enemy.health, 40, "Health after attack: %s" % enemy.health)
+        self.assertEquals(enemy.state, ActorModel.STATE_HURTING, "Not hurting after attack")
+        self.evManager.Notify(AttackEvent("hero", "enemy2", 60))
+        self.assertEquals([event.__class__ for event in self.listener.events if not isinstance(event, AttackEvent)],
+                          [HurtEvent, HurtEvent, DieEvent],
+                          "Events: %s" % [str(event) for event in self.listener.events])
+        slot = enemy.slot
+        enemy.Remove()
+        newcomer = ArenaEnemyModel("enemy5", self.heroes, 0, self.arena)
+        self.assertEquals(newcomer.slot, slot, "Freed slot not reused")
+        self.assertEquals(newcomer.health, 100, "Reused slot not reset")
+    
+    def testOneStream(self):
+        """Verify that an arena actor's own attacks & hurts draw from the arena's random number stream"""
+        enemy = self.enemies[2]
+        rng = numpy.random.RandomState()
+        rng.set_state(self.arena.rng.get_state())
+        nextAttack = enemy.nextAttack
+        enemy.Hurt(10)
+        expected = nextAttack + int(rng.random_sample() * 501)
+        self.assertEquals(enemy.nextAttack, expected, "Next attack at %s, not %s" % (enemy.nextAttack, expected))
+        self.assertEquals(self.arena.rng.random_sample(), rng.random_sample(), "Arena stream out of step")
+
+    def testSaveSettings(self):
+        """Verify that an arena actor's timing settings, kept in the arena, are saved with its state"""
+        settings = [1234, 7.0, 150, 250]
+        for name, value in zip(ArenaEnemyModel.settings, settings):
+            setattr(self.enemies[0], name, value)
+        self.enemies[1].LoadState(self.enemies[0].SaveState())
+        found = [getattr(self.enemies[1], name) for name in ArenaEnemyModel.settings]
+        self.assertEquals(found, settings, "Settings loaded: %s" % found)
+
+    def testDeadlines(self):
+        """Verify that a slot's deadline is worked out again when it changes, and the arena's timer
+            kept for the earliest"""
+        enemy = self.enemies[2]
+        self.assertEquals(self.arena.deadline[enemy.slot], enemy.nextAttack,
+                          "Deadline %s before attack at %s" % (self.arena.deadline[enemy.slot], enemy.nextAttack))
+        self.evManager.Notify(AttackEvent("hero", "enemy2", 10))
+        self.assertEquals(self.arena.deadline[enemy.slot], enemy.HurtEndTime,
+                          "Deadline %s while hurt until %s" % (self.arena.deadline[enemy.slot], enemy.HurtEndTime))
+        self.assertEquals(self.arena.timer[0], min([self.arena.Deadlines([e.slot])[0] for e in self.enemies]),
+                          "Timer set for %s" % self.arena.timer[0])
+        enemy.Remove()
+        self.assertEquals(self.arena.deadline[enemy.slot], numpy.inf, "Released slot still due")
+    
+    def testBattle(self):
+        """Verify that battles can be played in arena mode, and snapshots restored"""
+        for seed in range(3):
+            simulator = RunBattle(seed, arena=True)
+            self.assert_(simulator.outcome in ("victory", "defeat"), "Battle outcome %s" % simulator.outcome)
+        evManager = EventManager.NewInstance()
+        game = Game.NewInstance(evManager, 1, True)
+        for time in range(0, 3000, 25):
+            evManager.NotifyTick(time, 25)
+        snapshot = game.Snapshot()
+        for time in range(3000, 9000, 25):
+            evManager.NotifyTick(time, 25)
+        evManager.time = 2975
+        game.Restore(snapshot)
+        self.assertEquals(game.Snapshot(), snapshot, "Arena game differs from the snapshot it was restored from")
+
+if numpy is None:
+    del ArenaTest
+
+class ImageRegistryTest(EventDrivenTestCase):
+    def setUp(self):
+        EventDrivenTestCase.setUp(self)
+        pygame.init()
+        pygame.display.set_mode((640,480), 0, 32)
+        self.group = pygame.sprite.RenderUpdates()
+    
+    def testLoadOnce(self):
+        """Verify that an image file is only loaded once"""
+        images = ImageRegistry()
+        self.assert_(images.Load("wait.png") is images.Load("wait.png"), "Image was loaded twice")
+    
+    def testSharedImages(self):
+        """Verify that sprites of the same kind share their images"""
+        first = EnemySprite(10, 10, "enemy1", self.group)
+        second = EnemySprite(20, 20, "enemy2", self.group)
+        self.assert_(first.hurtImage is second.hurtImage, "Enemy sprites did not share their images")
+        first = HeroSprite(10, 10, "hero1", self.group)
+        second = HeroSprite(20, 20, "hero2", self.group)
+        self.assert_(first.waitImage is second.waitImage, "Hero sprites did not share their images")
+
+    def testHealthBarLeavesSharedImages(self):
+        """Verify that showing an actor's health doesn't draw on the images it shares with other actors"""
+        hurt = EnemySprite(10, 10, "enemy1", self.group)
+        healthy = EnemySprite(20, 20, "enemy2", self.group)
+        before = pygame.image.tostring(hurt.hurtImage, "RGB")
+        self.evManager.Notify(HurtEvent("enemy1", 0.5))
+        self.evManager.Notify(HurtEvent("enemy2", 1.0))
+        self.group.update()
+        self.assertEquals(pygame.image.tostring(hurt.hurtImage, "RGB"), before,
+                          "Shared hurt image was drawn on")
+        self.assert_(hurt.image is not healthy.image,
+                     "Actors with different health should not show the same image")
+        self.assertEquals(hurt.image.get_at((hurt.healthWidth, 0))[:3], (0,0,0),
+                          "Health bar should stop at half the image width")
+
 #view tests(?)
 
 if __name__ == '__main__':
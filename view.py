@@ -1,13 +1,66 @@
 from EventManager import *
+from profiler import *
 
 import pygame
 from pygame.locals import *
 
+import os
+
+class ImageRegistry(object):
+	"""Process-wide store of the images sprites are drawn with, so that each one is only
+		loaded (or drawn) once, converted to the display's pixel format, and shared by every
+		sprite that uses it.  Shared images must not be drawn on by the sprites using them"""
+	__metaclass__ = SingletonType
+	
+	def __init__(self):
+		self.images = {} #filename or name -> surface
+	
+	def Load(self, filename):
+		"""Return the shared image loaded from the given file in the images directory"""
+		try:
+			return self.images[filename]
+		except KeyError:
+			image = self.Convert(pygame.image.load(os.path.join("images", filename)))
+			self.images[filename] = image
+			return image
+	
+	def Get(self, name, create):
+		"""Return the shared image with the given name, calling create() to make it the first time"""
+		try:
+			return self.images[name]
+		except KeyError:
+			image = self.images[name] = create()
+			return image
+	
+	def Convert(self, image):
+		"""Convert image to the display's pixel format (keeping per-pixel alpha) for faster blits
+			this is only possible once the display has been set up"""
+		if pygame.display.get_surface() is None:
+			return image
+		if image.get_flags() & SRCALPHA:
+			return image.convert_alpha()
+		return image.convert()
+
+def SolidImage(color, size=(64,64)):
+	"""Create an image filled with the given color"""
+	image = pygame.Surface(size)
+	image.fill(color)
+	return image
+
+def CircleImage(color, size=(64,64)):
+	"""Create an image of a circle in the given color on a transparent (colorkeyed) background"""
+	image = pygame.Surface(size)
+	image.set_colorkey((0,0,0))
+	pygame.draw.circle(image, color, (size[0]/2,size[1]/2), min(size)/2)
+	return image
+
 class PygameView:
 	"""Creates the game window, and handles drawing everything inside it"""
-	def __init__(self):
-		self.evManager = EventManager()
-		self.evManager.RegisterListener(self)
+	def __init__(self, evManager=None):
+		if evManager is None: evManager = EventManager()
+		self.evManager = evManager
+		self.evManager.RegisterListener(self, (RenderEvent, DieEvent, SpawnEvent, GameRestoredEvent,
+			ToggleProfilerEvent, SolutionUpdateEvent, SolveEvent))
 
 		#set up pygame requriements
 		pygame.init()
@@ -16,50 +69,129 @@ class PygameView:
 		self.background = pygame.Surface(self.window.get_size())
 		self.background.fill( (0,0,0) )
 
-		self.backSprites = pygame.sprite.RenderUpdates()
-		self.menuSprites = pygame.sprite.RenderUpdates()
-		self.actorSprites = pygame.sprite.RenderUpdates()
+		self.backSprites = pygame.sprite.RenderUpdates() #static: drawn into the background once
+		self.menuSprites = pygame.sprite.RenderUpdates() #static: drawn into the background once
+		self.sprites = pygame.sprite.LayeredDirty() #everything drawn over the background, when it changes
+		#LayeredDirty goes back to redrawing the whole screen after any frame slower than its
+		#threshold (12.5ms) -- which is just when only drawing what changed matters most
+		#(pygame 2 fixed the spelling of the method)
+		setThreshold = getattr(self.sprites, 'set_timing_threshold', None) or self.sprites.set_timing_treshold
+		setThreshold(float('inf'))
+		self.actorSprites = pygame.sprite.Group() #for looking actors up by evID
 		
 		self.mapspr = MapSprite(self.window.get_rect(), self.backSprites)
-		self.hud = HUD(self.window.get_rect(), self.menuSprites)
+		self.hud = HUD(self.window.get_rect(), self.menuSprites, self.evManager)
+		
+		#composite the map and the HUD frame into the background (the HUD's changing
+		#parts are drawn separately, by the sprites of its boxes)
+		self.backSprites.draw(self.background)
+		self.menuSprites.draw(self.background)
+		self.sprites.add(self.hud.boxSprites.values(), layer=0)
+		self.profilerOverlay = None #created when the profiler is first turned on
+		self.sprites.clear(self.window, self.background)
+		
+		self.pixelsUpdated = 0 #pixels pushed to the display on the last frame
+		self.totalPixelsUpdated = 0
+		self.frames = 0
+		
+		#input latency: milliseconds from a keypress to the display showing it, by event class
+		self.inputLatency = {}
+		self.pendingInputs = [] #(event class name, wall time of keypress) waiting to be shown
 
 	def SpawnHero(self, evID):
 		x = self.window.get_width()/4
 		y = self.window.get_height()/3
-		hero = HeroSprite(x, y, evID, self.actorSprites)
+		hero = HeroSprite(x, y, evID, [self.sprites, self.actorSprites], self.evManager)
 	
 	def SpawnEnemy(self, evID):
 		x = self.window.get_width()*3/4
 		y = self.window.get_height()/3
-		enemy = EnemySprite(x, y, evID, self.actorSprites)
+		enemy = EnemySprite(x, y, evID, [self.sprites, self.actorSprites], self.evManager)
 	
 	def GetActor(self, evID):
 		for sprite in self.actorSprites.sprites():
 			if sprite.evID == evID: return sprite
 	
+	def UpdateSprites(self):
+		self.hud.update()
+		self.sprites.update()
+	
+	def DrawSprites(self):
+		"""Draw whatever has changed, returning the areas of the window that were drawn on"""
+		return self.sprites.draw(self.window)
+	
+	def Flip(self, dirtyRects):
+		"""Push the given areas of the window to the display"""
+		self.pixelsUpdated = 0
+		for rect in dirtyRects:
+			self.pixelsUpdated += rect.width*rect.height
+		self.totalPixelsUpdated += self.pixelsUpdated
+		self.frames += 1
+		pygame.display.update(dirtyRects)
+		if self.pendingInputs:
+			self.RecordInputLatency(pygame.time.get_ticks())
+	
+	def RecordInputLatency(self, now):
+		"""The keypresses waiting to be shown have just been flipped to the display
+			(the HUD redraws the solution on the frame after the event): record how long they took"""
+		profiler = self.evManager.profiler
+		for name, wallTime in self.pendingInputs:
+			latency = now - wallTime
+			try:
+				self.inputLatency[name].Add(latency)
+			except KeyError:
+				self.inputLatency[name] = Histogram()
+				self.inputLatency[name].Add(latency)
+			if profiler is not None:
+				profiler.Record('input', name, latency/1000.0)
+		self.pendingInputs = []
+	
+	def ProfileFrame(self, profiler):
+		"""Draw a frame, recording how long each stage takes"""
+		start = default_timer()
+		self.UpdateSprites()
+		updated = default_timer()
+		dirtyRects = self.DrawSprites()
+		drawn = default_timer()
+		self.Flip(dirtyRects)
+		flipped = default_timer()
+		profiler.Record('view', 'update', updated - start)
+		profiler.Record('view', 'draw', drawn - updated)
+		profiler.Record('view', 'flip', flipped - drawn)
+	
+	def ToggleProfiler(self):
+		"""Turn the profiler (and its overlay) on or off"""
+		if self.evManager.profiler is None:
+			self.evManager.EnableProfiler()
+			if self.profilerOverlay is None:
+				self.profilerOverlay = ProfilerOverlay(self.window.get_rect(), self.sprites, self.evManager)
+			self.profilerOverlay.Show()
+		else:
+			self.evManager.DisableProfiler()
+			self.profilerOverlay.Hide()
+	
 	def Notify(self, event):
 		"""Handled events:
-		TickEvent:
-			redraw back & front sprites using double buffering
+		RenderEvent:
+			redraw the sprites that have changed, and update only those parts of the display
+			(timing each stage while the profiler is on)
 		DieEvent:
 		SpawnEvent:
 			Create the spawned actor
+		GameRestoredEvent:
+			Drop the actors' sprites (the actors are spawned again)
+		ToggleProfilerEvent:
+			Turn the profiler and its overlay on or off
+		SolutionUpdateEvent, SolveEvent:
+			Note the time of the keypress, to record how long it takes to reach the display
 		"""
-		if isinstance( event, TickEvent ):
-			#Draw Everything
-			self.backSprites.clear(self.window, self.background)
-			self.menuSprites.clear(self.window, self.background)
-			self.actorSprites.clear(self.window, self.background)
-
-			self.backSprites.update()
-			self.menuSprites.update()
-			self.actorSprites.update()
-			
-			dirtyRects1 = self.backSprites.draw(self.window)
-			dirtyRects2 = self.menuSprites.draw(self.window)
-			dirtyRects3 = self.actorSprites.draw(self.window)
-
-			pygame.display.update(dirtyRects1 + dirtyRects2 + dirtyRects3)
+		if isinstance( event, RenderEvent ):
+			profiler = self.evManager.profiler
+			if profiler is None:
+				self.UpdateSprites()
+				self.Flip(self.DrawSprites())
+			else:
+				self.ProfileFrame(profiler)
 		
 		#..should go to HUD?
 		elif isinstance(event, DieEvent):
@@ -70,6 +202,132 @@ class PygameView:
 		elif isinstance(event, SpawnEvent):
 			if isinstance(event, SpawnHeroEvent): self.SpawnHero(event.evID)
 			if isinstance(event, SpawnEnemyEvent): self.SpawnEnemy(event.evID)
+		
+		elif isinstance(event, GameRestoredEvent):
+			for sprite in self.actorSprites.sprites():
+				sprite.kill()
+		
+		elif isinstance(event, ToggleProfilerEvent):
+			self.ToggleProfiler()
+		
+		elif isinstance(event, (SolutionUpdateEvent, SolveEvent)):
+			if event.wallTime is not None:
+				self.pendingInputs.append((event.__class__.__name__, event.wallTime))
+
+class ProfilerOverlay(pygame.sprite.DirtySprite):
+	"""Shows the slowest things the profiler has timed (50th, 90th and 99th percentiles, in ms)
+		over the top of the window.  Hidden until shown, and only re-rendered every refreshWait ms"""
+	_layer = 2 #drawn over everything
+	
+	def __init__(self, rect, group=None, evManager=None, lines=12, refreshWait=500):
+		pygame.sprite.DirtySprite.__init__(self, group)
+		if evManager is None: evManager = EventManager()
+		self.evManager = evManager
+		
+		self.font = pygame.font.Font(None, 18)
+		self.lines = lines
+		self.columnWidth = 50 #width of each percentile column
+		self.refreshWait = refreshWait
+		self.lastRefresh = None
+		#(translucent: 32 bits whatever the display's depth, which may have no alpha)
+		self.image = pygame.Surface((rect.width/2, (lines+1)*self.font.get_linesize()+8), SRCALPHA, 32)
+		self.rect = self.image.get_rect(topright=rect.topright)
+		self.visible = 0
+	
+	def Show(self):
+		self.visible = 1
+		self.lastRefresh = None
+		self.dirty = 1
+	
+	def Hide(self):
+		self.visible = 0
+		self.dirty = 1
+	
+	def update(self):
+		profiler = self.evManager.profiler
+		if not self.visible or profiler is None:
+			return
+		if self.lastRefresh is not None and self.evManager.time - self.lastRefresh < self.refreshWait:
+			return
+		self.lastRefresh = self.evManager.time
+		self.Render(profiler.Report(limit=self.lines))
+		self.dirty = 1
+	
+	def Render(self, report):
+		self.image.fill((0,0,0,192))
+		lineHeight = self.font.get_linesize()
+		nameWidth = self.rect.width - 3*self.columnWidth
+		rows = [("ms", "p50", "p90", "p99")]
+		for category, name, count, timings in report:
+			rows.append(("%s %s" % (category, name), "%.2f" % (timings[50]*1000),
+				"%.2f" % (timings[90]*1000), "%.2f" % (timings[99]*1000)))
+		for i, row in enumerate(rows):
+			y = 4 + i*lineHeight
+			self.image.blit(self.font.render(row[0], True, (255,255,255)), (4, y))
+			for j, column in enumerate(row[1:]):
+				text = self.font.render(column, True, (255,255,255))
+				self.image.blit(text, (nameWidth + (j+1)*self.columnWidth - text.get_width() - 4, y))
+
+class TextCache(object):
+	"""Keeps the surfaces rendered by a font, so the same text is only rendered once:
+		* whole strings in a least-recently-used cache of limited size
+		* single characters (glyphs) in an atlas that is never emptied, for text that changes
+			a character at a time (like the solution being typed)
+	Tracks the hits and misses of each (hits & misses for the strings, glyphHits & glyphMisses
+	for the atlas) so they can be sized separately"""
+	def __init__(self, font, capacity=64):
+		self.font = font
+		self.capacity = capacity
+		self.surfaces = {} #(text, antialias, color) -> [surface, last use]
+		self.glyphs = {} #(character, antialias, color) -> surface
+		self.uses = 0
+		self.hits = 0
+		self.misses = 0
+		self.glyphHits = 0
+		self.glyphMisses = 0
+	
+	def Render(self, text, antialias, color):
+		"""Same as font.render, but cached"""
+		key = (text, antialias, tuple(color))
+		self.uses += 1
+		entry = self.surfaces.get(key)
+		if entry is not None:
+			self.hits += 1
+			entry[1] = self.uses
+			return entry[0]
+		self.misses += 1
+		if len(self.surfaces) >= self.capacity:
+			oldest = min(self.surfaces.items(), key=lambda item: item[1][1])[0]
+			del self.surfaces[oldest]
+		surface = self.font.render(text, antialias, color)
+		self.surfaces[key] = [surface, self.uses]
+		return surface
+	
+	def Glyph(self, char, antialias, color):
+		"""Return the rendered surface for a single character from the glyph atlas"""
+		key = (char, antialias, tuple(color))
+		glyph = self.glyphs.get(key)
+		if glyph is None:
+			self.glyphMisses += 1
+			glyph = self.glyphs[key] = self.font.render(char, antialias, color)
+		else:
+			self.glyphHits += 1
+		return glyph
+	
+	def BlitGlyphs(self, surface, text, pos, antialias, color):
+		"""Draw text onto surface at pos one cached glyph at a time"""
+		x, y = pos
+		for char in text:
+			glyph = self.Glyph(char, antialias, color)
+			surface.blit(glyph, (x,y))
+			x += glyph.get_width()
+
+class HUDBoxSprite(pygame.sprite.DirtySprite):
+	"""Puts one of the HUD's boxes on the screen -- only redrawn when the HUD marks it dirty"""
+	def __init__(self, box, offset=(0,0)):
+		pygame.sprite.DirtySprite.__init__(self)
+		self.image = box
+		self.rect = pygame.Rect(box.get_abs_offset(), box.get_size()).move(offset)
 
 class HUD(pygame.sprite.Sprite):
 	"""Handles drawing any displayed info, namely:
@@ -77,10 +335,12 @@ class HUD(pygame.sprite.Sprite):
 		* timer bar for problem
 		* the lines separating the screens
 	"""
-	def __init__(self, rect, group=None):
+	def __init__(self, rect, group=None, evManager=None):
 		pygame.sprite.Sprite.__init__(self, group)
-		self.evManager = EventManager()
-		self.evManager.RegisterListener(self)
+		if evManager is None: evManager = EventManager()
+		self.evManager = evManager
+		self.evManager.RegisterListener(self, (TickEvent, SpawnHeroEvent, RequestSolutionEvent,
+			SolutionUpdateEvent, SolveEvent, VictoryEvent, NextBattleEvent, GameRestoredEvent))
 		
 		self.time = 0
 		
@@ -117,6 +377,7 @@ class HUD(pygame.sprite.Sprite):
 		#set hud font
 		self.font = pygame.font.SysFont("Arial", 18)
 		self.font_height = 20
+		self.text = TextCache(self.font)
 		
 		#initialize instruction text:
 		self.instr_wait = "Press SPACE to attack"
@@ -125,6 +386,15 @@ class HUD(pygame.sprite.Sprite):
 		self.instr_loose = "Game Over! \nPress ESC to quit"
 		self.instr = self.instr_wait
 		self.sol = ""
+		self.timerWidth = 0
+		
+		#parts of the HUD that need to be re-rendered on the next update, and the sprites
+		#that put them on the screen
+		self.boxes = {'instr': self.instrBox, 'solution': self.solutionBox, 'timer': self.timerBox}
+		self.boxSprites = {}
+		for name, box in self.boxes.items():
+			self.boxSprites[name] = HUDBoxSprite(box, self.rect.topleft)
+		self.dirty = set(['instr', 'solution'])
 	
 	def DrawBorder(self, surf):
 		surf.fill(self.color)
@@ -135,33 +405,61 @@ class HUD(pygame.sprite.Sprite):
 		return rect
 	
 	def Victory(self):
-		self.instr = self.instr_win
+		self.SetInstructions(self.instr_win)
 	
 	def Defeat(self):
-		self.instr = self.instr_loose
+		self.SetInstructions(self.instr_loose)
+	
+	def SetInstructions(self, instr):
+		if instr != self.instr:
+			self.instr = instr
+			self.dirty.add('instr')
+	
+	def SetSolution(self, sol):
+		if sol != self.sol:
+			self.sol = sol
+			self.dirty.add('solution')
+	
+	def SetTimerWidth(self, width):
+		if width != self.timerWidth:
+			self.timerWidth = width
+			self.dirty.add('timer')
+	
+	def update(self):
+		"""Re-render only the parts of the HUD whose content has changed"""
+		if not self.dirty: return
+		if 'instr' in self.dirty: self.DrawInstructions()
+		if 'solution' in self.dirty: self.DrawSolution()
+		if 'timer' in self.dirty: self.UpdateTimer()
+		for name in self.dirty:
+			self.boxSprites[name].dirty = 1
+		self.dirty.clear()
 	
 	def DrawInstructions(self, color = False):
 		if not color: color = self.color
 		vpos = 0
 		self.instrBox.fill((0,0,0))
 		for text in self.instr.split('\n'):
-			pImg = self.font.render(text, False, color)
+			pImg = self.text.Render(text, False, color)
 			self.instrBox.blit(pImg, (0,vpos))
 			vpos += self.font_height
 	
 	def DrawSolution(self, color = False):
 		if not color: color = self.color
-		sImg = self.font.render(self.sol, False, color)
 		self.solutionBox.fill((0,0,0))
-		self.solutionBox.blit(sImg, (0,0))
+		self.text.BlitGlyphs(self.solutionBox, self.sol, (0,0), False, color)
+	
+	def TimerWidth(self):
+		"""Width in pixels of the timer bar at the current time"""
+		if self.time >= self.timer[1]: #timer off
+			return 0
+		w = self.timerBox.get_width()
+		p = 1.*(self.timer[1]-self.time)/(self.timer[1]-self.timer[0])
+		return int(w*p)
 	
 	def UpdateTimer(self):
 		#rect = self.DrawBorder(self.timerBox)
-		rect = self.timerBox.get_rect()
-		w = rect.width
-		p = 1.*(self.timer[1]-self.time)/(self.timer[1]-self.timer[0])
-		w = w*p
-		rect = (0,0, w,rect.height)
+		rect = (0,0, self.timerWidth,self.timerBox.get_height())
 		self.timerBox.fill((0,0,0))
 		self.timerBox.fill(self.color, rect)
 	
@@ -173,33 +471,34 @@ class HUD(pygame.sprite.Sprite):
 			display the problem & timer
 		SolutionUpdateEvent:
 			update the solution to the current state
-		SolveEvent:
-			Hide problem & timer
+		SolveEvent, GameRestoredEvent:
+			Hide problem & timer (showing how the battle ended, if the one restored had)
 		"""
 		if isinstance(event, TickEvent):
 			self.time = event.time
-			self.DrawInstructions()
-			self.DrawSolution()
-			if self.time < self.timer[1]: #timer on
-				self.UpdateTimer()
+			self.SetTimerWidth(self.TimerWidth())
 		elif isinstance(event, SpawnHeroEvent):
 			self.hero = event.evID
 		elif isinstance(event, RequestSolutionEvent):
-			self.instr = self.instr_prob % event.problem
+			self.SetInstructions(self.instr_prob % event.problem)
 			self.timer = (self.time, event.endTime)
+			self.SetTimerWidth(self.TimerWidth())
 		elif isinstance(event, SolutionUpdateEvent):
-			self.sol = event.solution
-		elif isinstance(event, SolveEvent):
-			self.sol = ""
-			self.instr = self.instr_wait
+			self.SetSolution(event.solution)
+		elif isinstance(event, (SolveEvent, GameRestoredEvent)):
+			self.SetSolution("")
+			self.SetInstructions(self.instr_wait)
 			self.timer = (0,0)
-			self.timerBox.fill((0,0,0))
+			self.SetTimerWidth(0)
+			if isinstance(event, GameRestoredEvent):
+				if event.endEvent is VictoryEvent: self.Victory()
+				elif event.endEvent is GameOverEvent: self.Defeat()
 		elif isinstance(event, VictoryEvent):
-			self.instr = self.instr_win
+			self.SetInstructions(self.instr_win)
 		elif isinstance(event, NextBattleEvent):
-			self.instr = self.instr_wait
+			self.SetInstructions(self.instr_wait)
 
-class ActorSprite(pygame.sprite.Sprite):
+class ActorSprite(pygame.sprite.DirtySprite):
 	""" Virtual sprite for a generic game actor
 		subclasses must define the following:
 			self.waitImage
@@ -207,78 +506,89 @@ class ActorSprite(pygame.sprite.Sprite):
 			self.defendImage
 			self.hurtImage
 	"""
-	def __init__(self, x, y, evID, group=None):
-		self.evManager = EventManager()
-		self.evManager.RegisterListener( self )
+	_layer = 1 #drawn over the HUD
+	
+	def __init__(self, x, y, evID, group=None, evManager=None):
+		if evManager is None: evManager = EventManager()
+		self.evManager = evManager
+		self.evManager.RegisterListener( self, (ActorStateChangeEvent,), evID )
 		
-		pygame.sprite.Sprite.__init__(self, group)
+		pygame.sprite.DirtySprite.__init__(self, group)
 		
 		self.evID = evID
 		
 		self.pos = (x,y)
 		self.InitImages()
 		
-		self.image = self.waitImage #start out waiting
-		
-		self.rect  = self.image.get_rect()
-		self.rect.center = self.pos
-		
-		self.healthBox = pygame.Surface((self.rect.width,15))
-		self.healthBox.fill((0,255,0))
-		#self.healthBox.set_colorkey((0,0,0))
+		self.healthHeight = 15
+		self.healthWidth = self.waitImage.get_width() #width of the health bar, in pixels
+		self.ShowImage(self.waitImage) #start out waiting
 	
 	def InitImages(self):
-		# predefine images
-		self.deadImage = pygame.Surface((0,0))
-		self.waitImage = pygame.Surface((64,64)) #Idle image
-		self.attackImage = pygame.Surface((64,64)) #Attack image
-		self.defendImage = pygame.Surface((64,64)) #Defend image
-		self.hurtImage = pygame.Surface((64,64)) #Hurt image
+		# predefine images (shared by every actor)
+		images = ImageRegistry()
+		self.deadImage = images.Get("dead", lambda: pygame.Surface((0,0)))
+		self.waitImage = images.Get("blank", lambda: pygame.Surface((64,64))) #Idle image
+		self.attackImage = self.waitImage #Attack image
+		self.defendImage = self.waitImage #Defend image
+		self.hurtImage = self.waitImage #Hurt image
 	
-	def update(self):
-		pygame.sprite.Sprite.update(self)
-		self.image.blit(self.healthBox, (0,0))
+	def ShowImage(self, stateImage):
+		"""Display the given state image with the health bar over it.  The combined image is
+			drawn once per state image and health bar width, and shared between sprites, so
+			the state images themselves are never drawn on"""
+		self.stateImage = stateImage
+		if stateImage is self.deadImage:
+			self.image = stateImage
+		else:
+			key = ("health bar", stateImage, self.healthWidth)
+			self.image = ImageRegistry().Get(key, lambda: self.DrawHealthBar(stateImage))
+		self.rect  = self.image.get_rect()
+		self.rect.center = self.pos
+		self.dirty = 1
 	
-	def UpdateHealth(self, newHealth):
-		y = self.healthBox.get_rect().height
-		x = self.healthBox.get_rect().width
-		dx = x*newHealth
-		grey = 255*newHealth
+	def DrawHealthBar(self, stateImage):
+		"""Return a copy of the given state image with the health bar drawn on it"""
+		image = stateImage.copy()
+		x = image.get_width()
+		y = self.healthHeight
+		grey = 255.*self.healthWidth/x
 		r = min((255-grey)*2, 255)
 		g = min(grey*2, 255)
 		b = 0
 		
-		self.healthBox.fill((0,0,0))
-		self.healthBox.fill((r,g,b), (0,0, dx,y))
+		image.fill((0,0,0), (0,0, x,y))
+		image.fill((r,g,b), (0,0, self.healthWidth,y))
+		return image
+	
+	def UpdateHealth(self, newHealth):
+		self.healthWidth = int(self.waitImage.get_width()*newHealth)
 	
 	def Wait(self):
 		#if self.image == self.attackImage:
-		self.image = self.waitImage
-		self.rect  = self.image.get_rect()
-		self.rect.center = self.pos
+		self.ShowImage(self.waitImage)
 	
 	def Attack(self):
-		if self.image == self.waitImage:
-			self.image = self.attackImage
-			self.rect  = self.image.get_rect()
-			self.rect.center = self.pos
+		if self.stateImage is self.waitImage:
+			self.ShowImage(self.attackImage)
 	
 	def Defend(self):
-		if self.image == self.waitImage:
-			self.image = self.defendImage
-			self.rect  = self.image.get_rect()
-			self.rect.center = self.pos
+		if self.stateImage is self.waitImage:
+			self.ShowImage(self.defendImage)
 	
 	def Hurt(self, newHealth):
 		self.UpdateHealth(newHealth)
-		self.image = self.hurtImage
-		self.rect  = self.image.get_rect()
-		self.rect.center = self.pos
+		self.ShowImage(self.hurtImage)
 	
 	def Die(self):
-		self.image = self.deadImage
+		self.ShowImage(self.deadImage)
+	
+	def Restore(self, stateEvent, newHealth):
+		self.UpdateHealth(newHealth)
+		images = {WaitEvent: self.waitImage, AttackEvent: self.attackImage, DefendEvent: self.defendImage,
+			HurtEvent: self.hurtImage, DieEvent: self.deadImage}
+		self.ShowImage(images[stateEvent])
 	
-	#todo: actor objects should only get notifications for themselves (and maybe clock tick events)
 	def Notify(self, event):
 		"""handled events:
 		WaitEvent:
@@ -291,6 +601,8 @@ class ActorSprite(pygame.sprite.Sprite):
 			Dislpay Hurt
 		DieEvent:
 			Display Die
+		ActorRestoredEvent:
+			Display the state & health restored
 		"""
 		if isinstance(event, ActorStateChangeEvent) and self.evID == event.subject:
 			if isinstance(event, WaitEvent): self.Wait()
@@ -299,55 +611,54 @@ class ActorSprite(pygame.sprite.Sprite):
 			elif isinstance(event, HurtEvent): self.Hurt(event.newHealth)
 			elif isinstance(event, DieEvent): 
 				self.Die()
+			elif isinstance(event, ActorRestoredEvent): self.Restore(event.stateEvent, event.newHealth)
 	
 class HeroSprite(ActorSprite):
 	"""Knows how to draw a hero (images or circles)
 	can eventually be just images -- and then wrapped into ActorSprite class with 
 	special code to map images to a directory based on constructor params
 	"""
-	def __init__(self, x, y, evID, group=None):
-		ActorSprite.__init__(self, x, y, evID, group)
+	def __init__(self, x, y, evID, group=None, evManager=None):
+		ActorSprite.__init__(self, x, y, evID, group, evManager)
 	
 	def InitImages(self):
 		# define images
 		ActorSprite.InitImages(self)
 		
+		images = ImageRegistry()
 		extended = pygame.image.get_extended()
 		if extended:
-			self.waitImage = pygame.image.load("images/wait.png")
-			self.attackImage = pygame.image.load("images/attack.png")
-			self.defendImage = pygame.image.load("images/defend.png")
-			self.hurtImage = pygame.image.load("images/hurt.png")
+			self.waitImage = images.Load("wait.png")
+			self.attackImage = images.Load("attack.png")
+			self.defendImage = images.Load("defend.png")
+			self.hurtImage = images.Load("hurt.png")
 		else:
-			self.waitImage.set_colorkey((0,0,0)) #Idle image
-			pygame.draw.circle(self.waitImage, (255,0,0), (32,32), 32)
-			self.attackImage.set_colorkey((0,0,0)) #Attack image
-			pygame.draw.circle(self.attackImage, (0,0,255), (32,32), 32)
-			self.defendImage.set_colorkey((0,0,0)) #Defend image
-			pygame.draw.circle(self.defendImage, (100,100,100), (32,32), 32)
-			self.hurtImage.set_colorkey((0,0,0)) #Hurt image
-			pygame.draw.circle(self.hurtImage, (100,100,100), (32,32), 32)
+			self.waitImage = images.Get("hero wait", lambda: CircleImage((255,0,0))) #Idle image
+			self.attackImage = images.Get("hero attack", lambda: CircleImage((0,0,255))) #Attack image
+			self.defendImage = images.Get("hero defend", lambda: CircleImage((100,100,100))) #Defend image
+			self.hurtImage = images.Get("hero hurt", lambda: CircleImage((100,100,100))) #Hurt image
 
 class EnemySprite(ActorSprite):
 	"""Knows how to draw an enemy (squares)
 	can eventually be just images -- and then wrapped into ActorSprite class with 
 	special code to map images to a directory based on constructor params
 	"""
-	def __init__(self, x, y, evID, group=None):
-		ActorSprite.__init__(self, x, y, evID, group)
+	def __init__(self, x, y, evID, group=None, evManager=None):
+		ActorSprite.__init__(self, x, y, evID, group, evManager)
 	
 	def InitImages(self):
 		# define images
 		ActorSprite.InitImages(self)
 		
-		self.waitImage.fill((127,127,127)) #Idle image
-		self.attackImage.fill((255,0,0)) #Attack image
-		self.defendImage.fill((0,0,255)) #Defend image
-		self.hurtImage.fill((255,0,255))
+		images = ImageRegistry()
+		self.waitImage = images.Get("enemy wait", lambda: SolidImage((127,127,127))) #Idle image
+		self.attackImage = images.Get("enemy attack", lambda: SolidImage((255,0,0))) #Attack image
+		self.defendImage = images.Get("enemy defend", lambda: SolidImage((0,0,255))) #Defend image
+		self.hurtImage = images.Get("enemy hurt", lambda: SolidImage((255,0,255))) #Hurt image
 
 class MapSprite(pygame.sprite.Sprite):
 	"""Displays the background map"""
 	def __init__(self, rect, group=None):
 		pygame.sprite.Sprite.__init__(self, group)
-		self.image = pygame.image.load("images/bg.png")
+		self.image = ImageRegistry().Load("bg.png")
 		self.rect = self.image.get_rect()
\ No newline at end of file